@@ -1,7 +1,7 @@
 # -*- mode: python ; coding: utf-8 -*-
 from PyInstaller.utils.hooks import collect_all
 
-datas = [('database.py', '.'), ('price_list_window.py', '.'), ('logo.png', '.'), ('logo.ico', '.'), ('format.docx', '.')]
+datas = [('database.py', '.'), ('price_list_window.py', '.'), ('background_search.py', '.'), ('virtual_table.py', '.'), ('records.py', '.'), ('quote_template.py', '.'), ('startup_timer.py', '.'), ('db_metrics.py', '.'), ('catalog_index.py', '.'), ('backup.py', '.'), ('logo.png', '.'), ('logo.ico', '.'), ('format.docx', '.')]
 binaries = []
 hiddenimports = ['tkinter', 'sqlite3', 'docx', 'docx.shared', 'docx.oxml.ns', 'docx.oxml']
 tmp_ret = collect_all('docx')
@@ -0,0 +1,490 @@
+"""
+JSON HTTP API over InventoryDB for the web front-end.
+
+Several browsers in the shop can share one live inventory through this server
+instead of each keeping its own copy in localStorage:
+
+    python api_server.py [--db inventory.db] [--host 127.0.0.1] [--port 8765]
+                         [--workers 4] [--static web] [--profile fast]
+
+Endpoints (table is fans, sheet_metal or flexible):
+    GET    /api/{table}?search=&order_by=&desc=1&limit=100&offset=0
+                            one page: {"items", "total", "limit", "offset", "next_offset"}
+    GET    /api/{table}/{id}
+    POST   /api/{table}          JSON object with the item's fields -> 201 and the item
+    PUT    /api/{table}/{id}     fields to change (others keep their value) -> the item
+    DELETE /api/{table}/{id}     -> 204
+    POST   /api/quote            {"customer", "date", "items": [{"fan_id", "quantity",
+                                 "price_type"}]} -> priced lines and total;
+                                 ?format=docx returns the Word quote instead
+    GET    /api/status           schema version and server details
+
+GET responses carry an ETag that changes when the table changes (for fans,
+also the catalog index their searches match); a request
+with a matching If-None-Match gets 304 Not Modified without touching the
+database. Responses over GZIP_MIN_BYTES are gzip-compressed for clients that
+accept it.
+
+Requests are parsed on the asyncio event loop and handled on a pool of worker
+threads. InventoryDB keeps one connection per thread, so each worker reuses
+its own connection for every request it serves.
+
+There is no login: only bind to a shop network address (--host 0.0.0.0) on a
+network you trust.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import mimetypes
+import os
+import sys
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from database import (InventoryDB, BULK_COLUMNS, BULK_REQUIRED, PRODUCT_TABLES,
+                      SCHEMA_VERSION, SORTABLE_COLUMNS, STORAGE_PROFILES)
+
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 4
+PAGE_SIZE = 100           # Items per page when the client does not ask for a limit
+MAX_PAGE_SIZE = 1000
+MAX_BODY_BYTES = 1 << 20  # Larger request bodies are refused with 413
+MAX_HEADERS = 100
+GZIP_MIN_BYTES = 1024     # Smaller bodies are sent as they are
+GZIP_LEVEL = 6
+KEEP_ALIVE_SECONDS = 15   # Idle connections are closed after this long
+
+STATUS_TEXT = {
+    200: 'OK', 201: 'Created', 204: 'No Content', 304: 'Not Modified',
+    400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    411: 'Length Required', 413: 'Payload Too Large', 431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error', 501: 'Not Implemented',
+}
+DOCX_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# InventoryDB methods per table; the arguments are BULK_COLUMNS[table] by name
+ADD_METHODS = {'fans': 'add_fan', 'sheet_metal': 'add_sheet_metal', 'flexible': 'add_flexible'}
+UPDATE_METHODS = {'fans': 'update_fan', 'sheet_metal': 'update_sheet_metal',
+                  'flexible': 'update_flexible'}
+DELETE_METHODS = {'fans': 'delete_fan', 'sheet_metal': 'delete_sheet_metal',
+                  'flexible': 'delete_flexible'}
+GET_METHODS = {'fans': 'get_fan_by_id', 'sheet_metal': 'get_sheet_metal_by_id',
+               'flexible': 'get_flexible_by_id'}
+# Other tables whose changes show in a table's responses (fan searches match datasheet text)
+ETAG_DEPENDS = {'fans': ('catalog_index',)}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, target, version, headers, body=b''):
+        self.method = method
+        self.version = version
+        self.headers = headers  # Lower-case names
+        self.body = body
+        url = urlsplit(target)
+        self.path = unquote(url.path)
+        self.query = dict(parse_qsl(url.query, keep_blank_values=True))
+    
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+    
+    def json(self):
+        try:
+            return json.loads(self.body.decode('utf-8') or 'null')
+        except (UnicodeDecodeError, ValueError) as e:
+            raise HTTPError(400, f"Invalid JSON body: {e}")
+    
+    def not_modified(self, etag):
+        """Whether the client's If-None-Match already names etag"""
+        tags = [tag.strip() for tag in self.headers.get('if-none-match', '').split(',')]
+        return etag in tags or '*' in tags
+
+
+class Response:
+    def __init__(self, status=200, body=b'', content_type='application/json; charset=utf-8',
+                 headers=None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+    
+    @classmethod
+    def json(cls, data, status=200, etag=None):
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return cls(status, body, headers={'ETag': etag} if etag else None)
+
+
+class InventoryAPI:
+    """Request handlers. handle() runs on a worker thread, with that thread's connection."""
+    
+    def __init__(self, db, static_dir=None, cors_origin='*'):
+        self.db = db
+        self.static_dir = os.path.abspath(static_dir) if static_dir else None
+        self.cors_origin = cors_origin
+        # Table versions restart at 0 with the server; the instance id keeps old ETags from matching
+        self.instance = uuid.uuid4().hex[:8]
+    
+    def handle(self, request):
+        """Route a request and return the encoded Response (gzip, CORS headers)"""
+        try:
+            response = self.route(request)
+        except HTTPError as e:
+            response = Response.json({'error': str(e)}, e.status)
+        except ValueError as e:
+            response = Response.json({'error': str(e)}, 400)
+        except Exception as e:
+            traceback.print_exc()
+            response = Response.json({'error': f"{type(e).__name__}: {e}"}, 500)
+        
+        if self.cors_origin:
+            response.headers.update({
+                'Access-Control-Allow-Origin': self.cors_origin,
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, PATCH, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
+                'Access-Control-Expose-Headers': 'ETag',
+            })
+        if (len(response.body) >= GZIP_MIN_BYTES
+                and 'gzip' in request.headers.get('accept-encoding', '')
+                and response.content_type != DOCX_TYPE):  # Already zip-compressed
+            response.body = gzip.compress(response.body, GZIP_LEVEL)
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    
+    def route(self, request):
+        if request.method == 'OPTIONS':
+            return Response(204)
+        parts = [part for part in request.path.split('/') if part]
+        if not parts or parts[0] != 'api':
+            if request.method != 'GET':
+                raise HTTPError(405, "Method not allowed")
+            return self.static_file(request, parts)
+        
+        resource = parts[1] if len(parts) > 1 else ''
+        if resource == 'status' and len(parts) == 2:
+            self._require(request, 'GET')
+            return Response.json({'schema_version': SCHEMA_VERSION, 'tables': list(PRODUCT_TABLES),
+                                  'instance': self.instance})
+        if resource == 'quote' and len(parts) == 2:
+            self._require(request, 'POST')
+            return self.quote(request)
+        if resource not in PRODUCT_TABLES or len(parts) > 3:
+            raise HTTPError(404, f"Unknown resource: {request.path}")
+        
+        if len(parts) == 2:
+            self._require(request, 'GET', 'POST')
+            if request.method == 'GET':
+                return self.list_items(request, resource)
+            return self.create_item(request, resource)
+        
+        try:
+            item_id = int(parts[2])
+        except ValueError:
+            raise HTTPError(404, f"Invalid id: {parts[2]}")
+        self._require(request, 'GET', 'PUT', 'PATCH', 'DELETE')
+        if request.method == 'GET':
+            return self.get_item(request, resource, item_id)
+        if request.method == 'DELETE':
+            return self.delete_item(resource, item_id)
+        return self.update_item(request, resource, item_id)
+    
+    @staticmethod
+    def _require(request, *methods):
+        if request.method not in methods:
+            raise HTTPError(405, f"{request.method} is not allowed here (use {', '.join(methods)})")
+    
+    def _etag(self, table):
+        versions = '-'.join(str(self.db.table_version(t))
+                            for t in (table,) + ETAG_DEPENDS.get(table, ()))
+        return f'W/"{self.instance}-{table}-{versions}"'
+    
+    # Items
+    
+    def list_items(self, request, table):
+        etag = self._etag(table)
+        if request.not_modified(etag):
+            return Response(304, headers={'ETag': etag})
+        
+        query = request.query
+        search = query.get('search') or None
+        order_by = query.get('order_by', 'id') or None  # Empty: relevance (when searching)
+        if order_by is not None and order_by not in SORTABLE_COLUMNS[table]:
+            raise HTTPError(400, f"order_by must be one of {', '.join(SORTABLE_COLUMNS[table])}")
+        desc = query.get('desc', '') in ('1', 'true', 'yes')
+        try:
+            limit = int(query.get('limit', PAGE_SIZE))
+            offset = int(query.get('offset', 0))
+        except ValueError:
+            raise HTTPError(400, "limit and offset must be integers")
+        # SQLite reads a negative LIMIT as "no limit"
+        if limit < 1 or offset < 0:
+            raise HTTPError(400, "limit must be at least 1 and offset at least 0")
+        limit = min(limit, MAX_PAGE_SIZE)
+        
+        items = self.db.query(table, order_by=order_by, desc=desc, limit=limit, offset=offset,
+                              search=search)
+        total = self.db.count(table, search)
+        next_offset = offset + len(items) if offset + len(items) < total else None
+        return Response.json({
+            'items': [item.to_dict() for item in items],
+            'total': total,
+            'limit': limit,
+            'offset': offset,
+            'next_offset': next_offset,
+        }, etag=etag)
+    
+    def _fetch(self, table, item_id):
+        item = getattr(self.db, GET_METHODS[table])(item_id)
+        if item is None:
+            raise HTTPError(404, f"No {table} item with id {item_id}")
+        return item
+    
+    def get_item(self, request, table, item_id):
+        etag = self._etag(table)
+        if request.not_modified(etag):
+            return Response(304, headers={'ETag': etag})
+        return Response.json(self._fetch(table, item_id).to_dict(), etag=etag)
+    
+    def _fields(self, table, data, current=None):
+        """Validated InventoryDB arguments from a JSON object (merged over current, if given)"""
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Expected a JSON object")
+        unknown = set(data) - set(BULK_COLUMNS[table]) - {'id', 'created_at', 'updated_at'}
+        if unknown:
+            raise HTTPError(400, f"Unknown field(s): {', '.join(sorted(unknown))}")
+        values = {}
+        for column, column_type in BULK_COLUMNS[table].items():
+            value = data[column] if column in data else (current or {}).get(column)
+            if isinstance(value, str):
+                value = value.strip()
+            if value is None or value == '':
+                if column in BULK_REQUIRED[table]:
+                    raise HTTPError(400, f"'{column}' is required")
+                values[column] = 0 if column == 'quantity' else None
+                continue
+            try:
+                values[column] = column_type(float(value)) if column_type is int else column_type(value)
+            except (TypeError, ValueError):
+                raise HTTPError(400, f"Invalid {column} value {value!r}")
+        return values
+    
+    def create_item(self, request, table):
+        values = self._fields(table, request.json())
+        item_id = getattr(self.db, ADD_METHODS[table])(**values)
+        response = Response.json(self._fetch(table, item_id).to_dict(), 201)
+        response.headers['Location'] = f"/api/{table}/{item_id}"
+        return response
+    
+    def update_item(self, request, table, item_id):
+        current = self._fetch(table, item_id)
+        values = self._fields(table, request.json(), current)
+        getattr(self.db, UPDATE_METHODS[table])(item_id, **values)
+        return Response.json(self._fetch(table, item_id).to_dict())
+    
+    def delete_item(self, table, item_id):
+        self._fetch(table, item_id)
+        getattr(self.db, DELETE_METHODS[table])(item_id)
+        return Response(204)
+    
+    # Quotes
+    
+    def quote(self, request):
+        data = request.json()
+        if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+            raise HTTPError(400, "Expected {\"customer\", \"date\", \"items\": [...]}")
+        customer = str(data.get('customer') or '').strip()
+        date_str = str(data.get('date') or '').strip() or datetime.now().strftime("%Y/%m/%d")
+        
+        items, lines, grand_total = [], [], 0
+        for entry in data['items']:
+            try:
+                fan_id = int(entry['fan_id'])
+                quantity = int(entry.get('quantity', 1))
+            except (KeyError, TypeError, ValueError):
+                raise HTTPError(400, "Each item needs an integer fan_id (and quantity)")
+            price_type = entry.get('price_type', 'retail')
+            if price_type not in ('retail', 'wholesale'):
+                raise HTTPError(400, f"price_type must be retail or wholesale, not {price_type!r}")
+            fan = self._fetch('fans', fan_id)
+            unit_price = fan['price_retail'] if price_type == 'retail' else fan['price_wholesale']
+            grand_total += unit_price * quantity
+            items.append({'fan': fan.to_dict(), 'quantity': quantity, 'price_type': price_type})
+            lines.append({'fan_id': fan_id, 'name': fan['name'], 'description': fan['description'],
+                          'airflow': fan['airflow'], 'quantity': quantity, 'price_type': price_type,
+                          'unit_price': unit_price, 'total': unit_price * quantity})
+        
+        if request.query.get('format') != 'docx':
+            return Response.json({'customer': customer, 'date': date_str,
+                                  'items': lines, 'total': grand_total})
+        
+        try:
+            from quote_template import find_template, get_template
+        except ImportError:
+            raise HTTPError(501, "Word quotes require python-docx. Install it with: pip install python-docx")
+        template_path = find_template()
+        if template_path is None:
+            raise HTTPError(501, "No quote template found (template.docx or format.docx)")
+        output = BytesIO()
+        get_template(template_path).render(customer, date_str, items, output)
+        return Response(200, output.getvalue(), DOCX_TYPE,
+                        {'Content-Disposition': 'attachment; filename="quote.docx"'})
+    
+    # Front-end files
+    
+    def static_file(self, request, parts):
+        if self.static_dir is None:
+            raise HTTPError(404, "Not found")
+        path = os.path.abspath(os.path.join(self.static_dir, *parts))
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        # Never serve anything outside the static folder
+        if os.path.commonpath([path, self.static_dir]) != self.static_dir or not os.path.isfile(path):
+            raise HTTPError(404, "Not found")
+        st = os.stat(path)
+        etag = f'W/"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        if request.not_modified(etag):
+            return Response(304, headers={'ETag': etag})
+        with open(path, 'rb') as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+        return Response(200, body, content_type, {'ETag': etag})
+
+
+class APIServer:
+    """asyncio front end: HTTP/1.1 parsing and keep-alive on the loop, handlers on worker threads"""
+    
+    def __init__(self, api, workers=DEFAULT_WORKERS):
+        self.api = api
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api-worker')
+        self.server = None
+    
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+    
+    async def serve_forever(self, host, port):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+    
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.executor.shutdown(wait=True)
+    
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), KEEP_ALIVE_SECONDS)
+                except HTTPError as e:
+                    await self.write_response(writer, Response.json({'error': str(e)}, e.status), False)
+                    break
+                if request is None:
+                    break  # Client closed the connection
+                response = await loop.run_in_executor(self.executor, self.api.handle, request)
+                await self.write_response(writer, response, request.keep_alive)
+                if not request.keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    
+    async def read_request(self, reader):
+        """Next Request on the connection, or None at end of stream"""
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HTTPError(431, "Too many headers")
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        
+        if 'transfer-encoding' in headers:
+            raise HTTPError(411, "Chunked request bodies are not supported; send Content-Length")
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"Request body over {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b''
+        return Request(method.upper(), target, version.upper(), headers, body)
+    
+    async def write_response(self, writer, response, keep_alive):
+        head = [f"HTTP/1.1 {response.status} {STATUS_TEXT.get(response.status, '')}"]
+        headers = dict(response.headers)
+        if response.status not in (204, 304):
+            headers['Content-Type'] = response.content_type
+            headers['Content-Length'] = str(len(response.body))
+        headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        if response.status not in (204, 304):
+            writer.write(response.body)
+        await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the inventory as a JSON API")
+    parser.add_argument('--db', default='inventory.db', help="Database file (default: inventory.db)")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Address to listen on (default: 127.0.0.1; 0.0.0.0 for the shop network)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"Worker threads, each with its own connection (default: {DEFAULT_WORKERS})")
+    parser.add_argument('--profile', default='default', choices=sorted(STORAGE_PROFILES),
+                        help="Storage profile; 'fast' (WAL) lets readers work during writes, "
+                             "but only when the database is on this computer")
+    parser.add_argument('--static', help="Also serve this folder (e.g. web) at /")
+    parser.add_argument('--cors-origin', default='*',
+                        help="Access-Control-Allow-Origin value (default: *; empty to disable)")
+    args = parser.parse_args()
+    
+    db = InventoryDB(args.db, profile=args.profile)
+    server = APIServer(InventoryAPI(db, args.static, args.cors_origin or None), max(1, args.workers))
+    print(f"Serving {args.db} on http://{args.host}:{args.port}/api/ (Ctrl+C to stop)")
+    start = time.monotonic()
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        db.close()
+    print(f"Stopped after {time.monotonic() - start:.0f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Debounced background search for Tk windows.
+
+Typing in a search box triggers a query on every keystroke. BackgroundSearch
+waits until typing pauses, runs the query on a worker thread so the Tk event
+loop never blocks on SQLite, drops queries that were superseded before they
+ran, and hands only the newest result back to the main thread.
+"""
+
+import threading
+import traceback
+import tkinter as tk
+
+
+class BackgroundSearch:
+    def __init__(self, widget, on_result, on_error=None, delay_ms=200, poll_ms=15,
+                 cleanup=None):
+        """
+        widget: any Tk widget, used for after() scheduling on the main thread
+        on_result: called on the main thread with the newest query result
+        on_error: called on the main thread with the exception if the query fails
+        cleanup: called on the worker thread before it exits (e.g. db.release_connection)
+        """
+        self.widget = widget
+        self.on_result = on_result
+        self.on_error = on_error
+        self.delay_ms = delay_ms
+        self.poll_ms = poll_ms
+        self.cleanup = cleanup
+        
+        self._generation = 0      # Bumped for every submit/cancel; older results are stale
+        self._debounce_id = None  # Pending after() that will start the query
+        self._poll_id = None      # Pending after() that checks for a finished query
+        self._waiting_for = None  # Generation whose result the main thread expects
+        
+        # Worker state (guarded by _cond): only the newest job is kept
+        self._cond = threading.Condition()
+        self._job = None          # (generation, query) waiting to run
+        self._done = None         # (generation, result, error) waiting to be delivered
+        self._closed = False
+        
+        self._worker = threading.Thread(target=self._run, name="BackgroundSearch", daemon=True)
+        self._worker.start()
+    
+    def submit(self, query, delay_ms=None):
+        """Schedule query (a callable run on the worker thread) after the debounce delay"""
+        self.cancel()
+        generation = self._generation
+        delay = self.delay_ms if delay_ms is None else delay_ms
+        self._debounce_id = self.widget.after(delay, lambda: self._start(generation, query))
+    
+    def cancel(self):
+        """Forget any pending or running query; its result will never be delivered"""
+        self._generation += 1
+        if self._debounce_id is not None:
+            self._cancel_after(self._debounce_id)
+            self._debounce_id = None
+        with self._cond:
+            self._job = None
+    
+    def close(self):
+        """Stop the worker thread"""
+        self.cancel()
+        if self._poll_id is not None:
+            self._cancel_after(self._poll_id)
+            self._poll_id = None
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+    
+    def _cancel_after(self, after_id):
+        try:
+            self.widget.after_cancel(after_id)
+        except tk.TclError:
+            pass  # Widget already destroyed
+    
+    def _start(self, generation, query):
+        """Debounce delay elapsed: hand the query to the worker (main thread)"""
+        self._debounce_id = None
+        if generation != self._generation:
+            return
+        with self._cond:
+            self._job = (generation, query)
+            self._cond.notify()
+        self._waiting_for = generation
+        if self._poll_id is None:
+            self._poll_id = self.widget.after(self.poll_ms, self._poll)
+    
+    def _poll(self):
+        """Deliver a finished result if it is still current (main thread)"""
+        self._poll_id = None
+        with self._cond:
+            done, self._done = self._done, None
+        
+        if done is not None and done[0] == self._generation:
+            _, result, error = done
+            self._waiting_for = None
+            if error is None:
+                self.on_result(result)
+            elif self.on_error is not None:
+                self.on_error(error)
+            else:
+                traceback.print_exception(type(error), error, error.__traceback__)
+            return
+        
+        # Keep polling until the current query finishes (stop once it is cancelled)
+        if self._waiting_for == self._generation:
+            try:
+                self._poll_id = self.widget.after(self.poll_ms, self._poll)
+            except tk.TclError:
+                pass  # Widget destroyed while a query was running
+    
+    def _run(self):
+        """Worker thread: run the newest job, skipping any that were superseded"""
+        try:
+            while True:
+                with self._cond:
+                    while self._job is None and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    generation, query = self._job
+                    self._job = None
+                
+                result = error = None
+                try:
+                    result = query()
+                except Exception as e:
+                    error = e
+                
+                with self._cond:
+                    self._done = (generation, result, error)
+        finally:
+            if self.cleanup is not None:
+                self.cleanup()
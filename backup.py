@@ -0,0 +1,381 @@
+"""
+Online backups of inventory.db.
+
+Snapshots are taken with SQLite's online backup API on a background thread,
+a few hundred pages at a time with pauses between steps (or in one pass in
+WAL mode, where readers never block writers), so the application keeps
+reading and saving while a large database is copied. An edit makes the copy
+start again; after a few restarts the database is copied in one pass if that
+locks the edits out only briefly (SINGLE_PASS_LIMIT), and otherwise the
+snapshot is put off and tried again later. Each snapshot is written to a temporary file,
+checked with PRAGMA integrity_check, and only then renamed to
+backups/inventory-YYYYMMDD-HHMMSS.db; the oldest snapshots beyond the
+retention count are deleted.
+
+The application takes a snapshot in the background shortly after startup and
+then every few hours, skipping it when the database has not changed since the
+last one (see BackupScheduler); snapshots that keep failing are reported to
+the user. By hand:
+
+    python backup.py backup                   # snapshot now
+    python backup.py list                     # snapshots, newest first
+    python backup.py verify <snapshot>        # integrity check
+    python backup.py restore <snapshot>       # close the application first
+
+Restoring checks the snapshot, saves the current database as one more
+snapshot, then copies the snapshot over it.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+
+BACKUP_DIR = "backups"  # Next to the database file
+BACKUP_KEEP = 14  # Snapshots kept; older ones are deleted
+BACKUP_INTERVAL = 4 * 60 * 60  # Seconds between scheduled snapshots
+BACKUP_DELAY = 60  # Seconds after startup before the first one
+STEP_PAGES = 256  # Pages copied per step (1MB with 4KB pages)
+STEP_PAUSE = 0.005  # Seconds between steps, so writers can get the lock
+MAX_RESTARTS = 8  # Restarts by edits before the copy is finished in one pass or put off
+SINGLE_PASS_LIMIT = 2.0  # Longest estimated one-pass copy (seconds); writers wait up to BUSY_TIMEOUT
+RESTART_BACKOFF = 0.5  # Seconds to wait after the first restart, doubled after each
+MAX_BACKOFF = 30
+BACKUP_RETRY = 10 * 60  # Seconds before a snapshot put off by edits is tried again
+BUSY_TIMEOUT = 5000
+SNAPSHOT_PREFIX = "inventory-"
+SNAPSHOT_SUFFIX = ".db"
+
+
+class BackupStopped(Exception):
+    """A snapshot was abandoned because stop() was called"""
+
+
+class BackupBusy(RuntimeError):
+    """The database kept being edited during the copy; try again later"""
+
+
+class _SinglePass(Exception):
+    """Restarts ran out, but the database is small enough to copy in one pass"""
+
+
+def backup_dir(db_path):
+    """The backups folder of a database"""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), BACKUP_DIR)
+
+
+def list_snapshots(directory):
+    """Snapshot paths in directory, newest first"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    names = [name for name in names
+             if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)]
+    # The timestamp in the name sorts chronologically
+    return [os.path.join(directory, name) for name in sorted(names, reverse=True)]
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT}')
+    return conn
+
+
+def copy_database(source_path, target_path, pages=STEP_PAGES, pause=STEP_PAUSE,
+                  progress=None, stop=None):
+    """
+    Copy a live database with the online backup API without holding up its writers.
+    
+    In WAL mode the copy reads one consistent version of the database while
+    writers carry on in the WAL, so it is made in a single pass. Otherwise it
+    is copied pages at a time, so an edit never waits longer than one step.
+    A commit by another connection between two steps makes SQLite start again;
+    each restart first waits for the edits to stop (RESTART_BACKOFF, doubled
+    every time). After MAX_RESTARTS the whole database is copied in one pass,
+    which holds the edits back until it is done, if the speed of the steps so
+    far says that takes at most SINGLE_PASS_LIMIT seconds; a larger database
+    is not copied (BackupBusy).
+    progress(copied, total) is called after each step; setting the stop Event
+    abandons the copy (BackupStopped) before the next step. Returns the number
+    of restarts.
+    """
+    state = {'remaining': None, 'restarts': 0, 'steps': 0, 'copying': 0.0,
+             'resumed': time.perf_counter()}
+    
+    def wait(seconds):
+        if stop is None:
+            time.sleep(seconds)
+        elif stop.wait(seconds):
+            raise BackupStopped()
+    
+    def step(status, remaining, total):
+        # Time spent copying, without the pauses and waits in here
+        state['copying'] += time.perf_counter() - state['resumed']
+        state['steps'] += 1
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > MAX_RESTARTS:
+                estimate = total * state['copying'] / (state['steps'] * pages)
+                if estimate <= SINGLE_PASS_LIMIT:
+                    raise _SinglePass()
+                raise BackupBusy(f"The database was edited throughout the copy "
+                                 f"(restarted {MAX_RESTARTS} times), and copying it "
+                                 f"in one pass would hold edits back for about {estimate:.0f}s")
+            # Let a burst of edits finish rather than copy pages they will change again
+            wait(min(RESTART_BACKOFF * 2 ** (state['restarts'] - 1), MAX_BACKOFF))
+        state['remaining'] = remaining
+        if progress:
+            progress(total - remaining, total)
+        # Between steps the source is not locked: edits go through here
+        wait(pause)
+        state['resumed'] = time.perf_counter()
+    
+    source = _connect(source_path)
+    try:
+        target = _connect(target_path)
+        try:
+            wal = source.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
+            try:
+                source.backup(target, pages=-1 if wal else pages, progress=step)
+            except _SinglePass:
+                source.backup(target, pages=-1)
+            # A copy of a WAL database is in WAL mode too; make it a single file
+            target.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return state['restarts']
+
+
+def verify_snapshot(path):
+    """Problems found by PRAGMA integrity_check (an empty list if the file is sound)"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    finally:
+        conn.close()
+    return [] if rows == ['ok'] else rows
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def take_snapshot(db_path, directory=None, keep=BACKUP_KEEP, progress=None, stop=None):
+    """
+    Back up db_path into directory (default: its backups folder), verify the copy
+    and delete the snapshots beyond the newest keep (None: delete none).
+    Returns (snapshot path, restarts); raises BackupBusy if edits kept
+    interrupting the copy and RuntimeError if the copy fails its integrity check.
+    """
+    directory = directory or backup_dir(db_path)
+    os.makedirs(directory, exist_ok=True)
+    started = time.time()
+    stamp = datetime.fromtimestamp(started).strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(directory, f"{SNAPSHOT_PREFIX}{stamp}{SNAPSHOT_SUFFIX}")
+    partial = path + '.part'
+    
+    try:
+        restarts = copy_database(db_path, partial, progress=progress, stop=stop)
+        problems = verify_snapshot(partial)
+        if problems:
+            raise RuntimeError(f"Backup failed its integrity check: {'; '.join(problems[:5])}")
+    except BaseException:
+        _remove(partial)
+        raise
+    os.replace(partial, path)
+    # Dated to the start of the copy, so a change made during it is seen as newer
+    os.utime(path, (started, started))
+    
+    if keep is not None:
+        for old in list_snapshots(directory)[max(keep, 1):]:
+            _remove(old)
+    return path, restarts
+
+
+def changed_since_snapshot(db_path, directory=None):
+    """Whether the database (or its WAL) was written after the newest snapshot began"""
+    snapshots = list_snapshots(directory or backup_dir(db_path))
+    if not snapshots:
+        return True
+    try:
+        taken = os.stat(snapshots[0]).st_mtime
+    except OSError:
+        return True
+    for path in (db_path, db_path + '-wal'):
+        try:
+            if os.stat(path).st_mtime >= taken:
+                return True
+        except OSError:
+            pass
+    return False
+
+
+def restore_snapshot(snapshot_path, db_path, directory=None):
+    """
+    Replace the contents of db_path with a snapshot. The current database is
+    snapshotted first; returns that snapshot's path. No other program may have
+    the database open.
+    """
+    problems = verify_snapshot(snapshot_path)
+    if problems:
+        raise RuntimeError(f"{snapshot_path} failed its integrity check: {'; '.join(problems[:5])}")
+    saved = None
+    if os.path.exists(db_path):
+        # Without rotation, so the snapshot being restored cannot be deleted
+        saved, _ = take_snapshot(db_path, directory, keep=None)
+    # Through the backup API rather than a file copy, so a WAL or journal stays consistent
+    source = _connect(snapshot_path)
+    try:
+        target = _connect(db_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return saved
+
+
+class BackupScheduler:
+    """Takes a snapshot on a daemon thread every interval seconds (if anything changed)"""
+    
+    def __init__(self, db_path, directory=None, interval=BACKUP_INTERVAL, keep=BACKUP_KEEP):
+        self.db_path = db_path
+        self.directory = directory or backup_dir(db_path)
+        self.interval = interval
+        self.keep = keep
+        self.last_error = None
+        self.failing_since = None  # time.time() of the first failure since the last snapshot
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def run_once(self, force=False):
+        """Snapshot path, or None when the database has not changed since the last one"""
+        if not force and not changed_since_snapshot(self.db_path, self.directory):
+            return None
+        path, _ = take_snapshot(self.db_path, self.directory, self.keep, stop=self._stop)
+        return path
+    
+    def start(self, delay=BACKUP_DELAY):
+        """Start the schedule; the first snapshot is taken after delay seconds"""
+        # Copies left behind when the application was closed during a snapshot
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        for name in names:
+            if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX + '.part'):
+                _remove(os.path.join(self.directory, name))
+        
+        def work():
+            wait = delay
+            while not self._stop.wait(wait):
+                wait = self.interval
+                try:
+                    self.run_once()
+                    self.last_error = self.failing_since = None
+                except BackupStopped:
+                    return
+                except BackupBusy as e:
+                    self._failed(e)
+                    wait = min(BACKUP_RETRY, self.interval)
+                except Exception as e:
+                    self._failed(e)
+                    traceback.print_exc()
+        
+        self._stop.clear()
+        self._thread = threading.Thread(target=work, name="backup-scheduler", daemon=True)
+        self._thread.start()
+        return self._thread
+    
+    def _failed(self, error):
+        self.last_error = error
+        if self.failing_since is None:
+            self.failing_since = time.time()
+    
+    def failure(self):
+        """
+        The error to tell the user about, or None. A snapshot put off by edits
+        counts once it has been put off for a whole interval; other failures
+        count at once.
+        """
+        # Written by the scheduler thread: read each once
+        error, since = self.last_error, self.failing_since
+        if error is None or since is None:
+            return None
+        if isinstance(error, BackupBusy) and time.time() - since < self.interval:
+            return None
+        return error
+    
+    def stop(self, timeout=None):
+        """Stop the schedule; a snapshot being copied is abandoned after the current step"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up and restore the inventory database")
+    parser.add_argument('--db', default='inventory.db', help="Database file (default: inventory.db)")
+    parser.add_argument('--dir', help=f"Snapshot folder (default: {BACKUP_DIR} next to the database)")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    
+    backup = commands.add_parser('backup', help="Take a snapshot now")
+    backup.add_argument('--keep', type=int, default=BACKUP_KEEP,
+                        help=f"Snapshots to keep (default: {BACKUP_KEEP})")
+    commands.add_parser('list', help="List the snapshots, newest first")
+    verify = commands.add_parser('verify', help="Run an integrity check on a snapshot")
+    verify.add_argument('snapshot')
+    restore = commands.add_parser('restore', help="Replace the database with a snapshot")
+    restore.add_argument('snapshot')
+    args = parser.parse_args()
+    directory = args.dir or backup_dir(args.db)
+    
+    try:
+        if args.command == 'backup':
+            if not os.path.exists(args.db):
+                print(f"Error: {args.db} not found")
+                return 1
+            
+            def progress(done, total):
+                print(f"\r   {done}/{total} pages", end='', flush=True)
+            
+            start = time.perf_counter()
+            path, restarts = take_snapshot(args.db, directory, args.keep, progress)
+            print()
+            print(f"Wrote {path} in {time.perf_counter() - start:.1f}s"
+                  + (f" (restarted {restarts} times by edits)" if restarts else ""))
+        elif args.command == 'list':
+            for path in list_snapshots(directory):
+                size = os.path.getsize(path) / (1024 * 1024)
+                print(f"{os.path.basename(path)}  {size:8.1f} MB")
+        elif args.command == 'verify':
+            problems = verify_snapshot(args.snapshot)
+            print("ok" if not problems else "\n".join(problems))
+            return 1 if problems else 0
+        elif args.command == 'restore':
+            saved = restore_snapshot(args.snapshot, args.db, directory)
+            if saved:
+                print(f"Saved the previous database as {saved}")
+            print(f"Restored {args.db} from {args.snapshot}")
+    except (OSError, sqlite3.Error, RuntimeError) as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
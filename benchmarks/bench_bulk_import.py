@@ -0,0 +1,98 @@
+"""
+Benchmark: bulk import into inventory.db
+Compares loading a supplier price sheet row by row (add_fan) with
+InventoryDB.bulk_upsert_fans, for both new items and re-imported ones.
+
+Usage:
+    python benchmarks/bench_bulk_import.py [--rows 100000] [--profile fast] [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import InventoryDB, STORAGE_PROFILES, BULK_CHUNK_SIZE
+
+
+def price_sheet(rows, price_offset=0):
+    """Synthetic supplier rows as they come out of csv.DictReader (all strings)"""
+    for i in range(rows):
+        yield {
+            'name': f"FAN-{i:07d}",
+            'description': f"Axial fan model {i}",
+            'airflow': f"{500 + i % 5000} m3/h",
+            'price_wholesale': str(10 + (i + price_offset) % 300),
+            'price_retail': str(15 + (i + price_offset) % 400),
+            'quantity': str(i % 50),
+        }
+
+
+def rows_per_sec(func, rows):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    return rows / elapsed if elapsed else float('inf')
+
+
+def fresh_db(tmp_dir, name, profile):
+    return InventoryDB(os.path.join(tmp_dir, name), profile=profile)
+
+
+def run(rows, loop_rows, profile, chunk_size):
+    tmp_dir = tempfile.mkdtemp(prefix="rabah_bench_")
+    result = {'rows': rows, 'profile': profile, 'chunk_size': chunk_size}
+    try:
+        db = fresh_db(tmp_dir, "loop.db", profile)
+
+        def loop():
+            for row in price_sheet(loop_rows):
+                db.add_fan(row['name'], row['description'], row['airflow'],
+                           float(row['price_wholesale']), float(row['price_retail']),
+                           int(row['quantity']))
+        result['add_fan_loop_rows_per_sec'] = rows_per_sec(loop, loop_rows)
+        db.close()
+
+        db = fresh_db(tmp_dir, "bulk.db", profile)
+        result['bulk_insert_rows_per_sec'] = rows_per_sec(
+            lambda: db.bulk_upsert_fans(price_sheet(rows), chunk_size=chunk_size), rows)
+        result['bulk_update_rows_per_sec'] = rows_per_sec(
+            lambda: db.bulk_upsert_fans(price_sheet(rows, 7), chunk_size=chunk_size), rows)
+        result['bulk_skip_rows_per_sec'] = rows_per_sec(
+            lambda: db.bulk_upsert_fans(price_sheet(rows), chunk_size=chunk_size,
+                                        on_conflict='skip'), rows)
+        db.close()
+        return result
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark InventoryDB bulk imports")
+    parser.add_argument('--rows', type=int, default=100000, help="rows in the price sheet")
+    parser.add_argument('--loop-rows', type=int, default=2000,
+                        help="rows inserted one add_fan call at a time")
+    parser.add_argument('--profile', choices=sorted(STORAGE_PROFILES), default='default')
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    parser.add_argument('--json', help="write results to this JSON file")
+    args = parser.parse_args()
+
+    result = run(args.rows, args.loop_rows, args.profile, args.chunk_size)
+    baseline = result['add_fan_loop_rows_per_sec']
+    for metric, value in result.items():
+        if metric.endswith('_per_sec'):
+            print(f"{metric:<28}{value:>14,.0f}{value / baseline:>9.1f}x")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
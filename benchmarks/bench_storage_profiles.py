@@ -0,0 +1,116 @@
+"""
+Benchmark: storage profiles for inventory.db
+Compares the "default" (rollback journal) and "fast" (WAL + tuned PRAGMAs)
+profiles of InventoryDB on a synthetic fans table.
+
+Usage:
+    python benchmarks/bench_storage_profiles.py [--rows 100000] [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import InventoryDB, STORAGE_PROFILES
+
+
+def populate_fans(db, rows):
+    """Fill the fans table with synthetic rows in one transaction"""
+    with db.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO fans (name, description, airflow, price_wholesale, price_retail, quantity)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', ((f"FAN-{i:06d}", f"Axial fan model {i}", f"{500 + i % 5000} m3/h",
+               10 + i % 300, 15 + i % 400, i % 50) for i in range(rows)))
+
+
+def timed(func, iterations):
+    """Run func iterations times and return operations per second"""
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(i)
+    elapsed = time.perf_counter() - start
+    return iterations / elapsed if elapsed else float('inf')
+
+
+def concurrent_reads(db, rows, duration):
+    """Count point reads completed by a reader thread while the main thread writes"""
+    stop = threading.Event()
+    reads = [0]
+    
+    def reader():
+        rng = random.Random(1)
+        while not stop.is_set():
+            db.get_fan_by_id(rng.randint(1, rows))
+            reads[0] += 1
+    
+    thread = threading.Thread(target=reader)
+    thread.start()
+    writes = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        db.update_quantity(1 + writes % rows, 1)
+        writes += 1
+    stop.set()
+    thread.join()
+    return reads[0] / duration, writes / duration
+
+
+def run_profile(profile, rows, writes, reads):
+    """Benchmark one storage profile on a fresh database"""
+    tmp_dir = tempfile.mkdtemp(prefix="rabah_bench_")
+    db_path = os.path.join(tmp_dir, "inventory.db")
+    db = InventoryDB(db_path, profile=profile)
+    try:
+        populate_fans(db, rows)
+        rng = random.Random(0)
+        ids = [rng.randint(1, rows) for _ in range(reads)]
+        
+        result = {'profile': profile, 'rows': rows}
+        result['single_row_writes_per_sec'] = timed(
+            lambda i: db.add_fan(f"NEW-{i}", None, None, 1.0, 2.0, 1), writes)
+        result['point_reads_per_sec'] = timed(lambda i: db.get_fan_by_id(ids[i]), reads)
+        result['searches_per_sec'] = timed(lambda i: db.search_fans(f"FAN-0{i % 10}"), 5)
+        result['full_scans_per_sec'] = timed(lambda i: db.get_all_fans(), 3)
+        (result['concurrent_reads_per_sec'],
+         result['concurrent_writes_per_sec']) = concurrent_reads(db, rows, 2.0)
+        return result
+    finally:
+        db.close()
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare InventoryDB storage profiles")
+    parser.add_argument('--rows', type=int, default=100000, help="rows in the fans table")
+    parser.add_argument('--writes', type=int, default=2000, help="single-row commits to time")
+    parser.add_argument('--reads', type=int, default=20000, help="point reads to time")
+    parser.add_argument('--json', help="write results to this JSON file")
+    args = parser.parse_args()
+    
+    results = [run_profile(profile, args.rows, args.writes, args.reads)
+               for profile in STORAGE_PROFILES]
+    
+    metrics = [key for key in results[0] if key.endswith('_per_sec')]
+    print(f"{'metric':<28}" + ''.join(f"{r['profile']:>14}" for r in results) + f"{'gain':>10}")
+    for metric in metrics:
+        values = [r[metric] for r in results]
+        gain = values[-1] / values[0] if values[0] else float('inf')
+        print(f"{metric:<28}" + ''.join(f"{v:>14.1f}" for v in values) + f"{gain:>9.2f}x")
+    
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+"""
+Benchmark suite: InventoryDB, the main table and Word quote export
+Generates synthetic inventories (1k / 100k / 1M fans by default) and times the
+InventoryDB read/write/search methods, bulk repricing (checked against its time
+budget), FanInventoryApp.refresh_table on a headless Treeview, and quote
+rendering. Results are written as JSON so two commits can be compared:
+
+Usage:
+    python benchmarks/bench_suite.py --json before.json
+    (change something)
+    python benchmarks/bench_suite.py --json after.json --compare before.json
+
+    python benchmarks/bench_suite.py --sizes 1k,100k --data-dir bench_data   # keep/reuse databases
+
+Every timing is reported as the median and 95th percentile in milliseconds.
+The Treeview is a real ttk.Treeview in a withdrawn root when a display is
+available (--tk real), otherwise a stub with the same interface (--tk stub);
+--tk auto picks whichever works. The mode used is recorded in the results.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database import InventoryDB, STORAGE_PROFILES
+
+SIZES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+SEARCH_TERMS = ('FAN-0000123', 'axial', 'model 42', '750 m3')
+REPRICE_ITEMS = 50000  # Fans changed by one bulk repricing (half the fans of smaller inventories)
+REPRICE_TARGET_MS = 1000  # Budget for repricing REPRICE_ITEMS fans
+
+
+def parse_sizes(text):
+    sizes = []
+    for name in text.lower().split(','):
+        name = name.strip()
+        if name not in SIZES:
+            raise argparse.ArgumentTypeError(f"unknown size {name!r} (choose from {', '.join(SIZES)})")
+        sizes.append(name)
+    return sizes
+
+
+def fan_rows(rows):
+    """Synthetic fans as a supplier price sheet would give them"""
+    for i in range(rows):
+        yield {
+            'name': f"FAN-{i:07d}",
+            'description': f"Axial fan model {i % 1000}",
+            'airflow': f"{500 + i % 5000} m3/h",
+            'price_wholesale': 10 + i % 300,
+            'price_retail': 15 + i % 400,
+            'quantity': i % 50,
+        }
+
+
+def generate_inventory(path, rows, profile):
+    """Create inventory.db at path with rows fans (plus 1/10 as many sheet metal and flexible
+    rows), or reuse it if it already has that many fans"""
+    if os.path.exists(path):
+        db = InventoryDB(path, profile=profile)
+        if db.count('fans') == rows:
+            return db, 0.0
+        db.close()
+        os.remove(path)
+
+    db = InventoryDB(path, profile=profile)
+    start = time.perf_counter()
+    db.bulk_upsert_fans(fan_rows(rows))
+    db.bulk_upsert_sheet_metal({'thickness': str(i % 10), 'dimensions': f"{i % 97}x{i % 89}",
+                                'measurement': str(i), 'cost': i % 500, 'quantity': i % 20}
+                               for i in range(max(1, rows // 10)))
+    db.bulk_upsert_flexible({'description': f"Flexible {i}", 'diameter': str(100 + i % 20 * 25),
+                             'collection': str(i % 7), 'meter': i % 300}
+                            for i in range(max(1, rows // 10)))
+    return db, time.perf_counter() - start
+
+
+def measure(func, iterations):
+    """Call func(i) iterations times; returns {'median_ms', 'p95_ms', 'iterations'}"""
+    times = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        'median_ms': times[len(times) // 2] * 1000,
+        'p95_ms': times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+        'iterations': iterations,
+    }
+
+
+def bench_database(db, rows, iterations):
+    """Time the InventoryDB methods the GUI calls"""
+    rng = random.Random(42)
+    ids = [rng.randint(1, rows) for _ in range(iterations)]
+    results = {}
+
+    def uncached(i):
+        db.clear_row_cache()
+        db.get_fan_by_id(ids[i])
+    results['get_fan_by_id'] = measure(uncached, iterations)
+    db.get_fan_by_id(ids[0])
+    results['get_fan_by_id_cached'] = measure(lambda i: db.get_fan_by_id(ids[0]), iterations)
+
+    for term in SEARCH_TERMS:
+        key = term.replace(' ', '_').lower()
+        results[f'search_fans[{key}]'] = measure(
+            lambda i: db.search_fans(term, limit=200), max(1, iterations // 4))
+        results[f'count[{key}]'] = measure(
+            lambda i: db.count('fans', term), max(1, iterations // 4))
+
+    results['query_first_page_by_name'] = measure(
+        lambda i: db.query('fans', order_by='name', limit=200), iterations // 4 or 1)
+    results['query_middle_page_by_price'] = measure(
+        lambda i: db.query('fans', order_by='price_retail', limit=200, offset=rows // 2),
+        iterations // 4 or 1)
+
+    added = []
+    results['add_fan'] = measure(
+        lambda i: added.append(db.add_fan(f"BENCH-{i}", "bench", "100 m3/h", 1.0, 2.0, 5)),
+        iterations)
+    results['update_fan'] = measure(
+        lambda i: db.update_fan(added[i], f"BENCH-{i}", "bench updated", "120 m3/h", 1.5, 2.5, 6),
+        iterations)
+    results['update_quantity'] = measure(lambda i: db.update_quantity(added[i], -1), iterations)
+    results['delete_fan'] = measure(lambda i: db.delete_fan(added[i]), iterations)
+    return results
+
+
+def bench_reprice(db, rows, iterations):
+    """Time InventoryDB.reprice on every other fan: the preview and the change itself.
+
+    Prices go up 10% and back down on alternate runs, so every run changes every item.
+    Warns when changing REPRICE_ITEMS fans takes longer than REPRICE_TARGET_MS.
+    """
+    items = min(REPRICE_ITEMS, rows // 2)
+    ids = list(range(1, 2 * items, 2))
+    runs = max(1, iterations // 40)
+    percents = (10.0, -100.0 / 11)
+    results = {
+        'reprice_preview': measure(
+            lambda i: db.reprice('fans', percent=percents[i % 2], item_ids=ids, dry_run=True), runs),
+        'reprice_apply': measure(
+            lambda i: db.reprice('fans', percent=percents[i % 2], item_ids=ids), runs),
+    }
+    if items == REPRICE_ITEMS:
+        median = results['reprice_apply']['median_ms']
+        results['reprice_within_target'] = median <= REPRICE_TARGET_MS
+        if median > REPRICE_TARGET_MS:
+            print(f"   WARNING: repricing {items:,} fans took {median:.0f} ms "
+                  f"(target {REPRICE_TARGET_MS} ms)", flush=True)
+    return results
+
+
+class StubTree:
+    """The parts of ttk.Treeview that VirtualTreeview uses, without Tk"""
+
+    def __init__(self, height=25):
+        self.height = height
+        self.rows = []
+        self.values = {}
+        self.selected = ()
+
+    def configure(self, **options):
+        pass
+
+    def bind(self, *args, **kwargs):
+        pass
+
+    def cget(self, option):
+        return self.height
+
+    def winfo_height(self):
+        return self.height * 20
+
+    def get_children(self):
+        return tuple(self.rows)
+
+    def insert(self, parent, index, iid, values):
+        self.rows.insert(index if index != 'end' else len(self.rows), iid)
+        self.values[iid] = values
+
+    def delete(self, *iids):
+        for iid in iids:
+            self.rows.remove(iid)
+            del self.values[iid]
+
+    def move(self, iid, parent, index):
+        self.rows.remove(iid)
+        self.rows.insert(index, iid)
+
+    def item(self, iid, values=None):
+        self.values[iid] = values
+
+    def selection(self):
+        return self.selected
+
+    def selection_set(self, iids):
+        self.selected = tuple(iids)
+
+    def see(self, iid):
+        pass
+
+    def yview_moveto(self, fraction):
+        pass
+
+    def after_idle(self, func):
+        return None
+
+    def after_cancel(self, after_id):
+        pass
+
+
+class StubScrollbar:
+    def configure(self, **options):
+        pass
+
+    def set(self, first, last):
+        pass
+
+
+class StubVar:
+    def __init__(self, value=''):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class StubSearch:
+    def cancel(self):
+        pass
+
+
+def make_table(mode):
+    """(tree, scrollbar, table class, mode used, cleanup) for the requested --tk mode"""
+    from virtual_table import VirtualTreeview
+    if mode in ('auto', 'real'):
+        import tkinter as tk
+        from tkinter import ttk
+        try:
+            root = tk.Tk()
+        except tk.TclError:
+            if mode == 'real':
+                raise
+        else:
+            root.withdraw()
+            tree = ttk.Treeview(root, show='headings', height=25,
+                                columns=("Quantity", "Retail", "Wholesale", "Airflow", "Name"))
+            scrollbar = ttk.Scrollbar(root, orient=tk.VERTICAL)
+            return tree, scrollbar, VirtualTreeview, 'real', root.destroy
+
+    class StubVirtualTreeview(VirtualTreeview):
+        def _visible_rows(self):
+            return self.tree.height
+
+    return StubTree(), StubScrollbar(), StubVirtualTreeview, 'stub', lambda: None
+
+
+def bench_main_table(db, rows, iterations, tk_mode):
+    """Time FanInventoryApp.refresh_table (count + first page + render) and scrolling"""
+    import main
+    tree, scrollbar, table_class, used_mode, cleanup = make_table(tk_mode)
+    try:
+        app = main.FanInventoryApp.__new__(main.FanInventoryApp)
+        app.db = db
+        app.tree = tree
+        app.table = table_class(tree, scrollbar, app.format_row)
+        app.search = StubSearch()
+        app.search_var = StubVar()
+        app.current_product_type = 'fans'
+        app.sort_column = 'name'
+        app.sort_reverse = False
+
+        results = {'tk_mode': used_mode}
+        results['refresh_table'] = measure(lambda i: app.refresh_table(), iterations // 4 or 1)
+        app.search_var.set('axial')
+        results['refresh_table[search]'] = measure(lambda i: app.refresh_table(), iterations // 4 or 1)
+        app.search_var.set('')
+        app.refresh_table()
+
+        rng = random.Random(7)
+        positions = [rng.random() for _ in range(iterations)]
+        results['scroll_moveto'] = measure(lambda i: app.table.yview('moveto', positions[i]), iterations)
+        return results
+    finally:
+        cleanup()
+
+
+def bench_quote_export(data_dir, iterations):
+    """Time quote rendering for a small and a large price list"""
+    try:
+        from quote_template import find_template, get_template
+        from docx import Document
+    except ImportError:
+        return {'skipped': "python-docx is not installed"}
+
+    template_path = find_template([ROOT])
+    if template_path is None:
+        # A stand-in with placeholders, some text and a product table
+        template_path = os.path.join(data_dir, 'bench_template.docx')
+        document = Document()
+        document.add_paragraph("العميل: {CUSTOMER_NAME}")
+        document.add_paragraph("التاريخ: {DATE}")
+        for i in range(20):
+            document.add_paragraph(f"شرط رقم {i} " * 8)
+        document.add_table(rows=2, cols=4)
+        document.save(template_path)
+
+    results = {'template': os.path.basename(template_path)}
+    start = time.perf_counter()
+    template = get_template(template_path)
+    results['compile_ms'] = (time.perf_counter() - start) * 1000
+
+    output = os.path.join(data_dir, 'bench_quote.docx')
+    for items_count in (20, 200):
+        items = [{'fan': {'name': f"FAN-{i}", 'description': f"Axial fan model {i}",
+                          'airflow': "750 m3/h", 'price_retail': 100.0 + i, 'price_wholesale': 80.0 + i},
+                  'quantity': 1 + i % 5, 'price_type': 'retail'} for i in range(items_count)]
+        results[f'render[{items_count}_items]'] = measure(
+            lambda i: template.render("عميل", "2025/01/01", items, output), max(1, iterations // 4))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Print median times next to a previous run's, with the ratio (>1 means slower now)"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    print(f"{'benchmark':<52}{'before':>10}{'after':>10}{'ratio':>8}")
+    for section, metrics in results['results'].items():
+        old_metrics = baseline['results'].get(section, {})
+        for name, value in metrics.items():
+            old = old_metrics.get(name)
+            if not isinstance(value, dict) or not isinstance(old, dict):
+                continue
+            before, after = old['median_ms'], value['median_ms']
+            ratio = after / before if before else float('inf')
+            print(f"{section + ' ' + name:<52}{before:>10.3f}{after:>10.3f}{ratio:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite for the inventory application")
+    parser.add_argument('--sizes', type=parse_sizes, default=parse_sizes('1k,100k,1m'),
+                        help="comma-separated inventory sizes: 1k, 10k, 100k, 1m (default: 1k,100k,1m)")
+    parser.add_argument('--iterations', type=int, default=200, help="calls per timed method")
+    parser.add_argument('--profile', choices=sorted(STORAGE_PROFILES), default='default')
+    parser.add_argument('--tk', choices=('auto', 'real', 'stub'), default='auto',
+                        help="Treeview for the table benchmarks (default: auto)")
+    parser.add_argument('--data-dir', help="keep generated databases here and reuse them "
+                                           "(default: a temporary folder, removed afterwards)")
+    parser.add_argument('--json', help="write results to this JSON file")
+    parser.add_argument('--compare', help="JSON file from an earlier run to compare against")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="rabah_bench_")
+    os.makedirs(data_dir, exist_ok=True)
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'profile': args.profile,
+            'iterations': args.iterations,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'results': {},
+    }
+    try:
+        for size in args.sizes:
+            rows = SIZES[size]
+            size_dir = os.path.join(data_dir, size)
+            os.makedirs(size_dir, exist_ok=True)
+            print(f"[{size}] generating inventory ({rows:,} fans)...", flush=True)
+            db, seconds = generate_inventory(os.path.join(size_dir, 'inventory.db'), rows, args.profile)
+            try:
+                section = {'generate_s': seconds}
+                print(f"[{size}] InventoryDB methods...", flush=True)
+                section.update(bench_database(db, rows, args.iterations))
+                print(f"[{size}] bulk repricing...", flush=True)
+                section.update(bench_reprice(db, rows, args.iterations))
+                print(f"[{size}] main table...", flush=True)
+                section.update(bench_main_table(db, rows, args.iterations, args.tk))
+            finally:
+                db.close()
+            results['results'][size] = section
+
+        print("quote export...", flush=True)
+        results['results']['quote_export'] = bench_quote_export(data_dir, args.iterations)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    for section, metrics in results['results'].items():
+        print(f"\n{section}")
+        for name, value in metrics.items():
+            if isinstance(value, dict):
+                print(f"   {name:<40}{value['median_ms']:>10.3f} ms  (p95 {value['p95_ms']:.3f})")
+            elif isinstance(value, float):
+                print(f"   {name:<40}{value:>10.3f}")
+            else:
+                print(f"   {name:<40}{value:>10}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -56,6 +56,14 @@ if defined ICON_FILE (
         --icon="%ICON_FILE%" ^
         --add-data="database.py;." ^
         --add-data="price_list_window.py;." ^
+        --add-data="background_search.py;." ^
+        --add-data="virtual_table.py;." ^
+        --add-data="records.py;." ^
+        --add-data="quote_template.py;." ^
+        --add-data="startup_timer.py;." ^
+        --add-data="db_metrics.py;." ^
+        --add-data="catalog_index.py;." ^
+        --add-data="backup.py;." ^
         --add-data="logo.png;." ^
         --add-data="logo.ico;." ^
         %DATA_FILES% ^
@@ -74,6 +82,14 @@ if defined ICON_FILE (
         --windowed ^
         --add-data="database.py;." ^
         --add-data="price_list_window.py;." ^
+        --add-data="background_search.py;." ^
+        --add-data="virtual_table.py;." ^
+        --add-data="records.py;." ^
+        --add-data="quote_template.py;." ^
+        --add-data="startup_timer.py;." ^
+        --add-data="db_metrics.py;." ^
+        --add-data="catalog_index.py;." ^
+        --add-data="backup.py;." ^
         --add-data="logo.png;." ^
         --add-data="logo.ico;." ^
         %DATA_FILES% ^
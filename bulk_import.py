@@ -0,0 +1,176 @@
+"""
+Bulk import/export for inventory.db
+Loads supplier price sheets (CSV, JSON, NDJSON or XLSX) into the fans, sheet_metal
+or flexible tables in chunked transactions, and exports tables back to CSV/JSON.
+
+Usage:
+    python bulk_import.py import fans prices.csv [--on-conflict update|skip] [--chunk-size 5000]
+    python bulk_import.py export fans fans.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from database import InventoryDB, BULK_COLUMNS, BULK_CHUNK_SIZE
+
+UPSERTS = {
+    'fans': 'bulk_upsert_fans',
+    'sheet_metal': 'bulk_upsert_sheet_metal',
+    'flexible': 'bulk_upsert_flexible',
+}
+
+
+def read_csv(path):
+    """Yield one dict per CSV row (header row gives the column names)"""
+    # utf-8-sig strips the BOM Excel adds when saving "CSV UTF-8"
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def read_ndjson(path):
+    """Yield one dict per non-empty line"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def read_json(path, table):
+    """Rows from a JSON list, or from {table: [...]} as written by migrate_to_web.py"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get(table, [])
+    return iter(data)
+
+
+def read_xlsx(path):
+    """Yield one dict per row of the first worksheet (first row gives the column names)"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError("Reading .xlsx files requires openpyxl. Install it with: pip install openpyxl")
+    
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(h).strip() if h is not None else '' for h in header]
+        for values in rows:
+            if any(v is not None for v in values):
+                yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def read_rows(path, table):
+    """Pick a reader by file extension"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return read_csv(path)
+    if ext in ('.ndjson', '.jsonl'):
+        return read_ndjson(path)
+    if ext == '.json':
+        return read_json(path, table)
+    if ext == '.xlsx':
+        return read_xlsx(path)
+    raise ValueError(f"Unsupported file type: {ext} (use .csv, .json, .ndjson or .xlsx)")
+
+
+def export_table(db, table, path):
+    """Write a table to .csv or .json; returns the number of rows written"""
+    columns = ['id'] + list(BULK_COLUMNS[table])
+    ext = os.path.splitext(path)[1].lower()
+    count = 0
+    if ext == '.csv':
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            for row in db.iter_records(table):
+                writer.writerow(row.to_dict())
+                count += 1
+    elif ext in ('.json', '.ndjson', '.jsonl'):
+        with open(path, 'w', encoding='utf-8') as f:
+            if ext == '.json':
+                f.write('[\n')
+            for row in db.iter_records(table):
+                item = json.dumps({c: row[c] for c in columns}, ensure_ascii=False)
+                if ext == '.json':
+                    f.write((',\n' if count else '') + item)
+                else:
+                    f.write(item + '\n')
+                count += 1
+            if ext == '.json':
+                f.write('\n]\n')
+    else:
+        raise ValueError(f"Unsupported file type: {ext} (use .csv, .json or .ndjson)")
+    return count
+
+
+def import_file(db, table, path, chunk_size=BULK_CHUNK_SIZE, on_conflict='update', quiet=False):
+    """Upsert a file into a table, printing progress; returns the stats dict"""
+    start = time.perf_counter()
+    
+    def progress(rows):
+        if not quiet:
+            print(f"\r   {rows} rows...", end='', flush=True)
+    
+    upsert = getattr(db, UPSERTS[table])
+    stats = upsert(read_rows(path, table), chunk_size=chunk_size,
+                   on_conflict=on_conflict, progress=progress)
+    stats['seconds'] = time.perf_counter() - start
+    if not quiet:
+        print()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export for inventory.db")
+    parser.add_argument('--db', default='inventory.db', help="Database file (default: inventory.db)")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    
+    import_parser = commands.add_parser('import', help="Insert or update rows from a file")
+    import_parser.add_argument('table', choices=sorted(UPSERTS))
+    import_parser.add_argument('file', help=".csv, .json, .ndjson or .xlsx")
+    import_parser.add_argument('--on-conflict', choices=('update', 'skip'), default='update',
+                               help="What to do with rows matching an existing item (default: update)")
+    import_parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE,
+                               help=f"Rows per transaction (default: {BULK_CHUNK_SIZE})")
+    
+    export_parser = commands.add_parser('export', help="Write a table to a file")
+    export_parser.add_argument('table', choices=sorted(UPSERTS))
+    export_parser.add_argument('file', help=".csv, .json or .ndjson")
+    args = parser.parse_args()
+    
+    db = InventoryDB(args.db)
+    try:
+        if args.command == 'import':
+            print(f"Importing {args.file} into {args.table}...")
+            stats = import_file(db, args.table, args.file, args.chunk_size, args.on_conflict)
+            rate = stats['rows'] / stats['seconds'] if stats['seconds'] else 0
+            print(f"{stats['rows']} rows in {stats['seconds']:.2f}s ({rate:,.0f} rows/s)")
+            print(f"   - Inserted: {stats['inserted']}")
+            print(f"   - Updated: {stats['updated']}")
+            print(f"   - Unchanged: {stats['unchanged']}")
+        else:
+            count = export_table(db, args.table, args.file)
+            print(f"Exported {count} {args.table} rows to {args.file}")
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
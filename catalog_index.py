@@ -0,0 +1,261 @@
+"""
+Catalog datasheet index.
+
+Reads the text of the fans' catalog PDFs (the files their catalog_file_path
+points to, plus every PDF in the rabah folder) and stores it in the
+catalog_index table, together with the specs found in it: airflow, motor
+power, speeds and dimensions. The main search matches fans on that text, so
+"DA 10/10" or "550W" finds fans whose datasheet says so without any PDF being
+opened while searching.
+
+Fans are matched to the index by file name, as their catalog_file_path is the
+path the PDF had on the computer that linked it (e.g. C:/Users/.../rabah/x.pdf)
+while the indexer reads the copy in the rabah folder; each file name is indexed
+once, from the linked file if it exists here. Files are keyed by path,
+modification time and size: only new or changed files are read again, and
+files that disappeared are dropped from the index.
+The application runs the indexer on a background thread after startup; it can
+also be run by hand:
+
+    python catalog_index.py [--db inventory.db] [--dir rabah] [--rebuild]
+
+Reading PDFs requires pypdf (pip install pypdf); without it nothing is indexed.
+"""
+
+import argparse
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+
+from database import InventoryDB, catalog_key
+
+CATALOG_DIRS = ("rabah",)
+MAX_SPEC_VALUES = 8  # Per spec, in the order found
+
+# Airflow: the value (or the last value of a chart axis) right before m3/h, m³/h, CFM
+_AIRFLOW = re.compile(r'((?:\d[\d.,]*\s+){0,30}\d[\d.,]*)\s*(?:Q\s*\()?\s*(m\s*[3³]\s*/\s*h|CFM)\b',
+                      re.IGNORECASE)
+_NUMBER = re.compile(r'\d+(?:[.,]\d+)?')
+_WATTS = re.compile(r'(?<![\w.,])(\d{1,5}(?:[.,]\d+)?)\s*(k?W)\b')
+# Number of speeds: "3V"/"3S" (velocidades), "3 speeds", "3 سرعات"; and rpm values
+_SPEED_COUNT = re.compile(r'(?<![\w.,])([1-9])\s*(?:V|S|speeds?|velocidades|سرعات)\b', re.IGNORECASE)
+_ONE_SPEED = re.compile(r'سرعة\s+واحدة|single[\s-]speed', re.IGNORECASE)
+_RPM = re.compile(r'((?:\d{3,4}\s+){0,30}\d{3,4})\s*(?:rpm|r/min|min-1|min⁻¹)', re.IGNORECASE)
+# Model sizes (DA 10/10, RF4C-146/220), impeller diameters (Ø 146mm), W x H (x D) mm
+_MODEL_SIZE = re.compile(r'\b([A-Z][A-Z0-9]{1,4})\s*[\s\-‐]\s*(\d{1,3}\s*/\s*\d{1,3})\b')
+_DIAMETER = re.compile(r'[ØΦ]\s*(?:\w+\s*=\s*)?(\d{2,4})\s*mm', re.IGNORECASE)
+_BOX = re.compile(r'(?<![\w.,])(\d{2,4})\s*[x×]\s*(\d{2,4})(?:\s*[x×]\s*(\d{2,4}))?\s*mm', re.IGNORECASE)
+
+
+def _pdf_reader():
+    """pypdf's PdfReader class"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise RuntimeError("Indexing catalog PDFs requires pypdf. Install it with: pip install pypdf")
+    # pypdf logs every font it cannot map; the text is still usable
+    logging.getLogger('pypdf').setLevel(logging.ERROR)
+    return PdfReader
+
+
+def extract_pdf(path):
+    """(page count, text) of a PDF file"""
+    reader = _pdf_reader()(path)
+    pages = []
+    for page in reader.pages:
+        pages.append(page.extract_text() or '')
+    return len(pages), '\n'.join(pages).strip()
+
+
+def _unique(values):
+    """Values without repeats, in order, at most MAX_SPEC_VALUES"""
+    seen = []
+    for value in values:
+        if value not in seen:
+            seen.append(value)
+    return ', '.join(seen[:MAX_SPEC_VALUES]) or None
+
+
+def _number(text):
+    return float(text.replace(',', '.'))
+
+
+def extract_specs(text):
+    """Airflow, watts, speeds and dimensions mentioned in a datasheet (or file name)"""
+    airflow = []
+    for match in _AIRFLOW.finditer(text):
+        numbers = _NUMBER.findall(match.group(1))
+        unit = 'CFM' if match.group(2).upper() == 'CFM' else 'm3/h'
+        # Datasheets print the airflow axis of the fan curve; its last value is the maximum
+        value = max(_number(n) for n in numbers)
+        if value > 0:
+            airflow.append(f"{value:g} {unit}")
+    
+    watts = [f"{_number(value):g}{unit}" for value, unit in _WATTS.findall(text)]
+    
+    speeds = [f"{count} speeds" if count != '1' else "1 speed"
+              for count in _SPEED_COUNT.findall(text)]
+    if _ONE_SPEED.search(text):
+        speeds.append("1 speed")
+    speeds += [f"{max(int(n) for n in rpm.split())} rpm" for rpm in _RPM.findall(text)]
+    
+    dimensions = [f"{model} {size.replace(' ', '')}" for model, size in _MODEL_SIZE.findall(text)]
+    dimensions += [f"Ø{diameter}mm" for diameter in _DIAMETER.findall(text)]
+    dimensions += ['x'.join(part for part in box if part) + 'mm' for box in _BOX.findall(text)]
+    
+    return {
+        'airflow': _unique(airflow),
+        'watts': _unique(watts),
+        'speeds': _unique(speeds),
+        'dimensions': _unique(dimensions),
+    }
+
+
+class CatalogIndexer:
+    """Keeps the catalog_index table in step with the catalog PDFs on disk"""
+    
+    def __init__(self, db, directories=CATALOG_DIRS):
+        self.db = db
+        self.directories = directories
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def catalog_files(self):
+        """Paths to index, one per file name (catalog_key): the fans' catalog files
+        that exist on this computer first, then the PDFs in the catalog folders"""
+        paths = []
+        seen = set()
+        
+        def add(path):
+            key = catalog_key(path)
+            if key not in seen:
+                seen.add(key)
+                paths.append(path)
+        
+        for path in self.db.get_linked_catalog_paths():
+            # A link from another computer is found under its name in the catalog folders
+            if path.lower().endswith('.pdf') and os.path.isfile(path):
+                add(path)
+        for directory in self.directories:
+            try:
+                names = sorted(os.listdir(directory))
+            except OSError:
+                continue
+            for name in names:
+                if name.lower().endswith('.pdf'):
+                    add(os.path.join(directory, name))
+        return paths
+    
+    def run(self, progress=None, rebuild=False):
+        """
+        Index new and changed files and forget missing ones.
+        progress(done, total, path) is called after each file read.
+        Returns counts: {'indexed', 'unchanged', 'failed', 'removed'}.
+        """
+        stats = {'indexed': 0, 'unchanged': 0, 'failed': 0, 'removed': 0}
+        stamps = self.db.get_catalog_stamps()
+        
+        pending = []
+        present = set()
+        for path in self.catalog_files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # Missing: dropped below if it was indexed
+            present.add(path)
+            stamp = (st.st_mtime_ns, st.st_size)
+            if rebuild or stamps.get(path) != stamp:
+                pending.append((path, stamp))
+            else:
+                stats['unchanged'] += 1
+        
+        gone = [path for path in stamps if path not in present]
+        if gone:
+            stats['removed'] = self.db.delete_catalog_entries(gone)
+        
+        if pending:
+            _pdf_reader()  # Fail before the loop if pypdf is missing
+        for done, (path, (mtime, size)) in enumerate(pending, start=1):
+            if self._stop.is_set():
+                break
+            name = os.path.splitext(os.path.basename(path))[0]
+            # Read the PDF outside any transaction; only the save takes the write lock
+            try:
+                pages, content = extract_pdf(path)
+            except Exception as e:
+                # Remember the failure so the file is not retried until it changes
+                self.db.save_catalog_entry(path, mtime, size, name=name,
+                                           specs=extract_specs(name), error=str(e))
+                stats['failed'] += 1
+            else:
+                self.db.save_catalog_entry(path, mtime, size, pages, name, content,
+                                           extract_specs(f"{name}\n{content}"))
+                stats['indexed'] += 1
+            if progress:
+                progress(done, len(pending), path)
+        return stats
+    
+    def start(self, on_done=None):
+        """
+        Run the indexer on a daemon thread. on_done(stats) is called on that thread
+        when it finishes (not if pypdf is missing or the run fails).
+        """
+        def work():
+            try:
+                stats = self.run()
+            except RuntimeError:
+                return  # pypdf not installed: searching works without datasheet text
+            except Exception:
+                traceback.print_exc()
+                return
+            finally:
+                self.db.release_connection()
+            if on_done:
+                on_done(stats)
+        
+        self._stop.clear()
+        self._thread = threading.Thread(target=work, name="catalog-indexer", daemon=True)
+        self._thread.start()
+        return self._thread
+    
+    def stop(self, timeout=None):
+        """Ask a running indexer to stop after the file it is reading"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the text and specs of catalog PDFs")
+    parser.add_argument('--db', default='inventory.db', help="Database file (default: inventory.db)")
+    parser.add_argument('--dir', action='append', dest='dirs',
+                        help="Folder of catalog PDFs (default: rabah; repeat for more)")
+    parser.add_argument('--rebuild', action='store_true', help="Read every file again")
+    args = parser.parse_args()
+    
+    db = InventoryDB(args.db)
+    indexer = CatalogIndexer(db, tuple(args.dirs) if args.dirs else CATALOG_DIRS)
+    
+    def progress(done, total, path):
+        print(f"\r   {done}/{total} {os.path.basename(path)[:50]:<50}", end='', flush=True)
+    
+    start = time.perf_counter()
+    try:
+        stats = indexer.run(progress, rebuild=args.rebuild)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        db.close()
+    print()
+    print(f"Indexed {stats['indexed']}, unchanged {stats['unchanged']}, failed {stats['failed']}, "
+          f"removed {stats['removed']} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
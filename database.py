@@ -1,244 +1,2011 @@
 import sqlite3
+import json
+import math
 import os
-from typing import List, Dict, Optional
+import re
+import string
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
+
+from records import RECORD_TYPES, Fan, SheetMetal, Flexible
+
+# PRAGMAs applied to every connection opened by InventoryDB
+DEFAULT_PRAGMAS = {
+    'busy_timeout': 5000,  # Wait up to 5s for a lock instead of failing immediately
+    'foreign_keys': 'ON',
+}
+
+# Storage profiles: named PRAGMA sets layered on top of DEFAULT_PRAGMAS.
+# "fast" switches to WAL so readers never block on a writer (and vice versa).
+# WAL needs shared memory, so it only works when every process using the
+# database runs on the same machine - do not use it on a network share.
+STORAGE_PROFILES = {
+    'default': {},
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',        # Safe with WAL, fsync only at checkpoints
+        'cache_size': -32000,           # ~32MB page cache (negative = KiB)
+        'mmap_size': 268435456,         # Memory-map up to 256MB for reads
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 1000,     # Checkpoint every ~1000 pages
+    },
+}
+
+# Full-text search: one FTS5 shadow table per product table, kept in sync by triggers
+SEARCH_INDEXES = {
+    'fans': ('name', 'description', 'airflow'),
+    'sheet_metal': ('thickness', 'dimensions', 'measurement', 'extra'),
+    'flexible': ('description', 'diameter', 'collection'),
+}
+# Text extracted from the PDF datasheets (see catalog_index.py), searched with the fans
+CATALOG_SEARCH_COLUMNS = ('name', 'content')
+CATALOG_SPEC_COLUMNS = ('airflow', 'watts', 'speeds', 'dimensions')
+
+# Columns the query() API can sort by, with a matching index on each non-id column.
+# Text columns sort case-insensitively (their indexes use COLLATE NOCASE).
+SORTABLE_COLUMNS = {
+    'fans': {'id': 'INTEGER', 'name': 'TEXT', 'airflow': 'TEXT', 'price_retail': 'REAL',
+             'price_wholesale': 'REAL', 'quantity': 'INTEGER'},
+    'sheet_metal': {'id': 'INTEGER', 'thickness': 'TEXT', 'cost': 'REAL'},
+    'flexible': {'id': 'INTEGER', 'diameter': 'TEXT', 'meter': 'REAL'},
+}
+
+# Bulk import: column -> type for each product table, plus the natural key used
+# to decide whether an incoming row updates an existing item or inserts a new one.
+# Fans match by name (case-insensitive, served by idx_fans_name).
+BULK_COLUMNS = {
+    'fans': {'name': str, 'description': str, 'airflow': str, 'price_wholesale': float,
+             'price_retail': float, 'quantity': int, 'catalog_file_path': str},
+    'sheet_metal': {'thickness': str, 'dimensions': str, 'measurement': str,
+                    'cost': float, 'extra': str},
+    'flexible': {'description': str, 'diameter': str, 'collection': str, 'meter': float},
+}
+BULK_REQUIRED = {
+    'fans': ('name', 'price_wholesale', 'price_retail'),
+    'sheet_metal': ('cost',),
+    'flexible': ('meter',),
+}
+NATURAL_KEYS = {
+    'fans': ('name',),
+    'sheet_metal': ('thickness', 'dimensions', 'measurement'),
+    'flexible': ('description', 'diameter', 'collection'),
+}
+BULK_CHUNK_SIZE = 5000
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+PRODUCT_TABLES = ('fans', 'sheet_metal', 'flexible')
+
+# Read-through cache for get_*_by_id
+ROW_CACHE_SIZE = 2048      # Rows kept (least recently used are evicted)
+ROW_CACHE_RECHECK = 0.5    # Seconds between checks for changes made by other programs
+
+# Plumbing that is not timed when metrics are on (per-statement helpers, a context manager)
+UNINSTRUMENTED_METHODS = ('get_connection', 'transaction', 'release_connection', 'close')
+
+# Deletion tombstones (deleted_items) are kept at least this long, so a lost delta
+# can be re-created with --since; older ones go once every sync target has them
+TOMBSTONE_RETENTION_DAYS = 90
+# sync_state name of a target's last change number (replica_state.seq) received
+CHANGE_WATERMARK = 'changes'
+
+# Tables whose quantity changes are recorded in stock_movements
+STOCK_TABLES = ('fans', 'sheet_metal')
+
+# Price columns of each product table, recorded in price_history whenever they change
+PRICE_COLUMNS = {
+    'fans': ('price_wholesale', 'price_retail'),
+    'sheet_metal': ('cost',),
+    'flexible': ('meter',),
+}
+PRICE_HISTORY_COLUMNS = ('price_wholesale', 'price_retail', 'cost', 'meter')
+
+REPRICE_ROUNDING = ('nearest', 'up', 'down')
+REPRICE_PREVIEW_ROWS = 100  # Items listed by a dry run (the totals cover every item)
+# Page cache while repricing: the price and updated_at index entries move in random order
+REPRICE_CACHE_KIB = 65536
+
+# Replication: columns copied between sites by last-writer-wins. Quantities are not
+# among them; they travel as per-site stock counters so sales at two sites add up.
+REPLICATED_COLUMNS = {table: tuple(c for c in columns if c != 'quantity')
+                      for table, columns in BULK_COLUMNS.items()}
+# Site of the rows that existed before replication: the same on every copy of a database
+BASELINE_SITE = '0'
+
+# Product table definitions ({table} is the name, optionally with IF NOT EXISTS)
+FANS_TABLE_SQL = '''
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        description TEXT,
+        airflow TEXT,
+        price_wholesale REAL NOT NULL,
+        price_retail REAL NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        catalog_file_path TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+SHEET_METAL_TABLE_SQL = '''
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        thickness TEXT,
+        dimensions TEXT,
+        measurement TEXT,
+        cost REAL NOT NULL,
+        extra TEXT,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+FLEXIBLE_TABLE_SQL = '''
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        description TEXT,
+        diameter TEXT,
+        collection TEXT,
+        meter REAL NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# Schema migrations: (number, description, InventoryDB method). PRAGMA user_version
+# holds the number of the last one applied. Append new migrations; never renumber
+# or change one that has shipped.
+MIGRATIONS = (
+    (1, "Product tables", '_migrate_product_tables'),
+    (2, "Sort and lookup indexes", '_migrate_indexes'),
+    (3, "Stock movement ledger", '_create_stock_ledger'),
+    (4, "Full-text search index", '_migrate_search_index'),
+    (5, "Change tracking for incremental sync", '_migrate_sync_tracking'),
+    (6, "Catalog datasheet index", '_migrate_catalog_index'),
+    (7, "Multi-site replication", '_migrate_replication'),
+    (8, "Price history", '_migrate_price_history'),
+    (9, "Catalog links by file name", '_migrate_catalog_keys'),
+    (10, "Change numbers for incremental sync", '_migrate_delta_changes'),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+MIGRATION_BATCH_SIZE = 10000  # Rows copied/indexed per statement (progress granularity)
+
+# Arabic normalization applied to both indexed text and search terms
+_ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ARABIC_CHAR_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',  # Alef variants
+    'ى': 'ي',                                  # Alef maksura
+    'ة': 'ه',                                  # Taa marbuta
+    **{chr(0x0660 + d): str(d) for d in range(10)},  # Arabic-Indic digits
+    **{chr(0x06F0 + d): str(d) for d in range(10)},  # Extended (Persian) digits
+})
+# Same token rule as the FTS5 unicode61 tokenizer: letters and digits, everything else separates
+_SEARCH_TOKEN = re.compile(r'[^\W_]+')
+# Limited searches rank this many candidates per requested row instead of every match
+SEARCH_RANK_WINDOW = 10
+
+
+def normalize_search_text(text):
+    """Normalize text for searching (case, diacritics, Arabic letter variants, digits)"""
+    if text is None:
+        return None
+    text = _ARABIC_DIACRITICS.sub('', str(text))
+    return text.translate(_ARABIC_CHAR_MAP).casefold()
+
+
+def build_fts_query(search_term: str) -> Optional[str]:
+    """Turn user input into an FTS5 prefix query (all words must match), or None if empty.
+    
+    Each typed word becomes a phrase, so "DA-9-9" matches the tokens da 9 9 in order
+    instead of three independent (and very common) prefixes.
+    """
+    phrases = []
+    for word in (normalize_search_text(search_term) or '').split():
+        tokens = _SEARCH_TOKEN.findall(word)
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"*')
+    return ' '.join(phrases) or None
+
+
+def _nocase(value):
+    """Fold a value the way SQLite's NOCASE collation does (ASCII letters only)"""
+    if isinstance(value, str):
+        return value.translate(_ASCII_LOWER)
+    return value
+
+
+def catalog_key(path: str) -> str:
+    """Key a fan's catalog_file_path and an indexed PDF are matched on: the file name.
+    
+    Fans link to their datasheet by the path it had on the computer that chose it
+    (C:/Users/.../rabah/DA 12-12.pdf), while the indexer reads the copy in the
+    catalog folder (rabah/DA 12-12.pdf); both end in the same file name. ASCII
+    letters are folded like SQLite's lower(), so _catalog_key_sql() agrees.
+    """
+    return _nocase(path.replace('\\', '/').rsplit('/', 1)[-1])
+
+
+def _catalog_key_sql(column: str) -> str:
+    """SQL computing catalog_key() of a path column (fans has an index on this expression)"""
+    path = f"replace({column}, '\\', '/')"
+    # rtrim() strips every character but '/' from the end, leaving the folder part
+    return f"lower(replace({path}, rtrim({path}, replace({path}, '/', '')), ''))"
+
+
+def _select_list(table: str, alias: str = 't') -> str:
+    """Column list matching the record class of a product table"""
+    return ', '.join(f'{alias}.{c}' for c in RECORD_TYPES[table]._fields)
+
+
+def _ledger_time(value) -> str:
+    """Format a datetime (naive = UTC) like stock_movements.created_at; strings pass through"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f')[:23]
+    return value
+
+
+def _reprice_expression(column: str, percent: float, amount: float,
+                        round_to: Optional[float], rounding: str) -> str:
+    """SQL for a repriced column: percent then amount, never below zero, then rounded.
+    
+    Without round_to a changed price is rounded to the cent; with neither a
+    percent nor an amount the price is only rounded to round_to (or left as it
+    is, so no item counts as changed). The numbers are validated floats, so
+    they are written into the SQL as literals.
+    """
+    if not percent and not amount:
+        value = column
+    else:
+        value = f'max(0, {column} * {1 + percent / 100!r} + {float(amount)!r})'
+    if not round_to:
+        return value if value == column else f'round({value}, 2)'
+    steps = f'({value} / {float(round_to)!r})'
+    # floor/ceil without the math extension; the 1e-9 absorbs float noise (1.25 / 0.05)
+    if rounding == 'up':
+        steps = f'(CAST({steps} - 1e-9 AS INTEGER) + ({steps} - 1e-9 > CAST({steps} - 1e-9 AS INTEGER)))'
+    elif rounding == 'down':
+        steps = f'CAST({steps} + 1e-9 AS INTEGER)'
+    else:
+        steps = f'round({steps})'
+    return f'round({steps} * {float(round_to)!r}, 6)'
+
+
+def _json1_available() -> bool:
+    """Check whether the bundled SQLite library has the JSON functions (built in since 3.38)"""
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.execute("SELECT value FROM json_each('[1]')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def _fts5_available() -> bool:
+    """Check whether the bundled SQLite library was compiled with FTS5"""
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.execute('CREATE VIRTUAL TABLE fts5_probe USING fts5(x)')
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
 
 class InventoryDB:
-    def __init__(self, db_path: str = "inventory.db"):
+    def __init__(self, db_path: str = "inventory.db", profile: str = "default",
+                 pragmas: Optional[Dict] = None, progress=None, auto_migrate: bool = True,
+                 metrics=None):
+        """
+        auto_migrate=False leaves the schema check to the caller, who must call
+        migrate() (on any thread) before using the database; the GUI does this so
+        its window can appear before the check runs.
+        metrics: a db_metrics.DBMetrics to record method timings, slow statements
+        and connection counts in (off by default; costs nothing when off).
+        """
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f"Unknown storage profile: {profile}")
         self.db_path = db_path
-        self.init_database()
+        self.profile = profile
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(STORAGE_PROFILES[profile])
+        if pragmas:
+            self.pragmas.update(pragmas)
+        
+        # One long-lived connection per thread (sqlite3 connections are not thread-safe)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        
+        # id -> row cache shared by all threads; an entry is valid while its table's
+        # version is unchanged (bumped after every write transaction)
+        self._row_cache = OrderedDict()
+        self._row_cache_lock = threading.Lock()
+        # catalog_index too: fan searches match the datasheet text
+        self._table_versions = dict.fromkeys(PRODUCT_TABLES + ('catalog_index',), 0)
+        
+        # Fall back to LIKE scans when SQLite was built without FTS5 (or, after
+        # migrate(), when the database has no FTS tables; see _check_search_indexes)
+        self._fts5 = _fts5_available()
+        self.fts_enabled = self._fts5
+        self._json1 = _json1_available()
+        
+        self.metrics = metrics
+        self._connection_factory = sqlite3.Connection
+        if metrics is not None:
+            self._instrument(metrics)
+        
+        if auto_migrate:
+            self.migrate(progress)
+    
+    def _instrument(self, metrics):
+        """Time every public method and every statement (see db_metrics)"""
+        from db_metrics import connection_factory
+        self._connection_factory = connection_factory(metrics)
+        for name, attribute in vars(type(self)).items():
+            if name.startswith('_') or name in UNINSTRUMENTED_METHODS or not callable(attribute):
+                continue
+            # The instance attribute shadows the class's method on this instance only
+            setattr(self, name, metrics.timed(name, getattr(self, name)))
     
     def get_connection(self):
-        """Get database connection"""
-        return sqlite3.connect(self.db_path)
+        """Get the database connection owned by the calling thread (opened on first use)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open_connection()
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
     
-    def init_database(self):
-        """Initialize database with all product tables"""
+    def _open_connection(self):
+        """Open a new connection with the configured PRAGMAs applied"""
+        # isolation_level=None: autocommit for reads, explicit BEGIN in transaction()
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                               factory=self._connection_factory)
+        conn.row_factory = sqlite3.Row
+        # Used by the search index triggers, so every writer connection needs it
+        try:
+            conn.create_function('normalize_ar', 1, normalize_search_text, deterministic=True)
+        except (TypeError, sqlite3.NotSupportedError):
+            conn.create_function('normalize_ar', 1, normalize_search_text)  # Python < 3.8
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        with self._connections_lock:
+            self._connections.append(conn)
+        if self.metrics is not None:
+            self.metrics.connection_opened(conn)
+        return conn
+    
+    @contextmanager
+    def transaction(self, *tables: str):
+        """Run a block inside a write transaction (commit on success, rollback on error).
+        
+        tables: the tables the block writes to, so only their cached rows are
+        invalidated when it ends (no tables: invalidate every cached row).
+        Nested calls join the outermost transaction.
+        """
+        conn = self.get_connection()
+        if self._local.depth:
+            self._local.changed.update(tables or PRODUCT_TABLES)
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        self._local.changed = set(tables or PRODUCT_TABLES)
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+            # After COMMIT/ROLLBACK, so no other thread can cache the old rows again
+            self._bump_versions(self._local.changed)
+    
+    def _bump_versions(self, tables):
+        """Invalidate the cached rows of tables"""
+        with self._row_cache_lock:
+            for table in tables:
+                self._table_versions[table] = self._table_versions.get(table, 0) + 1
+    
+    def clear_row_cache(self):
+        """Drop every cached row (e.g. after another program changed the database)"""
+        with self._row_cache_lock:
+            self._row_cache.clear()
+            for table in self._table_versions:
+                self._table_versions[table] += 1
+    
+    def table_version(self, table: str) -> int:
+        """Number that changes whenever table may have changed (e.g. for HTTP ETags).
+        
+        Writes through this instance change it at once, writes by other programs
+        within ROW_CACHE_RECHECK seconds. It starts again from 0 in every instance.
+        """
         conn = self.get_connection()
-        cursor = conn.cursor()
+        if not self._local.depth:
+            self._check_outside_changes(conn)
+        with self._row_cache_lock:
+            return self._table_versions[table]
+    
+    def _check_outside_changes(self, conn):
+        """Clear the row cache if another connection or program committed a change.
+        
+        PRAGMA data_version costs about as much as the lookup it protects, so it is
+        checked at most every ROW_CACHE_RECHECK seconds per thread.
+        """
+        now = time.monotonic()
+        if now - getattr(self._local, 'version_checked', float('-inf')) < ROW_CACHE_RECHECK:
+            return
+        self._local.version_checked = now
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if getattr(self._local, 'data_version', data_version) != data_version:
+            self.clear_row_cache()
+        self._local.data_version = data_version
+    
+    def _get_by_id(self, table: str, item_id: int):
+        """Read-through cached lookup of one record by id"""
+        conn = self.get_connection()
+        if self._local.depth:
+            # Inside a write transaction: the row may not be committed yet
+            return self._fetch_by_id(table, item_id)
+        
+        self._check_outside_changes(conn)
+        key = (table, item_id)
+        with self._row_cache_lock:
+            version = self._table_versions[table]
+            entry = self._row_cache.get(key)
+            if entry is not None and entry[0] == version:
+                self._row_cache.move_to_end(key)
+                return entry[1]
+        
+        # Read after taking the version: a write committed meanwhile makes this entry stale
+        record = self._fetch_by_id(table, item_id)
+        with self._row_cache_lock:
+            self._row_cache[key] = (version, record)
+            self._row_cache.move_to_end(key)
+            if len(self._row_cache) > ROW_CACHE_SIZE:
+                self._row_cache.popitem(last=False)
+        return record
+    
+    def _fetch_by_id(self, table: str, item_id: int):
+        cursor = self._record_cursor(table)
+        cursor.execute(f'SELECT {_select_list(table)} FROM {table} t WHERE t.id = ?', (item_id,))
+        return cursor.fetchone()
+    
+    def _record_cursor(self, table: str):
+        """Cursor on the calling thread's connection that returns table records"""
+        cursor = self.get_connection().cursor()
+        cursor.row_factory = RECORD_TYPES[table].row_factory
+        return cursor
+    
+    def is_wal(self) -> bool:
+        """Check whether the database is in WAL journal mode"""
+        row = self.get_connection().execute('PRAGMA journal_mode').fetchone()
+        return row[0].lower() == 'wal'
+    
+    def checkpoint(self, mode: str = "PASSIVE"):
+        """Copy WAL content back into the main database file (no-op outside WAL mode)"""
+        if not self.is_wal():
+            return None
+        return tuple(self.get_connection().execute(f'PRAGMA wal_checkpoint({mode})').fetchone())
+    
+    def release_connection(self):
+        """Close the calling thread's connection (call before a worker thread exits)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._connections_lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+        if self.metrics is not None:
+            self.metrics.connection_closed()
+    
+    def close(self):
+        """Close every connection opened by this instance"""
+        # Fold the WAL back into the database so the file can be copied on its own
+        try:
+            self.checkpoint("TRUNCATE")
+        except sqlite3.Error:
+            pass  # Another process is still reading; its own close will checkpoint
+        
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            if self.metrics is not None:
+                self.metrics.connection_closed()
+        self._local = threading.local()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def init_database(self):
+        """Bring the database schema up to date (see MIGRATIONS)"""
+        return self.migrate()
+    
+    @property
+    def schema_version(self) -> int:
+        """Number of the last migration applied to this database"""
+        return self.get_connection().execute('PRAGMA user_version').fetchone()[0]
+    
+    def migrate(self, progress=None, stop=None) -> int:
+        """Apply pending migrations in order, each in its own transaction.
+        
+        An up-to-date database costs a PRAGMA user_version read and a look at
+        which search index tables exist.
+        progress(description, done, total) is called as each migration starts and
+        while large tables are copied or indexed. Once the stop Event is set no
+        further migration is started (the next call carries on from there).
+        """
+        version = self.schema_version
+        report = progress or (lambda description, done, total: None)
+        if version >= SCHEMA_VERSION:
+            self._check_search_indexes(report)
+            return version
+        
+        for number, description, method in MIGRATIONS:
+            if number <= version:
+                continue
+            if stop is not None and stop.is_set():
+                return self.schema_version
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                # Another program may have migrated while we waited for the write lock
+                cursor.execute('PRAGMA user_version')
+                if cursor.fetchone()[0] >= number:
+                    continue
+                report(description, 0, 1)
+                getattr(self, method)(cursor, lambda done, total: report(description, done, total))
+                cursor.execute(f'PRAGMA user_version = {number}')
+                report(description, 1, 1)
+        self._check_search_indexes(report)
+        return self.schema_version
+    
+    def _missing_search_indexes(self, cursor) -> Dict[str, Tuple[str, ...]]:
+        """{table: columns} of the existing tables that have no FTS table"""
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = {row[0] for row in cursor.fetchall()}
+        indexes = dict(SEARCH_INDEXES, catalog_index=CATALOG_SEARCH_COLUMNS)
+        return {table: columns for table, columns in indexes.items()
+                if table in tables and f'{table}_fts' not in tables}
+    
+    def _check_search_indexes(self, report):
+        """Use FTS only where its tables exist.
+        
+        Migrations 4 and 6 skip the FTS tables when SQLite has no FTS5 but are
+        still recorded, so a database migrated that way gets them here the first
+        time it is opened with FTS5.
+        """
+        if not self._fts5:
+            self.fts_enabled = False
+            return
+        cursor = self.get_connection().cursor()
+        if self._missing_search_indexes(cursor):
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                # Checked again under the write lock, as in migrate()
+                for table, columns in self._missing_search_indexes(cursor).items():
+                    description = f"Full-text search index ({table})"
+                    report(description, 0, 1)
+                    self._create_search_index(cursor, table, columns,
+                                              lambda done, total: report(description, done, total))
+                    report(description, 1, 1)
+        self.fts_enabled = True
+    
+    def _id_ranges(self, cursor, table: str):
+        """Split a table's ids into (after, upto] ranges of MIGRATION_BATCH_SIZE rows"""
+        cursor.execute(f'SELECT MIN(id), MAX(id) FROM {table}')
+        low, high = cursor.fetchone()
+        if low is None:
+            return
+        after = low - 1
+        while after < high:
+            cursor.execute(f'SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT 1 OFFSET ?',
+                           (after, MIGRATION_BATCH_SIZE - 1))
+            row = cursor.fetchone()
+            upto = row[0] if row else high
+            yield after, upto
+            after = upto
+    
+    def _copy_rows(self, cursor, source: str, target: str, columns, progress):
+        """Copy a table in batches of ids, reporting progress after each batch"""
+        cursor.execute(f'SELECT COUNT(*) FROM {source}')
+        total = cursor.fetchone()[0]
+        column_list = ', '.join(columns)
+        done = 0
+        for after, upto in self._id_ranges(cursor, source):
+            cursor.execute(f'''
+                INSERT INTO {target} ({column_list})
+                SELECT {column_list} FROM {source} WHERE id > ? AND id <= ?
+            ''', (after, upto))
+            done += max(cursor.rowcount, 0)
+            progress(done, total)
+    
+    def _rebuild_table(self, cursor, table: str, create_sql: str, columns, progress):
+        """Recreate a table with a new definition, keeping the given columns"""
+        cursor.execute(create_sql.format(table=f'{table}_new'))
+        self._copy_rows(cursor, table, f'{table}_new', columns, progress)
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+    
+    def _migrate_product_tables(self, cursor, progress):
+        """Migration 1: product tables, including the pre-versioning legacy layouts"""
+        cursor.execute(FANS_TABLE_SQL.format(table='IF NOT EXISTS fans'))
+        cursor.execute(SHEET_METAL_TABLE_SQL.format(table='IF NOT EXISTS sheet_metal'))
+        cursor.execute(FLEXIBLE_TABLE_SQL.format(table='IF NOT EXISTS flexible'))
+        
+        # Columns added to fans over time
+        cursor.execute('PRAGMA table_info(fans)')
+        columns = [row[1] for row in cursor.fetchall()]
+        for column in ('catalog_file_path', 'description'):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE fans ADD COLUMN {column} TEXT')
         
-        # Fans table
+        # sheet_metal used to have name/description columns
+        cursor.execute('PRAGMA table_info(sheet_metal)')
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'name' in columns or 'description' in columns:
+            self._rebuild_table(cursor, 'sheet_metal', SHEET_METAL_TABLE_SQL,
+                                ('id', 'thickness', 'dimensions', 'measurement', 'cost', 'extra',
+                                 'quantity', 'created_at', 'updated_at'), progress)
+        
+        # flexible used to have name/quantity columns
+        cursor.execute('PRAGMA table_info(flexible)')
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'name' in columns or 'quantity' in columns:
+            self._rebuild_table(cursor, 'flexible', FLEXIBLE_TABLE_SQL,
+                                ('id', 'description', 'diameter', 'collection', 'meter',
+                                 'created_at', 'updated_at'), progress)
+    
+    def _migrate_indexes(self, cursor, progress):
+        """Migration 2: sort indexes for query() and natural key indexes for bulk upserts"""
+        for table, columns in SORTABLE_COLUMNS.items():
+            for column, column_type in columns.items():
+                if column == 'id':
+                    continue
+                collate = ' COLLATE NOCASE' if column_type == 'TEXT' else ''
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{column} '
+                               f'ON {table} ({column}{collate})')
+        
+        # fans.name is covered by idx_fans_name
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sheet_metal_natural_key '
+                       'ON sheet_metal (thickness, dimensions, measurement)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_flexible_natural_key '
+                       'ON flexible (description, diameter, collection)')
+    
+    def _migrate_search_index(self, cursor, progress):
+        """Migration 4: FTS5 search indexes (skipped when SQLite has no FTS5)"""
+        if not self.fts_enabled:
+            return
+        for table, columns in SEARCH_INDEXES.items():
+            self._create_search_index(cursor, table, columns, progress)
+    
+    def _migrate_sync_tracking(self, cursor, progress):
+        """Migration 5: updated_at indexes, deletion tombstones and sync watermarks"""
+        for table in PRODUCT_TABLES:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table} (updated_at)')
+        
+        # A row per deleted item, so incremental exports can tell other copies to drop it
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS fans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+            CREATE TABLE IF NOT EXISTS deleted_items (
+                product_type TEXT NOT NULL,
+                item_id INTEGER NOT NULL,
+                deleted_at TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+                PRIMARY KEY (product_type, item_id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_deleted_items_time '
+                       'ON deleted_items (product_type, deleted_at)')
+        for table in PRODUCT_TABLES:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_tombstone AFTER DELETE ON {table} BEGIN
+                    INSERT OR REPLACE INTO deleted_items (product_type, item_id)
+                    VALUES ('{table}', old.id);
+                END
+            ''')
+        
+        # Last change exported to each sync target, per table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                target TEXT NOT NULL,
                 name TEXT NOT NULL,
-                description TEXT,
+                watermark TEXT NOT NULL,
+                PRIMARY KEY (target, name)
+            )
+        ''')
+    
+    def _migrate_catalog_index(self, cursor, progress):
+        """Migration 6: text and specs extracted from catalog PDFs, one row per file"""
+        # mtime (ns) and size tell the indexer which files changed since they were read
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_index (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT NOT NULL UNIQUE,
+                mtime INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                pages INTEGER NOT NULL DEFAULT 0,
+                name TEXT,
+                content TEXT,
                 airflow TEXT,
-                price_wholesale REAL NOT NULL,
-                price_retail REAL NOT NULL,
-                quantity INTEGER NOT NULL DEFAULT 0,
-                catalog_file_path TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                watts TEXT,
+                speeds TEXT,
+                dimensions TEXT,
+                error TEXT,
+                indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        # Joins datasheet matches back to the fans that link to them
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_fans_catalog_file_path '
+                       'ON fans (catalog_file_path)')
+        if self.fts_enabled:
+            self._create_search_index(cursor, 'catalog_index', CATALOG_SEARCH_COLUMNS, progress)
+    
+    def _migrate_catalog_keys(self, cursor, progress):
+        """Migration 9: match fans to catalog PDFs by file name instead of full path"""
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_fans_catalog_key '
+                       f'ON fans ({_catalog_key_sql("catalog_file_path")})')
+        cursor.execute('DROP INDEX IF EXISTS idx_fans_catalog_file_path')
+    
+    def _migrate_delta_changes(self, cursor, progress):
+        """Migration 10: number deletion tombstones like replicated changes.
         
-        # Add catalog_file_path column to existing databases (migration)
-        try:
-            cursor.execute('ALTER TABLE fans ADD COLUMN catalog_file_path TEXT')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
+        Delta exports ask for the changes numbered after the last one a target
+        received. The number is taken under the write lock, so unlike updated_at
+        it follows commit order: a transaction that commits after an export can
+        not carry a number the export already covered. Existing tombstones get 0.
+        """
+        cursor.execute('ALTER TABLE deleted_items ADD COLUMN seq INTEGER NOT NULL DEFAULT 0')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_deleted_items_seq ON deleted_items (product_type, seq)')
+        for table in PRODUCT_TABLES:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_tombstone')
+            # Above the last committed change number whichever trigger bumps it first
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_tombstone AFTER DELETE ON {table} BEGIN
+                    INSERT OR REPLACE INTO deleted_items (product_type, item_id, seq)
+                    SELECT '{table}', old.id, seq + 1 FROM replica_state;
+                END
+            ''')
+    
+    def _migrate_replication(self, cursor, progress):
+        """Migration 7: site id, Lamport clock and per-row versions for multi-site replication.
         
-        # Sheet Metal table
+        Every row gets a global id ('<site>:<local id>') that is the same on every
+        site, and a version (clock, site) that decides which of two concurrent
+        changes wins. Rows that already exist belong to the shared baseline site
+        '0' instead of this site's random id, so copies of one database that are
+        upgraded separately (the warehouse and the showroom) still agree on
+        their ids and count the stock they started with once. seq numbers changes in the order this site saw them, so a
+        changeset holds only what changed since the last one sent to a peer.
+        Triggers record local changes; replicate.py applies remote ones with
+        replica_state.applying set so they are not recorded as local.
+        """
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sheet_metal (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                thickness TEXT,
-                dimensions TEXT,
-                measurement TEXT,
-                cost REAL NOT NULL,
-                extra TEXT,
-                quantity INTEGER NOT NULL DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            CREATE TABLE IF NOT EXISTS replica_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                site TEXT NOT NULL,
+                clock INTEGER NOT NULL DEFAULT 0,
+                seq INTEGER NOT NULL DEFAULT 0,
+                applying INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO replica_state (id, site) VALUES (1, lower(hex(randomblob(6))))")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS row_versions (
+                product_type TEXT NOT NULL,
+                gid TEXT NOT NULL,
+                item_id INTEGER,
+                clock INTEGER NOT NULL,
+                site TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (product_type, gid)
             )
         ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_row_versions_item ON row_versions (product_type, item_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_row_versions_seq ON row_versions (seq)')
+        # Net quantity change made at each site, per row; version counts its changes
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS replica_counters (
+                product_type TEXT NOT NULL,
+                gid TEXT NOT NULL,
+                site TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                PRIMARY KEY (product_type, gid, site)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_replica_counters_seq ON replica_counters (seq)')
         
-        # Migrate existing sheet_metal table if it has name/description columns
-        try:
-            cursor.execute("PRAGMA table_info(sheet_metal)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'name' in columns or 'description' in columns:
-                # Create new table without name and description
-                cursor.execute('''
-                    CREATE TABLE sheet_metal_new (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        thickness TEXT,
-                        dimensions TEXT,
-                        measurement TEXT,
-                        cost REAL NOT NULL,
-                        extra TEXT,
-                        quantity INTEGER NOT NULL DEFAULT 0,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                # Copy data (excluding name and description)
-                cursor.execute('''
-                    INSERT INTO sheet_metal_new (id, thickness, dimensions, measurement, cost, extra, quantity, created_at, updated_at)
-                    SELECT id, thickness, dimensions, measurement, cost, extra, quantity, created_at, updated_at
-                    FROM sheet_metal
+        # Existing rows (and their stock) start at version 0 of the baseline site
+        total = sum(cursor.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for table in PRODUCT_TABLES)
+        done = 0
+        for table in PRODUCT_TABLES:
+            for after, upto in self._id_ranges(cursor, table):
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO row_versions (product_type, gid, item_id, clock, site, seq)
+                    SELECT '{table}', '{BASELINE_SITE}:' || id, id, 0, '{BASELINE_SITE}', 0
+                    FROM {table} WHERE id > ? AND id <= ?
+                ''', (after, upto))
+                done += max(cursor.rowcount, 0)
+                if table in STOCK_TABLES:
+                    cursor.execute(f'''
+                        INSERT OR IGNORE INTO replica_counters (product_type, gid, site, total, version, seq)
+                        SELECT '{table}', '{BASELINE_SITE}:' || id, '{BASELINE_SITE}', quantity, 1, 0
+                        FROM {table} WHERE id > ? AND id <= ? AND quantity != 0
+                    ''', (after, upto))
+                progress(done, total)
+        
+        local = "(SELECT applying FROM replica_state) = 0"
+        for table in PRODUCT_TABLES:
+            stock = table in STOCK_TABLES
+            initial_stock = f'''
+                    INSERT INTO replica_counters (product_type, gid, site, total, version, seq)
+                    SELECT '{table}', site || ':' || new.id, site, new.quantity, 1, seq
+                    FROM replica_state WHERE new.quantity != 0;''' if stock else ''
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_replica_insert AFTER INSERT ON {table}
+                WHEN {local} BEGIN
+                    UPDATE replica_state SET clock = clock + 1, seq = seq + 1;
+                    INSERT OR REPLACE INTO row_versions (product_type, gid, item_id, clock, site, seq)
+                    SELECT '{table}', site || ':' || new.id, new.id, clock, site, seq FROM replica_state;{initial_stock}
+                END
+            ''')
+            columns = REPLICATED_COLUMNS[table]
+            changed = ' OR '.join(f'old.{c} IS NOT new.{c}' for c in columns)
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_replica_update AFTER UPDATE OF {', '.join(columns)}
+                ON {table} WHEN ({changed}) AND {local} BEGIN
+                    UPDATE replica_state SET clock = clock + 1, seq = seq + 1;
+                    UPDATE row_versions SET (clock, site, seq) = (SELECT clock, site, seq FROM replica_state)
+                    WHERE product_type = '{table}' AND item_id = new.id;
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_replica_delete AFTER DELETE ON {table}
+                WHEN {local} BEGIN
+                    UPDATE replica_state SET clock = clock + 1, seq = seq + 1;
+                    UPDATE row_versions SET (clock, site, seq) = (SELECT clock, site, seq FROM replica_state),
+                        item_id = NULL, deleted = 1
+                    WHERE product_type = '{table}' AND item_id = old.id;
+                END
+            ''')
+            if stock:
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_replica_stock AFTER UPDATE OF quantity ON {table}
+                    WHEN old.quantity IS NOT new.quantity AND {local} BEGIN
+                        UPDATE replica_state SET seq = seq + 1;
+                        INSERT OR IGNORE INTO replica_counters (product_type, gid, site, total, version, seq)
+                        SELECT '{table}', v.gid, s.site, 0, 0, 0 FROM row_versions v, replica_state s
+                        WHERE v.product_type = '{table}' AND v.item_id = new.id;
+                        UPDATE replica_counters
+                        SET total = total + new.quantity - old.quantity, version = version + 1,
+                            seq = (SELECT seq FROM replica_state)
+                        WHERE product_type = '{table}'
+                          AND site = (SELECT site FROM replica_state)
+                          AND gid = (SELECT gid FROM row_versions
+                                     WHERE product_type = '{table}' AND item_id = new.id);
+                    END
                 ''')
-                # Drop old table and rename new one
-                cursor.execute('DROP TABLE sheet_metal')
-                cursor.execute('ALTER TABLE sheet_metal_new RENAME TO sheet_metal')
-        except sqlite3.OperationalError:
-            pass  # Table might not exist yet or migration already done
+    
+    def _migrate_price_history(self, cursor, progress):
+        """Migration 8: the price_history table and the triggers that fill it.
+        
+        A row holds an item's prices from changed_at on (UTC with milliseconds,
+        like stock_movements); only the columns of its own table are set. Rows
+        are only ever added. Existing items start with their current prices as
+        of their last update.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS price_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_type TEXT NOT NULL,
+                item_id INTEGER NOT NULL,
+                changed_at TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+                price_wholesale REAL,
+                price_retail REAL,
+                cost REAL,
+                meter REAL
+            )
+        ''')
+        # Covers the per-item lookups: "price as of" is one seek that never reads the table
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_price_history_item
+            ON price_history (product_type, item_id, changed_at, id, {', '.join(PRICE_HISTORY_COLUMNS)})
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_price_history_time '
+                       'ON price_history (product_type, changed_at)')
+        
+        total = sum(cursor.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for table in PRODUCT_TABLES)
+        done = 0
+        for table, columns in PRICE_COLUMNS.items():
+            column_list = ', '.join(columns)
+            for after, upto in self._id_ranges(cursor, table):
+                cursor.execute(f'''
+                    INSERT INTO price_history (product_type, item_id, changed_at, {column_list})
+                    SELECT '{table}', id,
+                           COALESCE(strftime('%Y-%m-%d %H:%M:%f', updated_at),
+                                    strftime('%Y-%m-%d %H:%M:%f', created_at),
+                                    strftime('%Y-%m-%d %H:%M:%f', 'now')),
+                           {column_list}
+                    FROM {table} WHERE id > ? AND id <= ?
+                ''', (after, upto))
+                done += max(cursor.rowcount, 0)
+                progress(done, total)
+            
+            new_values = ', '.join(f'new.{c}' for c in columns)
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_price_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO price_history (product_type, item_id, {column_list})
+                    VALUES ('{table}', new.id, {new_values});
+                END
+            ''')
+            changed = ' OR '.join(f'old.{c} IS NOT new.{c}' for c in columns)
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_price_update AFTER UPDATE OF {column_list}
+                ON {table} WHEN {changed} BEGIN
+                    INSERT INTO price_history (product_type, item_id, {column_list})
+                    VALUES ('{table}', new.id, {new_values});
+                END
+            ''')
+    
+    def _create_stock_ledger(self, cursor, progress):
+        """Migration 3: the stock_movements table and the triggers that fill it.
         
-        # Flexible table
+        Every change to a quantity (sales, edits, imports, deletes) is recorded by
+        triggers in the same statement that makes it, so the ledger cannot drift
+        from the stock levels. Timestamps are UTC with milliseconds.
+        """
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS flexible (
+            CREATE TABLE IF NOT EXISTS stock_movements (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                description TEXT,
-                diameter TEXT,
-                collection TEXT,
-                meter REAL NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                product_type TEXT NOT NULL,
+                item_id INTEGER NOT NULL,
+                change INTEGER NOT NULL,
+                quantity_after INTEGER NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
             )
         ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_stock_movements_item '
+                       'ON stock_movements (product_type, item_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_stock_movements_time '
+                       'ON stock_movements (product_type, created_at)')
+        
+        for table in STOCK_TABLES:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_stock_insert AFTER INSERT ON {table}
+                WHEN new.quantity != 0 BEGIN
+                    INSERT INTO stock_movements (product_type, item_id, change, quantity_after)
+                    VALUES ('{table}', new.id, new.quantity, new.quantity);
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_stock_update AFTER UPDATE OF quantity ON {table}
+                WHEN old.quantity IS NOT new.quantity BEGIN
+                    INSERT INTO stock_movements (product_type, item_id, change, quantity_after)
+                    VALUES ('{table}', new.id, new.quantity - old.quantity, new.quantity);
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_stock_delete AFTER DELETE ON {table}
+                WHEN old.quantity != 0 BEGIN
+                    INSERT INTO stock_movements (product_type, item_id, change, quantity_after)
+                    VALUES ('{table}', old.id, -old.quantity, 0);
+                END
+            ''')
+    
+    def _create_search_index(self, cursor, table: str, columns, progress=None):
+        """Create the FTS5 shadow table and sync triggers for a table with an id key"""
+        fts_table = f'{table}_fts'
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts_table,))
+        exists = cursor.fetchone() is not None
+        
+        column_list = ', '.join(columns)
+        normalized = ', '.join(f'normalize_ar(new.{c})' for c in columns)
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table}
+            USING fts5({column_list}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {normalized});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM {fts_table} WHERE rowid = old.id;
+            END
+        ''')
+        # Only re-index when the indexed text really changed (bulk imports rewrite
+        # every column); older databases get their unguarded trigger replaced
+        changed = ' OR '.join(f'old.{c} IS NOT new.{c}' for c in columns)
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                       (f'{table}_fts_update',))
+        row = cursor.fetchone()
+        if row is not None and 'WHEN' not in row[0]:
+            cursor.execute(f'DROP TRIGGER {table}_fts_update')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF {column_list} ON {table}
+            WHEN {changed} BEGIN
+                DELETE FROM {fts_table} WHERE rowid = old.id;
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {normalized});
+            END
+        ''')
+        
+        # Index rows that existed before the search index did
+        if not exists:
+            self._populate_search_index(cursor, table, columns, progress)
+    
+    def _populate_search_index(self, cursor, table: str, columns, progress=None):
+        """(Re)fill an FTS5 shadow table from its source table"""
+        fts_table = f'{table}_fts'
+        column_list = ', '.join(columns)
+        normalized = ', '.join(f'normalize_ar({c})' for c in columns)
+        cursor.execute(f'DELETE FROM {fts_table}')
+        cursor.execute(f'SELECT COUNT(*) FROM {table}')
+        total = cursor.fetchone()[0]
+        # Indexed in batches so large tables can report progress
+        done = 0
+        for after, upto in self._id_ranges(cursor, table):
+            cursor.execute(f'''
+                INSERT INTO {fts_table} (rowid, {column_list})
+                SELECT id, {normalized} FROM {table} WHERE id > ? AND id <= ?
+            ''', (after, upto))
+            done += max(cursor.rowcount, 0)
+            if progress:
+                progress(done, total)
+    
+    def rebuild_search_index(self):
+        """Rebuild all full-text search indexes (e.g. after the normalization rules change)"""
+        if not self.fts_enabled:
+            return
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            indexes = dict(SEARCH_INDEXES, catalog_index=CATALOG_SEARCH_COLUMNS)
+            for table, columns in indexes.items():
+                self._populate_search_index(cursor, table, columns)
+            for table in indexes:
+                cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('optimize')")
+    
+    def _search(self, table: str, search_term: str, order_by: str,
+                limit: Optional[int] = None) -> List:
+        """Ranked prefix search over a product table's FTS index (best matches first)"""
+        cursor = self._record_cursor(table)
+        columns = SEARCH_INDEXES[table]
+        select = _select_list(table)
+        
+        if not self.fts_enabled:
+            # No FTS5 in this SQLite build: plain substring scan
+            search_pattern = f'%{search_term}%'
+            where = ' OR '.join(f'{c} LIKE ?' for c in columns)
+            sql = f'SELECT {select} FROM {table} t WHERE {where} ORDER BY t.{order_by}'
+            params = [search_pattern] * len(columns)
+        else:
+            query = build_fts_query(search_term)
+            if query is None:
+                sql = f'SELECT {select} FROM {table} t ORDER BY t.{order_by}'
+                params = []
+            elif limit is None:
+                sql = f'''
+                    SELECT {select} FROM {table}_fts
+                    JOIN {table} t ON t.id = {table}_fts.rowid
+                    WHERE {table}_fts MATCH ?
+                    ORDER BY {table}_fts.rank, t.{order_by}
+                '''
+                params = [query]
+            else:
+                # Ranking every match of a short prefix is the slow part, so only
+                # rank a bounded window of candidates when the caller wants the top rows
+                sql = f'''
+                    SELECT {select} FROM (
+                        SELECT rowid, rank FROM {table}_fts WHERE {table}_fts MATCH ? LIMIT ?
+                    ) m
+                    JOIN {table} t ON t.id = m.rowid
+                    ORDER BY m.rank, t.{order_by}
+                '''
+                params = [query, limit * SEARCH_RANK_WINDOW]
+        
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    
+    def _filter_sql(self, table: str, search: Optional[str], ranked: bool = False):
+        """FROM/WHERE clause (aliasing the table as t) for an optional search term.
+        
+        Returns (sql, params, rank order or None). Fans also match on the text of
+        their catalog PDF (catalog_index), ranked after direct matches; the rank is
+        only computed when ranked is true (it costs a pass over every match).
+        """
+        if not search or not search.strip():
+            return f'{table} t', [], None
+        if not self.fts_enabled:
+            search_pattern = f'%{search}%'
+            columns = SEARCH_INDEXES[table]
+            where = ' OR '.join(f't.{c} LIKE ?' for c in columns)
+            params = [search_pattern] * len(columns)
+            if table == 'fans':
+                where += (f' OR {_catalog_key_sql("t.catalog_file_path")} IN '
+                          f'(SELECT {_catalog_key_sql("path")} FROM catalog_index '
+                          f'WHERE name LIKE ? OR content LIKE ?)')
+                params += [search_pattern] * 2
+            return f'{table} t WHERE {where}', params, None
+        query = build_fts_query(search)
+        if query is None:
+            return f'{table} t', [], None
+        if table == 'fans' and self._has_linked_catalogs():
+            # Direct matches, then fans matched only through their datasheet
+            direct, catalog = ('rowid, 0 AS tier, rank', 'f.id, 1, c.rank') if ranked else ('rowid', 'f.id')
+            return (f'''
+                (SELECT {direct} FROM fans_fts WHERE fans_fts MATCH ?
+                 UNION ALL
+                 SELECT {catalog} FROM catalog_index_fts c
+                 JOIN catalog_index ci ON ci.id = c.rowid
+                 JOIN fans f ON {_catalog_key_sql('f.catalog_file_path')} = {_catalog_key_sql('ci.path')}
+                 WHERE catalog_index_fts MATCH ?
+                   AND f.id NOT IN (SELECT rowid FROM fans_fts WHERE fans_fts MATCH ?)) m
+                JOIN fans t ON t.id = m.rowid
+            ''', [query, query, query], 'm.tier, m.rank' if ranked else None)
+        return (f'{table}_fts JOIN {table} t ON t.id = {table}_fts.rowid '
+                f'WHERE {table}_fts MATCH ?', [query], f'{table}_fts.rank')
+    
+    def _has_linked_catalogs(self) -> bool:
+        """Whether any fan links to an indexed catalog PDF"""
+        cursor = self.get_connection().cursor()
+        cursor.execute(f'''
+            SELECT EXISTS (SELECT 1 FROM catalog_index ci WHERE EXISTS
+                           (SELECT 1 FROM fans f WHERE {_catalog_key_sql('f.catalog_file_path')}
+                                                     = {_catalog_key_sql('ci.path')}))
+        ''')
+        return bool(cursor.fetchone()[0])
+    
+    def _query_sql(self, table: str, order_by: Optional[str], desc: bool,
+                   search: Optional[str]):
+        """SELECT statement and parameters shared by query() and iter_records()"""
+        if table not in SORTABLE_COLUMNS:
+            raise ValueError(f"Unknown table: {table}")
+        if order_by is not None and order_by not in SORTABLE_COLUMNS[table]:
+            raise ValueError(f"Cannot sort {table} by {order_by}")
         
-        # Migrate existing flexible table if it has name/quantity columns
+        from_sql, params, rank_order = self._filter_sql(table, search, ranked=order_by is None)
+        direction = 'DESC' if desc else 'ASC'
+        if order_by is None:
+            order_sql = f'{rank_order}, t.id' if rank_order else f't.id {direction}'
+        elif order_by == 'id':
+            order_sql = f't.id {direction}'
+        else:
+            collate = ' COLLATE NOCASE' if SORTABLE_COLUMNS[table][order_by] == 'TEXT' else ''
+            order_sql = f't.{order_by}{collate} {direction}, t.id {direction}'
+        return f'SELECT {_select_list(table)} FROM {from_sql} ORDER BY {order_sql}', params
+    
+    def query(self, table: str, order_by: Optional[str] = 'id', desc: bool = False,
+              limit: Optional[int] = None, offset: int = 0,
+              search: Optional[str] = None) -> List:
+        """Get one sorted page of a product table as records, optionally filtered by a search term.
+        
+        order_by must be one of SORTABLE_COLUMNS[table]; None sorts search results
+        by relevance (and everything else by id). Ties are broken by id so pages
+        never overlap.
+        """
+        sql, params = self._query_sql(table, order_by, desc, search)
+        cursor = self._record_cursor(table)
+        cursor.execute(sql + ' LIMIT ? OFFSET ?', params + [-1 if limit is None else limit, offset])
+        return cursor.fetchall()
+    
+    def iter_records(self, table: str, order_by: Optional[str] = 'id', desc: bool = False,
+                     search: Optional[str] = None, batch_size: int = 500) -> Iterator:
+        """Stream every (matching) record of a product table without building a list.
+        
+        Rows are read batch_size at a time from one cursor, so memory stays flat
+        however large the table is. The read sees the database as of its start.
+        """
+        cursor = self._record_cursor(table)
+        sql, params = self._query_sql(table, order_by, desc, search)
+        cursor.execute(sql, params)
         try:
-            cursor.execute("PRAGMA table_info(flexible)")
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'name' in columns or 'quantity' in columns:
-                # Create new table without name and quantity
-                cursor.execute('''
-                    CREATE TABLE flexible_new (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        description TEXT,
-                        diameter TEXT,
-                        collection TEXT,
-                        meter REAL NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                # Copy data (excluding name and quantity)
-                cursor.execute('''
-                    INSERT INTO flexible_new (id, description, diameter, collection, meter, created_at, updated_at)
-                    SELECT id, description, diameter, collection, meter, created_at, updated_at
-                    FROM flexible
-                ''')
-                # Drop old table and rename new one
-                cursor.execute('DROP TABLE flexible')
-                cursor.execute('ALTER TABLE flexible_new RENAME TO flexible')
-        except sqlite3.OperationalError:
-            pass  # Table might not exist yet or migration already done
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+    
+    # ===== INCREMENTAL SYNC =====
+    
+    def iter_changed_records(self, table: str, since: Optional[str] = None,
+                             after_seq: Optional[int] = None, batch_size: int = 500) -> Iterator:
+        """Stream records added or updated at or after since (all records if None), oldest first.
         
-        # Add description column to existing databases (migration)
+        updated_at has one-second resolution, so rows from the watermark's own
+        second are returned again; applying them twice is harmless. It is also
+        taken when a statement runs, not when it commits, so use since only to
+        redo an export by hand.
+        after_seq: instead, the records whose row or stock changed after that
+        change number (get_replica_state()['seq']), in id order. Read the number
+        before the records: everything committed later is numbered above it.
+        """
+        if table not in PRODUCT_TABLES:
+            raise ValueError(f"Unknown table: {table}")
+        cursor = self._record_cursor(table)
+        sql = f'SELECT {_select_list(table)} FROM {table} t'
+        params = []
+        order = ' ORDER BY t.updated_at, t.id'
+        if after_seq is not None:
+            stock = f'''
+                UNION SELECT v.item_id FROM replica_counters c
+                JOIN row_versions v ON v.product_type = c.product_type AND v.gid = c.gid
+                WHERE c.product_type = ? AND c.seq > ?''' if table in STOCK_TABLES else ''
+            sql += f'''
+                WHERE t.id IN (SELECT item_id FROM row_versions
+                               WHERE product_type = ? AND seq > ?{stock})'''
+            params += [table, after_seq] * (2 if stock else 1)
+            order = ' ORDER BY t.id'
+        elif since is not None:
+            sql += ' WHERE t.updated_at >= ?'
+            params.append(since)
+        cursor.execute(sql + order, params)
         try:
-            cursor.execute('ALTER TABLE fans ADD COLUMN description TEXT')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+    
+    def get_deleted_items(self, table: str, since: Optional[str] = None,
+                          after_seq: Optional[int] = None) -> List[Tuple[int, str]]:
+        """(item_id, deleted_at) of items deleted at or after since, or after change
+        number after_seq (as in iter_changed_records), oldest first"""
+        sql = 'SELECT item_id, deleted_at FROM deleted_items WHERE product_type = ?'
+        params = [table]
+        if after_seq is not None:
+            sql += ' AND seq > ?'
+            params.append(after_seq)
+        elif since is not None:
+            sql += ' AND deleted_at >= ?'
+            params.append(since)
+        cursor = self.get_connection().cursor()
+        cursor.execute(sql + ' ORDER BY deleted_at, item_id', params)
+        return [tuple(row) for row in cursor.fetchall()]
+    
+    def prune_deleted_items(self, retention_days: float = TOMBSTONE_RETENTION_DAYS) -> int:
+        """Drop the tombstones no sync target needs any more; returns the number dropped.
         
+        A tombstone is kept while it is newer than retention_days, or while some
+        target has not received it yet: its CHANGE_WATERMARK is below the
+        tombstone's change number (or, for a target last exported to by an older
+        version, its '<table>.deleted' time is not past it). With no targets, only
+        the retention period applies.
+        """
+        with self.transaction('deleted_items') as conn:
+            cursor = conn.execute('''
+                DELETE FROM deleted_items
+                WHERE deleted_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+                  AND NOT EXISTS (SELECT 1 FROM sync_state
+                                  WHERE name = ? AND CAST(watermark AS INTEGER) < deleted_items.seq)
+                  AND NOT EXISTS (SELECT 1 FROM sync_state
+                                  WHERE name = deleted_items.product_type || '.deleted'
+                                    AND watermark <= deleted_items.deleted_at)
+            ''', (f'-{float(retention_days)} days', CHANGE_WATERMARK))
+            return max(cursor.rowcount, 0)
+    
+    def get_sync_watermarks(self, target: str) -> Dict[str, str]:
+        """Watermarks stored for a sync target by set_sync_watermarks"""
+        cursor = self.get_connection().cursor()
+        cursor.execute('SELECT name, watermark FROM sync_state WHERE target = ?', (target,))
+        return {name: watermark for name, watermark in cursor.fetchall()}
+    
+    def set_sync_watermarks(self, target: str, watermarks: Dict[str, str], replace: bool = False):
+        """Remember how far a sync target has been brought up to date (replace: drop
+        the target's other watermarks)"""
+        with self.transaction('sync_state') as conn:
+            if replace:
+                conn.execute('DELETE FROM sync_state WHERE target = ?', (target,))
+            conn.executemany('''
+                INSERT OR REPLACE INTO sync_state (target, name, watermark) VALUES (?, ?, ?)
+            ''', [(target, name, watermark) for name, watermark in watermarks.items()])
+    
+    # ===== REPLICATION =====
+    
+    def get_replica_state(self) -> Dict:
+        """This site's id, Lamport clock and last change number"""
+        cursor = self.get_connection().cursor()
+        cursor.execute('SELECT site, clock, seq FROM replica_state WHERE id = 1')
+        return dict(cursor.fetchone())
+    
+    def new_replica_site(self) -> str:
+        """Give this database a new site id (after copying inventory.db to another site).
         
+        Rows and stock changes already recorded keep the id of the site that made
+        them; changes made from now on are recorded under the new id.
+        """
+        with self.transaction('replica_state') as conn:
+            conn.execute("UPDATE replica_state SET site = lower(hex(randomblob(6))) WHERE id = 1")
+            return conn.execute('SELECT site FROM replica_state WHERE id = 1').fetchone()[0]
+    
+    def iter_replica_changes(self, since: int = 0, upto: Optional[int] = None) -> Iterator[Dict]:
+        """Stream the changes numbered since < seq <= upto: rows, deletions, then stock counters.
         
-        conn.commit()
-        conn.close()
+        Rows are read as they are now; their version says which change that is.
+        """
+        if upto is None:
+            upto = self.get_replica_state()['seq']
+        cursor = self.get_connection().cursor()
+        for table in PRODUCT_TABLES:
+            columns = REPLICATED_COLUMNS[table]
+            cursor.execute(f'''
+                SELECT v.gid, v.clock, v.site, v.deleted, {', '.join(f't.{c}' for c in columns)}
+                FROM row_versions v LEFT JOIN {table} t ON t.id = v.item_id
+                WHERE v.product_type = ? AND v.seq > ? AND v.seq <= ?
+                ORDER BY v.seq
+            ''', (table, since, upto))
+            for row in cursor:
+                change = {'op': 'delete' if row[3] else 'upsert', 't': table,
+                          'g': row[0], 'c': row[1], 's': row[2]}
+                if not row[3]:
+                    change['row'] = dict(zip(columns, row[4:]))
+                yield change
+        cursor.execute('''
+            SELECT product_type, gid, site, total, version FROM replica_counters
+            WHERE seq > ? AND seq <= ? ORDER BY seq
+        ''', (since, upto))
+        for product_type, gid, site, total, version in cursor:
+            yield {'op': 'stock', 't': product_type, 'g': gid, 's': site, 'n': total, 'v': version}
+    
+    def apply_replica_changes(self, changes: Iterable[Dict]) -> Dict[str, int]:
+        """Apply changes from another site in one transaction; applying them again changes nothing.
+        
+        Conflicts are settled per row by version: the change with the higher Lamport
+        clock wins, the higher site id breaks ties. A deletion always wins. Stock
+        counters add up the quantity changes made at every site.
+        """
+        stats = dict.fromkeys(('inserted', 'updated', 'deleted', 'stock', 'unchanged', 'conflicts'), 0)
+        with self.transaction(*PRODUCT_TABLES) as conn:
+            cursor = conn.cursor()
+            site, clock, seq = cursor.execute(
+                'SELECT site, clock, seq FROM replica_state WHERE id = 1').fetchone()
+            # Writes below are remote changes: keep the triggers from recording them as local
+            cursor.execute('UPDATE replica_state SET applying = 1 WHERE id = 1')
+            for change in changes:
+                table = change['t']
+                if table not in PRODUCT_TABLES:
+                    raise ValueError(f"Unknown table in changeset: {table}")
+                if change['op'] == 'stock':
+                    result = self._apply_stock_counter(cursor, change, seq + 1)
+                else:
+                    clock = max(clock, change['c'])
+                    result = self._apply_row_change(cursor, change, seq + 1)
+                stats[result] += 1
+                if result not in ('unchanged', 'conflicts'):
+                    seq += 1  # Numbered like a local change, so it is passed on to other peers
+            cursor.execute('UPDATE replica_state SET clock = ?, seq = ?, applying = 0 WHERE id = 1',
+                           (clock, seq))
+        return stats
+    
+    def _apply_row_change(self, cursor, change: Dict, seq: int) -> str:
+        """Apply one remote upsert or delete; returns the stats key it counts towards"""
+        table, gid = change['t'], change['g']
+        version = (change['c'], change['s'])
+        cursor.execute('''
+            SELECT item_id, clock, site, deleted FROM row_versions WHERE product_type = ? AND gid = ?
+        ''', (table, gid))
+        local = cursor.fetchone()
+        
+        if change['op'] == 'delete':
+            if local is not None and local['deleted']:
+                return 'unchanged'
+            if local is not None:
+                cursor.execute(f'DELETE FROM {table} WHERE id = ?', (local['item_id'],))
+            # Kept as a tombstone so the row is not brought back by an older change
+            cursor.execute('''
+                INSERT OR REPLACE INTO row_versions (product_type, gid, item_id, clock, site, seq, deleted)
+                VALUES (?, ?, NULL, ?, ?, ?, 1)
+            ''', (table, gid, change['c'], change['s'], seq))
+            return 'deleted'
+        
+        columns = REPLICATED_COLUMNS[table]
+        values = [change['row'].get(c) for c in columns]
+        if local is None:
+            # Stock counters may have arrived before the row itself
+            quantity = ''
+            params = values
+            if table in STOCK_TABLES:
+                quantity = ', quantity'
+                cursor.execute('SELECT COALESCE(SUM(total), 0) FROM replica_counters '
+                               'WHERE product_type = ? AND gid = ?', (table, gid))
+                params = values + [cursor.fetchone()[0]]
+            cursor.execute(f'''
+                INSERT INTO {table} ({', '.join(columns)}{quantity})
+                VALUES ({', '.join('?' * len(params))})
+            ''', params)
+            cursor.execute('''
+                INSERT INTO row_versions (product_type, gid, item_id, clock, site, seq)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (table, gid, cursor.lastrowid, change['c'], change['s'], seq))
+            return 'inserted'
+        
+        if local['deleted']:
+            return 'unchanged'
+        if version <= (local['clock'], local['site']):
+            # Already applied, or superseded; a loser from another site is a conflict
+            return 'unchanged' if version == (local['clock'], local['site']) or \
+                change['s'] == local['site'] else 'conflicts'
+        cursor.execute(f'''
+            UPDATE {table} SET {', '.join(f'{c} = ?' for c in columns)}, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', values + [local['item_id']])
+        cursor.execute('''
+            UPDATE row_versions SET clock = ?, site = ?, seq = ? WHERE product_type = ? AND gid = ?
+        ''', (change['c'], change['s'], seq, table, gid))
+        return 'updated'
+    
+    def _apply_stock_counter(self, cursor, change: Dict, seq: int) -> str:
+        """Bring one site's stock counter for a row up to date and move the quantity by the difference"""
+        table, gid, site = change['t'], change['g'], change['s']
+        if table not in STOCK_TABLES:
+            raise ValueError(f"{table} has no stock counters")
+        cursor.execute('''
+            SELECT total, version FROM replica_counters WHERE product_type = ? AND gid = ? AND site = ?
+        ''', (table, gid, site))
+        current = cursor.fetchone()
+        if current is not None and change['v'] <= current['version']:
+            return 'unchanged'
+        difference = change['n'] - (current['total'] if current is not None else 0)
+        cursor.execute('''
+            INSERT OR REPLACE INTO replica_counters (product_type, gid, site, total, version, seq)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (table, gid, site, change['n'], change['v'], seq))
+        if difference:
+            cursor.execute(f'''
+                UPDATE {table} SET quantity = quantity + ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = (SELECT item_id FROM row_versions WHERE product_type = ? AND gid = ?)
+            ''', (difference, table, gid))
+        return 'stock'
+    
+    def count(self, table: str, search: Optional[str] = None) -> int:
+        """Count rows of a product table, optionally filtered by a search term"""
+        if table not in SORTABLE_COLUMNS:
+            raise ValueError(f"Unknown table: {table}")
+        from_sql, params, _ = self._filter_sql(table, search)
+        cursor = self.get_connection().cursor()
+        cursor.execute(f'SELECT COUNT(*) FROM {from_sql}', params)
+        return cursor.fetchone()[0]
+    
+    # ===== CATALOG INDEX =====
+    
+    def get_linked_catalog_paths(self) -> List[str]:
+        """Distinct catalog_file_path values of the fans"""
+        cursor = self.get_connection().cursor()
+        cursor.execute("SELECT DISTINCT catalog_file_path FROM fans "
+                       "WHERE catalog_file_path IS NOT NULL AND catalog_file_path != ''")
+        return [row[0] for row in cursor.fetchall()]
+    
+    def get_catalog_stamps(self) -> Dict[str, Tuple[int, int]]:
+        """{path: (mtime in ns, size)} of every indexed catalog file"""
+        cursor = self.get_connection().cursor()
+        cursor.execute('SELECT path, mtime, size FROM catalog_index')
+        return {path: (mtime, size) for path, mtime, size in cursor.fetchall()}
+    
+    def save_catalog_entry(self, path: str, mtime: int, size: int, pages: int = 0,
+                           name: Optional[str] = None, content: Optional[str] = None,
+                           specs: Optional[Dict[str, str]] = None, error: Optional[str] = None):
+        """Store (or replace) the extracted text and specs of one catalog file"""
+        specs = specs or {}
+        values = (mtime, size, pages, name, content,
+                  *(specs.get(column) for column in CATALOG_SPEC_COLUMNS), error)
+        with self.transaction('catalog_index') as conn:
+            # UPDATE first so the row keeps its id and the FTS triggers see an update
+            cursor = conn.execute('''
+                UPDATE catalog_index SET mtime = ?, size = ?, pages = ?, name = ?, content = ?,
+                    airflow = ?, watts = ?, speeds = ?, dimensions = ?, error = ?,
+                    indexed_at = CURRENT_TIMESTAMP
+                WHERE path = ?
+            ''', values + (path,))
+            if cursor.rowcount == 0:
+                conn.execute('''
+                    INSERT INTO catalog_index (mtime, size, pages, name, content,
+                        airflow, watts, speeds, dimensions, error, path)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', values + (path,))
+    
+    def delete_catalog_entries(self, paths: Iterable[str]) -> int:
+        """Drop catalog files that no longer exist; returns the number removed"""
+        with self.transaction('catalog_index') as conn:
+            cursor = conn.executemany('DELETE FROM catalog_index WHERE path = ?',
+                                      [(path,) for path in paths])
+            return max(cursor.rowcount, 0)
+    
+    def get_catalog_entry(self, path: str) -> Optional[Dict]:
+        """Indexed specs and text of a catalog file (found by file name, so a fan's
+        catalog_file_path from another computer works), or None if it has not been indexed"""
+        cursor = self.get_connection().cursor()
+        cursor.execute(f'SELECT * FROM catalog_index WHERE {_catalog_key_sql("path")} = ? '
+                       f'ORDER BY path = ? DESC, id LIMIT 1', (catalog_key(path), path))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    
+    # ===== BULK IMPORT =====
+    
+    def _coerce_bulk_row(self, table: str, row: Dict, row_number: int) -> tuple:
+        """Convert an incoming row (e.g. CSV strings) to a parameter tuple in BULK_COLUMNS order"""
+        values = []
+        for column, column_type in BULK_COLUMNS[table].items():
+            value = row.get(column)
+            if isinstance(value, str):
+                value = value.strip()
+            if value is None or value == '':
+                if column in BULK_REQUIRED[table]:
+                    raise ValueError(f"Row {row_number}: '{column}' is required")
+                values.append(None)
+                continue
+            try:
+                if column_type is int:
+                    value = int(float(value))
+                elif column_type is float:
+                    value = float(value)
+                else:
+                    value = str(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Row {row_number}: invalid {column} value {value!r}")
+            values.append(value)
+        return tuple(values)
+    
+    def _bulk_statements(self, table: str, on_conflict: str):
+        """UPDATE and INSERT statements for a bulk upsert (both take the same parameters)"""
+        columns = list(BULK_COLUMNS[table])
+        keys = NATURAL_KEYS[table]
+        # Named parameters, so UPDATE and INSERT can share one dict per row
+        if table == 'fans':
+            key_match = 'name = :name COLLATE NOCASE'
+        else:
+            key_match = ' AND '.join(f'{key} IS :{key}' for key in keys)
+        
+        # Optional columns missing from the file keep their current value
+        assignments = ', '.join(
+            f'{c} = :{c}' if c in BULK_REQUIRED[table] else f'{c} = COALESCE(:{c}, {c})'
+            for c in columns if c not in keys)
+        update_sql = None
+        if on_conflict == 'update':
+            # Rows identical to the stored item are left alone (re-imported price sheets)
+            unchanged = ' AND '.join(
+                f'{c} IS :{c}' if c in BULK_REQUIRED[table] else f'{c} IS COALESCE(:{c}, {c})'
+                for c in columns if c not in keys)
+            update_sql = (f'UPDATE {table} SET {assignments}, updated_at = CURRENT_TIMESTAMP '
+                          f'WHERE {key_match} AND NOT ({unchanged})')
+        
+        insert_values = ', '.join(
+            'COALESCE(:quantity, 0)' if c == 'quantity' else f':{c}' for c in columns)
+        insert_sql = (f'INSERT INTO {table} ({", ".join(columns)}) SELECT {insert_values} '
+                      f'WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {key_match})')
+        return update_sql, insert_sql
+    
+    def _bulk_upsert(self, table: str, rows, chunk_size: int = BULK_CHUNK_SIZE,
+                     on_conflict: str = 'update', progress=None) -> Dict:
+        """Stream rows into a product table with executemany, one transaction per chunk.
+        
+        on_conflict: 'update' overwrites items with the same natural key,
+        'skip' leaves them untouched and only inserts new items.
+        Returns counts of rows read and of items inserted, updated and left unchanged.
+        """
+        if on_conflict not in ('update', 'skip'):
+            raise ValueError(f"on_conflict must be 'update' or 'skip', not {on_conflict!r}")
+        update_sql, insert_sql = self._bulk_statements(table, on_conflict)
+        columns = list(BULK_COLUMNS[table])
+        stats = {'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0}
+        
+        def flush(chunk, row_count):
+            with self.transaction(table) as conn:
+                cursor = conn.cursor()
+                updated = 0
+                if update_sql:
+                    cursor.executemany(update_sql, chunk)
+                    updated = max(cursor.rowcount, 0)
+                cursor.executemany(insert_sql, chunk)
+                inserted = max(cursor.rowcount, 0)
+            stats['inserted'] += inserted
+            stats['updated'] += updated
+            stats['unchanged'] += len(chunk) - inserted - updated
+            stats['rows'] += row_count
+            if progress:
+                progress(stats['rows'])
+        
+        # Rows repeating a natural key inside a chunk are merged here, because every
+        # UPDATE in the chunk runs before the INSERT that would create the item
+        keys = NATURAL_KEYS[table]
+        chunk = {}
+        pending = 0
+        for row_number, row in enumerate(rows, 1):
+            params = dict(zip(columns, self._coerce_bulk_row(table, row, row_number)))
+            key = tuple(_nocase(params[k]) for k in keys)
+            previous = chunk.get(key)
+            if previous is None:
+                chunk[key] = params
+            elif on_conflict == 'update':
+                previous.update((c, v) for c, v in params.items()
+                                if v is not None and c not in keys)
+            pending += 1
+            if pending >= chunk_size:
+                flush(list(chunk.values()), pending)
+                chunk = {}
+                pending = 0
+        if pending:
+            flush(list(chunk.values()), pending)
+        return stats
+    
+    def bulk_upsert_fans(self, rows, chunk_size: int = BULK_CHUNK_SIZE,
+                         on_conflict: str = 'update', progress=None) -> Dict:
+        """Insert or update fans (matched by name) from an iterable of dicts"""
+        return self._bulk_upsert('fans', rows, chunk_size, on_conflict, progress)
+    
+    def bulk_upsert_sheet_metal(self, rows, chunk_size: int = BULK_CHUNK_SIZE,
+                                on_conflict: str = 'update', progress=None) -> Dict:
+        """Insert or update sheet metal (matched by thickness, dimensions and measurement)"""
+        return self._bulk_upsert('sheet_metal', rows, chunk_size, on_conflict, progress)
+    
+    def bulk_upsert_flexible(self, rows, chunk_size: int = BULK_CHUNK_SIZE,
+                             on_conflict: str = 'update', progress=None) -> Dict:
+        """Insert or update flexible (matched by description, diameter and collection)"""
+        return self._bulk_upsert('flexible', rows, chunk_size, on_conflict, progress)
     
     def add_fan(self, name: str, description: Optional[str], airflow: Optional[str], 
                 price_wholesale: float, price_retail: float, quantity: int, 
                 catalog_file_path: Optional[str] = None) -> int:
         """Add a new fan to inventory"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO fans (name, description, airflow, price_wholesale, price_retail, quantity, catalog_file_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (name, description, airflow, price_wholesale, price_retail, quantity, catalog_file_path))
-        
-        fan_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.transaction('fans') as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO fans (name, description, airflow, price_wholesale, price_retail, quantity, catalog_file_path)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (name, description, airflow, price_wholesale, price_retail, quantity, catalog_file_path))
+            
+            fan_id = cursor.lastrowid
         return fan_id
     
     def update_fan(self, fan_id: int, name: str, description: Optional[str], 
                    airflow: Optional[str], price_wholesale: float, price_retail: float, quantity: int,
                    catalog_file_path: Optional[str] = None):
         """Update an existing fan"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE fans 
-            SET name = ?, description = ?, airflow = ?, price_wholesale = ?, price_retail = ?, 
-                quantity = ?, catalog_file_path = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (name, description, airflow, price_wholesale, price_retail, quantity, catalog_file_path, fan_id))
-        
-        conn.commit()
-        conn.close()
+        with self.transaction('fans') as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                UPDATE fans 
+                SET name = ?, description = ?, airflow = ?, price_wholesale = ?, price_retail = ?, 
+                    quantity = ?, catalog_file_path = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (name, description, airflow, price_wholesale, price_retail, quantity, catalog_file_path, fan_id))
     
     def delete_fan(self, fan_id: int):
         """Delete a fan from inventory"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM fans WHERE id = ?', (fan_id,))
-        
-        conn.commit()
-        conn.close()
+        with self.transaction('fans') as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM fans WHERE id = ?', (fan_id,))
     
-    def get_all_fans(self) -> List[Dict]:
+    def get_all_fans(self) -> List[Fan]:
         """Get all fans from inventory"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = self._record_cursor('fans')
         
-        cursor.execute('SELECT * FROM fans ORDER BY name')
-        fans = [dict(row) for row in cursor.fetchall()]
+        cursor.execute(f'SELECT {_select_list("fans")} FROM fans t ORDER BY t.name')
+        fans = cursor.fetchall()
         
-        conn.close()
         return fans
     
-    def get_fan_by_id(self, fan_id: int) -> Optional[Dict]:
+    def get_fan_by_id(self, fan_id: int) -> Optional[Fan]:
         """Get a specific fan by ID"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        return self._get_by_id('fans', fan_id)
+    
+    def search_fans(self, search_term: str, limit: Optional[int] = None) -> List[Fan]:
+        """Search fans by name, description, or airflow"""
+        return self._search('fans', search_term, 'name', limit)
+    
+    def update_quantity(self, fan_id: int, quantity_change: int):
+        """Update fan quantity (add or subtract, never below zero)"""
+        # One statement: concurrent sales cannot overwrite each other's change
+        with self.transaction('fans') as conn:
+            conn.execute('''
+                UPDATE fans 
+                SET quantity = max(0, quantity + ?), updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (quantity_change, fan_id))
+    
+    # ===== STOCK MOVEMENTS =====
+    
+    def update_quantities(self, changes: Iterable[Tuple[int, int]], product_type: str = 'fans'):
+        """Apply many (item_id, quantity_change) pairs in one transaction (e.g. a batch of sales)"""
+        if product_type not in STOCK_TABLES:
+            raise ValueError(f"No stock is kept for {product_type!r}")
+        with self.transaction(product_type) as conn:
+            conn.executemany(f'''
+                UPDATE {product_type}
+                SET quantity = max(0, quantity + ?), updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', ((change, item_id) for item_id, change in changes))
+    
+    def get_stock_movements(self, product_type: str, item_id: int,
+                            since=None, until=None) -> List[Dict]:
+        """Recorded quantity changes of one item, oldest first (since/until bound created_at)"""
+        sql = 'SELECT * FROM stock_movements WHERE product_type = ? AND item_id = ?'
+        params = [product_type, item_id]
+        if since is not None:
+            sql += ' AND created_at >= ?'
+            params.append(_ledger_time(since))
+        if until is not None:
+            sql += ' AND created_at <= ?'
+            params.append(_ledger_time(until))
+        cursor = self.get_connection().cursor()
+        cursor.execute(sql + ' ORDER BY created_at, id', params)
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def get_quantity_at(self, product_type: str, item_id: int, at) -> int:
+        """Stock level of one item at a past moment (UTC string or datetime)"""
+        return self.get_stock_levels_at(product_type, at, item_id).get(item_id, 0)
+    
+    def get_stock_levels_at(self, product_type: str, at, item_id: Optional[int] = None) -> Dict[int, int]:
+        """Stock levels {item_id: quantity} at a past moment (items with no stock left out).
         
-        cursor.execute('SELECT * FROM fans WHERE id = ?', (fan_id,))
-        row = cursor.fetchone()
+        Rebuilt as the current quantity minus every change recorded after the moment,
+        so it also works for stock that was entered before the ledger existed.
+        """
+        if product_type not in STOCK_TABLES:
+            raise ValueError(f"No stock is kept for {product_type!r}")
+        item_filter = '' if item_id is None else ' AND item_id = ?'
+        id_filter = '' if item_id is None else ' WHERE id = ?'
+        extra = () if item_id is None else (item_id,)
         
-        conn.close()
-        return dict(row) if row else None
+        cursor = self.get_connection().cursor()
+        cursor.execute(f'SELECT id, quantity FROM {product_type}{id_filter}', extra)
+        levels = {row[0]: row[1] for row in cursor.fetchall()}
+        cursor.execute(f'''
+            SELECT item_id, SUM(change) FROM stock_movements
+            WHERE product_type = ? AND created_at > ?{item_filter}
+            GROUP BY item_id
+        ''', (product_type, _ledger_time(at)) + extra)
+        for movement_item, later_change in cursor.fetchall():
+            levels[movement_item] = levels.get(movement_item, 0) - later_change
+        return {item: quantity for item, quantity in levels.items() if quantity}
     
-    def search_fans(self, search_term: str) -> List[Dict]:
-        """Search fans by name, description, or airflow"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    # ===== PRICE HISTORY =====
+    
+    def get_prices_at(self, product_type: str, at,
+                      item_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict]:
+        """Prices {item_id: {column: price}} in effect at a past moment (UTC string or datetime).
         
-        search_pattern = f'%{search_term}%'
-        cursor.execute('''
-            SELECT * FROM fans 
-            WHERE name LIKE ? OR description LIKE ? OR airflow LIKE ?
-            ORDER BY name
-        ''', (search_pattern, search_pattern, search_pattern))
+        item_ids: the items to look up (default: every current item). Items with
+        no recorded price at that moment (added later, or changed before the
+        history began) are left out. Each item costs one seek in the covering index.
+        """
+        if product_type not in PRICE_COLUMNS:
+            raise ValueError(f"Unknown product type: {product_type!r}")
+        columns = PRICE_COLUMNS[product_type]
+        at = _ledger_time(at)
+        if item_ids is None:
+            sources = [(f'{product_type} i', ())]
+        else:
+            # Chunks keep the VALUES lists under SQLite's host parameter limit
+            ids = sorted(set(item_ids))
+            sources = []
+            for start in range(0, len(ids), 500):
+                chunk = tuple(ids[start:start + 500])
+                values = ', '.join('(?)' for _ in chunk)
+                sources.append((f'(SELECT column1 AS id FROM (VALUES {values})) i', chunk))
         
-        fans = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return fans
+        cursor = self.get_connection().cursor()
+        prices = {}
+        for items, params in sources:
+            cursor.execute(f'''
+                SELECT h.item_id, {', '.join(f'h.{c}' for c in columns)}
+                FROM (SELECT (SELECT id FROM price_history
+                              WHERE product_type = ? AND item_id = i.id AND changed_at <= ?
+                              ORDER BY changed_at DESC, id DESC LIMIT 1) AS history_id
+                      FROM {items}) latest
+                JOIN price_history h ON h.id = latest.history_id
+            ''', (product_type, at) + params)
+            for row in cursor.fetchall():
+                prices[row[0]] = dict(zip(columns, row[1:]))
+        return prices
     
-    def update_quantity(self, fan_id: int, quantity_change: int):
-        """Update fan quantity (add or subtract)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def get_price_at(self, product_type: str, item_id: int, at) -> Optional[Dict]:
+        """Prices {column: price} of one item at a past moment, or None if not recorded"""
+        return self.get_prices_at(product_type, at, (item_id,)).get(item_id)
+    
+    def get_price_changes(self, product_type: str, since=None, until=None,
+                          item_id: Optional[int] = None) -> List[Dict]:
+        """Recorded price changes, oldest first (since/until bound changed_at).
         
-        cursor.execute('SELECT quantity FROM fans WHERE id = ?', (fan_id,))
-        current_qty = cursor.fetchone()[0]
-        new_qty = max(0, current_qty + quantity_change)
+        Each change has the new prices under the column names and the prices
+        before it under old_<column> (None for an item's first recorded price).
+        """
+        if product_type not in PRICE_COLUMNS:
+            raise ValueError(f"Unknown product type: {product_type!r}")
+        columns = PRICE_COLUMNS[product_type]
+        sql = '''
+            SELECT h.id, h.item_id, h.changed_at, {new}, {old}
+            FROM price_history h
+            LEFT JOIN price_history p ON p.id = (
+                SELECT id FROM price_history
+                WHERE product_type = h.product_type AND item_id = h.item_id
+                  AND (changed_at, id) < (h.changed_at, h.id)
+                ORDER BY changed_at DESC, id DESC LIMIT 1)
+            WHERE h.product_type = ?
+        '''.format(new=', '.join(f'h.{c}' for c in columns),
+                   old=', '.join(f'p.{c} AS old_{c}' for c in columns))
+        params = [product_type]
+        if item_id is not None:
+            sql += ' AND h.item_id = ?'
+            params.append(item_id)
+        if since is not None:
+            sql += ' AND h.changed_at >= ?'
+            params.append(_ledger_time(since))
+        if until is not None:
+            sql += ' AND h.changed_at <= ?'
+            params.append(_ledger_time(until))
+        cursor = self.get_connection().cursor()
+        cursor.execute(sql + ' ORDER BY h.changed_at, h.id', params)
+        return [dict(row) for row in cursor.fetchall()]
+    
+    # ===== BULK REPRICING =====
+    
+    def reprice(self, product_type: str, percent: float = 0.0, amount: float = 0.0,
+                round_to: Optional[float] = None, rounding: str = 'nearest',
+                columns: Optional[Iterable[str]] = None, search: Optional[str] = None,
+                item_ids: Optional[Iterable[int]] = None, dry_run: bool = False) -> Dict:
+        """Change the prices of many items at once: new = old * (1 + percent/100) + amount.
         
-        cursor.execute('''
-            UPDATE fans 
-            SET quantity = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (new_qty, fan_id))
+        The result is never below zero and is rounded to a multiple of round_to
+        (rounding: 'nearest', 'up' or 'down'), or to the cent without round_to
+        (prices are not rounded when neither percent nor amount is given).
+        columns: the price columns to change (default: all of PRICE_COLUMNS[product_type]).
+        search, item_ids: only change the items matching the search term (as in
+        query()) and/or with these ids; neither means every item of the table.
         
-        conn.commit()
-        conn.close()
+        Applied in one transaction; items whose prices would not change are not
+        touched. Returns {'changed': count}. The per-row price history and
+        replication triggers are suspended for the UPDATE (dropped and created
+        again inside the transaction): the history rows and row versions (one
+        Lamport clock tick for the whole change) are written by one statement
+        each instead.
+        dry_run=True changes nothing and returns {'matched', 'changed',
+        'totals': {column: (before, after)}} from one aggregate pass over the
+        items, and 'items': the first REPRICE_PREVIEW_ROWS changed items, each
+        with its natural key columns, old prices and new_<column> prices.
+        """
+        if product_type not in PRICE_COLUMNS:
+            raise ValueError(f"Unknown product type: {product_type!r}")
+        columns = tuple(columns or PRICE_COLUMNS[product_type])
+        unknown = [c for c in columns if c not in PRICE_COLUMNS[product_type]]
+        if unknown or not columns:
+            raise ValueError(f"{product_type} has no price column {', '.join(unknown)}")
+        if rounding not in REPRICE_ROUNDING:
+            raise ValueError(f"rounding must be one of {', '.join(REPRICE_ROUNDING)}")
+        for name, value in (('percent', percent), ('amount', amount), ('round_to', round_to or 0)):
+            if not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise ValueError(f"{name} must be a number")
+        if percent <= -100:
+            raise ValueError("percent must be above -100")
+        if round_to is not None and round_to < 0:
+            raise ValueError("round_to must be positive")
+        
+        new_values = {c: _reprice_expression(c, percent, amount, round_to, rounding) for c in columns}
+        changed = ' OR '.join(f'{c} IS NOT {new_values[c]}' for c in columns)
+        conditions, params = [], []
+        if search and search.strip():
+            from_sql, params, _ = self._filter_sql(product_type, search)
+            conditions.append(f'id IN (SELECT t.id FROM {from_sql})')
+        
+        cursor = self.get_connection().cursor()
+        if item_ids is not None:
+            # A temp table rather than bound parameters, so any number of ids fits one statement
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS reprice_items (id INTEGER PRIMARY KEY)')
+            cursor.execute('DELETE FROM temp.reprice_items')
+            if self._json1:
+                # The whole list as one JSON parameter: far quicker than a statement per id
+                cursor.execute('INSERT OR IGNORE INTO temp.reprice_items (id) '
+                               'SELECT value FROM json_each(?)',
+                               (json.dumps([int(item_id) for item_id in item_ids]),))
+            else:
+                cursor.executemany('INSERT OR IGNORE INTO temp.reprice_items (id) VALUES (?)',
+                                   ((item_id,) for item_id in item_ids))
+            conditions.append('id IN (SELECT id FROM temp.reprice_items)')
+        where = ' AND '.join(conditions) or '1'
+        
+        if not dry_run:
+            cache_size = cursor.execute('PRAGMA cache_size').fetchone()[0]
+            cursor.execute(f'PRAGMA cache_size = {-REPRICE_CACHE_KIB}')
+            try:
+                with self.transaction(product_type) as conn:
+                    return {'changed': self._apply_reprice(conn.cursor(), product_type, new_values,
+                                                           f'({changed}) AND {where}', params)}
+            finally:
+                cursor.execute(f'PRAGMA cache_size = {cache_size}')
+        
+        # The totals in one aggregate pass; the listed items stop at the first changed ones
+        sums = ', '.join(f'COALESCE(SUM({c}), 0), COALESCE(SUM({new_values[c]}), 0)' for c in columns)
+        cursor.execute(f'''
+            SELECT COUNT(*), COALESCE(SUM({changed}), 0), {sums}
+            FROM {product_type} WHERE {where}
+        ''', params)
+        row = cursor.fetchone()
+        totals = {c: (round(row[2 + 2 * i], 2), round(row[3 + 2 * i], 2)) for i, c in enumerate(columns)}
+        
+        keys = NATURAL_KEYS[product_type]
+        cursor.execute(f'''
+            SELECT id, {', '.join(keys + columns)},
+                   {', '.join(f'{new_values[c]} AS new_{c}' for c in columns)}
+            FROM {product_type} WHERE ({changed}) AND {where}
+            ORDER BY id LIMIT {REPRICE_PREVIEW_ROWS}
+        ''', params)
+        items = [dict(item) for item in cursor.fetchall()]
+        return {'matched': row[0], 'changed': row[1], 'totals': totals, 'items': items}
+    
+    def _apply_reprice(self, cursor, product_type: str, new_values: Dict[str, str],
+                       where: str, params) -> int:
+        """reprice()'s writes, inside its transaction; returns the number of items changed"""
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS reprice_changed (id INTEGER PRIMARY KEY)')
+        cursor.execute('DELETE FROM temp.reprice_changed')
+        cursor.execute(f'INSERT INTO temp.reprice_changed SELECT id FROM {product_type} WHERE {where}',
+                       params)
+        count = cursor.rowcount
+        if not count:
+            return 0
+        selected = 'id IN (SELECT id FROM temp.reprice_changed)'
+        
+        # Dropped rather than skipped by a WHEN flag: even a trigger that does nothing
+        # costs a call per row. DDL is transactional, so a rollback restores them.
+        cursor.execute("""
+            SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN (?, ?)
+        """, (f'{product_type}_price_update', f'{product_type}_replica_update'))
+        triggers = cursor.fetchall()
+        for name, _ in triggers:
+            cursor.execute(f'DROP TRIGGER {name}')
+        cursor.execute(f'''
+            UPDATE {product_type}
+            SET {', '.join(f'{c} = {value}' for c, value in new_values.items())},
+                updated_at = CURRENT_TIMESTAMP
+            WHERE {selected}
+        ''')
+        columns = ', '.join(PRICE_COLUMNS[product_type])
+        cursor.execute(f'''
+            INSERT INTO price_history (product_type, item_id, {columns})
+            SELECT ?, id, {columns} FROM {product_type} WHERE {selected}
+        ''', (product_type,))
+        for _, sql in triggers:
+            cursor.execute(sql)
+        
+        cursor.execute('UPDATE replica_state SET clock = clock + 1, seq = seq + 1 WHERE id = 1')
+        cursor.execute('''
+            UPDATE row_versions SET (clock, site, seq) = (SELECT clock, site, seq FROM replica_state)
+            WHERE product_type = ? AND item_id IN (SELECT id FROM temp.reprice_changed)
+        ''', (product_type,))
+        return count
     
     # ===== SHEET METAL METHODS =====
     
@@ -246,171 +2013,105 @@ class InventoryDB:
                         dimensions: Optional[str], measurement: Optional[str], cost: float,
                         extra: Optional[str]) -> int:
         """Add a new sheet metal to inventory"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO sheet_metal (thickness, dimensions, measurement, cost, extra, quantity)
-            VALUES (?, ?, ?, ?, ?, 0)
-        ''', (thickness, dimensions, measurement, cost, extra))
-        
-        item_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.transaction('sheet_metal') as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO sheet_metal (thickness, dimensions, measurement, cost, extra, quantity)
+                VALUES (?, ?, ?, ?, ?, 0)
+            ''', (thickness, dimensions, measurement, cost, extra))
+            
+            item_id = cursor.lastrowid
         return item_id
     
     def update_sheet_metal(self, item_id: int, thickness: Optional[str], 
                           dimensions: Optional[str], measurement: Optional[str], 
                           cost: float, extra: Optional[str]):
         """Update an existing sheet metal"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE sheet_metal 
-            SET thickness = ?, dimensions = ?, measurement = ?,
-                cost = ?, extra = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (thickness, dimensions, measurement, cost, extra, item_id))
-        
-        conn.commit()
-        conn.close()
+        with self.transaction('sheet_metal') as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                UPDATE sheet_metal 
+                SET thickness = ?, dimensions = ?, measurement = ?,
+                    cost = ?, extra = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (thickness, dimensions, measurement, cost, extra, item_id))
     
     def delete_sheet_metal(self, item_id: int):
         """Delete a sheet metal from inventory"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM sheet_metal WHERE id = ?', (item_id,))
-        
-        conn.commit()
-        conn.close()
+        with self.transaction('sheet_metal') as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM sheet_metal WHERE id = ?', (item_id,))
     
-    def get_all_sheet_metal(self) -> List[Dict]:
+    def get_all_sheet_metal(self) -> List[SheetMetal]:
         """Get all sheet metal from inventory"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = self._record_cursor('sheet_metal')
         
-        cursor.execute('SELECT * FROM sheet_metal ORDER BY id')
-        items = [dict(row) for row in cursor.fetchall()]
+        cursor.execute(f'SELECT {_select_list("sheet_metal")} FROM sheet_metal t ORDER BY t.id')
+        items = cursor.fetchall()
         
-        conn.close()
         return items
     
-    def get_sheet_metal_by_id(self, item_id: int) -> Optional[Dict]:
+    def get_sheet_metal_by_id(self, item_id: int) -> Optional[SheetMetal]:
         """Get a specific sheet metal by ID"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM sheet_metal WHERE id = ?', (item_id,))
-        row = cursor.fetchone()
-        
-        conn.close()
-        return dict(row) if row else None
+        return self._get_by_id('sheet_metal', item_id)
     
-    def search_sheet_metal(self, search_term: str) -> List[Dict]:
-        """Search sheet metal by name, description, or other fields"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        search_pattern = f'%{search_term}%'
-        cursor.execute('''
-            SELECT * FROM sheet_metal 
-            WHERE name LIKE ? OR description LIKE ? OR thickness LIKE ? 
-               OR dimensions LIKE ? OR measurement LIKE ? OR extra LIKE ?
-            ORDER BY name
-        ''', (search_pattern, search_pattern, search_pattern, search_pattern, 
-              search_pattern, search_pattern))
-        
-        items = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return items
+    def search_sheet_metal(self, search_term: str, limit: Optional[int] = None) -> List[SheetMetal]:
+        """Search sheet metal by thickness, dimensions, measurement, or extra"""
+        return self._search('sheet_metal', search_term, 'id', limit)
     
     # ===== FLEXIBLE METHODS =====
     
     def add_flexible(self, description: Optional[str], diameter: Optional[str],
                     collection: Optional[str], meter: float) -> int:
         """Add a new flexible to inventory"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO flexible (description, diameter, collection, meter)
-            VALUES (?, ?, ?, ?)
-        ''', (description, diameter, collection, meter))
-        
-        item_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.transaction('flexible') as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO flexible (description, diameter, collection, meter)
+                VALUES (?, ?, ?, ?)
+            ''', (description, diameter, collection, meter))
+            
+            item_id = cursor.lastrowid
         return item_id
     
     def update_flexible(self, item_id: int, description: Optional[str],
                        diameter: Optional[str], collection: Optional[str], meter: float):
         """Update an existing flexible"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE flexible 
-            SET description = ?, diameter = ?, collection = ?,
-                meter = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (description, diameter, collection, meter, item_id))
-        
-        conn.commit()
-        conn.close()
+        with self.transaction('flexible') as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                UPDATE flexible 
+                SET description = ?, diameter = ?, collection = ?,
+                    meter = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (description, diameter, collection, meter, item_id))
     
     def delete_flexible(self, item_id: int):
         """Delete a flexible from inventory"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM flexible WHERE id = ?', (item_id,))
-        
-        conn.commit()
-        conn.close()
+        with self.transaction('flexible') as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM flexible WHERE id = ?', (item_id,))
     
-    def get_all_flexible(self) -> List[Dict]:
+    def get_all_flexible(self) -> List[Flexible]:
         """Get all flexible from inventory"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = self._record_cursor('flexible')
         
-        cursor.execute('SELECT * FROM flexible ORDER BY id')
-        items = [dict(row) for row in cursor.fetchall()]
+        cursor.execute(f'SELECT {_select_list("flexible")} FROM flexible t ORDER BY t.id')
+        items = cursor.fetchall()
         
-        conn.close()
         return items
     
-    def get_flexible_by_id(self, item_id: int) -> Optional[Dict]:
+    def get_flexible_by_id(self, item_id: int) -> Optional[Flexible]:
         """Get a specific flexible by ID"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM flexible WHERE id = ?', (item_id,))
-        row = cursor.fetchone()
-        
-        conn.close()
-        return dict(row) if row else None
+        return self._get_by_id('flexible', item_id)
     
-    def search_flexible(self, search_term: str) -> List[Dict]:
+    def search_flexible(self, search_term: str, limit: Optional[int] = None) -> List[Flexible]:
         """Search flexible by description, diameter, or collection fields"""
-        conn = self.get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        search_pattern = f'%{search_term}%'
-        cursor.execute('''
-            SELECT * FROM flexible 
-            WHERE description LIKE ? OR diameter LIKE ? OR collection LIKE ?
-            ORDER BY id
-        ''', (search_pattern, search_pattern, search_pattern))
-        
-        items = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return items
+        return self._search('flexible', search_term, 'id', limit)
 
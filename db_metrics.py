@@ -0,0 +1,290 @@
+"""
+Opt-in instrumentation for InventoryDB.
+
+    metrics = DBMetrics(slow_query_ms=50)
+    db = InventoryDB("inventory.db", metrics=metrics)
+    ...
+    metrics.write("db_metrics.json")
+
+The desktop application turns this on when started with --db-metrics or with
+the RABAH_DB_METRICS environment variable set (to the slow statement threshold
+in ms, or to 1 for the default); see from_environment().
+
+With metrics enabled, InventoryDB records:
+- a latency histogram per public method (get_fan_by_id, query, add_fan, ...)
+- every SQL statement slower than slow_query_ms, with its EXPLAIN QUERY PLAN
+- connections opened and closed, and SQL statements executed (including the
+  statements run by triggers)
+
+Python's sqlite3 module has a trace callback but no profile callback, so a
+statement is timed at the cursor: execute() plus the fetch calls that read its
+rows. Without metrics nothing is wrapped and InventoryDB runs at full speed.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open-ended
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+SLOW_QUERY_MS = 50
+METRICS_FILE = "db_metrics.json"  # Written by the application on exit
+MAX_SLOW_QUERIES = 200  # Oldest entries are dropped first
+PLANNED_STATEMENTS = ('SELECT', 'WITH', 'INSERT', 'REPLACE', 'UPDATE', 'DELETE')
+
+
+class Histogram:
+    """Call count, total/max time and a bucketed latency distribution"""
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        for index, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, fraction):
+        """Upper bound (ms) of the bucket holding the given fraction of calls"""
+        target = self.count * fraction
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target and bucket:
+                return BUCKETS_MS[index] if index < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def to_dict(self):
+        labels = [f"<={bound}ms" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"]
+        return {
+            'count': self.count,
+            'total_ms': round(self.total, 3),
+            'mean_ms': round(self.total / self.count, 3) if self.count else 0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': round(self.max, 3),
+            'buckets': {label: n for label, n in zip(labels, self.buckets) if n},
+        }
+
+
+class DBMetrics:
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.methods = {}
+            self.slow_queries = deque(maxlen=MAX_SLOW_QUERIES)
+            self.connections_opened = 0
+            self.connections_closed = 0
+            self.statements = 0
+
+    # Method timing
+
+    def timed(self, name, method):
+        """Wrap a bound method so every call is added to name's histogram"""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record_call(name, (time.perf_counter() - start) * 1000)
+        wrapper.__name__ = name
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+    def record_call(self, name, ms):
+        with self._lock:
+            histogram = self.methods.get(name)
+            if histogram is None:
+                histogram = self.methods[name] = Histogram()
+            histogram.add(ms)
+
+    # Connections and statements
+
+    def connection_opened(self, conn):
+        """Count the connection and start counting its statements"""
+        with self._lock:
+            self.connections_opened += 1
+        conn.set_trace_callback(self._count_statement)
+
+    def connection_closed(self):
+        with self._lock:
+            self.connections_closed += 1
+
+    def _count_statement(self, sql):
+        # Called by SQLite for every statement, trigger bodies included. Runs far too
+        # often to take the lock; a count lost to a thread switch does not matter here.
+        self.statements += 1
+
+    def record_slow_query(self, conn, sql, params, ms):
+        """Log a statement over the threshold together with its query plan"""
+        plan = []
+        words = sql.split(None, 1)
+        if words and words[0].upper() in PLANNED_STATEMENTS:
+            try:
+                cursor = conn.cursor(_plain=True)
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params or ())
+                plan = [row[-1] for row in cursor.fetchall()]
+            except sqlite3.Error:
+                pass  # e.g. executemany (no single set of parameters); the timing is still useful
+        entry = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'ms': round(ms, 3),
+            'sql': ' '.join(sql.split()),
+            'plan': plan,
+            'thread': threading.current_thread().name,
+        }
+        with self._lock:
+            self.slow_queries.append(entry)
+
+    # Output
+
+    def snapshot(self):
+        """All metrics as a JSON-serializable dict"""
+        with self._lock:
+            return {
+                'since': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'slow_query_ms': self.slow_query_ms,
+                'connections': {
+                    'opened': self.connections_opened,
+                    'closed': self.connections_closed,
+                    'open': self.connections_opened - self.connections_closed,
+                },
+                'statements': self.statements,
+                'methods': {name: histogram.to_dict()
+                            for name, histogram in sorted(self.methods.items(),
+                                                          key=lambda item: -item[1].total)},
+                'slow_queries': list(self.slow_queries),
+            }
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2, ensure_ascii=False)
+
+    def format_text(self):
+        """Human-readable summary, slowest methods (by total time) first"""
+        data = self.snapshot()
+        connections = data['connections']
+        lines = [
+            f"Since {data['since']}",
+            f"Connections: {connections['opened']} opened, {connections['closed']} closed, "
+            f"{connections['open']} open",
+            f"SQL statements: {data['statements']}",
+            "",
+            f"{'method':<28}{'calls':>8}{'total ms':>12}{'mean':>10}{'p95':>9}{'max':>10}",
+        ]
+        for name, h in data['methods'].items():
+            lines.append(f"{name:<28}{h['count']:>8}{h['total_ms']:>12.1f}{h['mean_ms']:>10.2f}"
+                         f"{h['p95_ms']:>9.1f}{h['max_ms']:>10.1f}")
+        lines.append("")
+        lines.append(f"Statements over {data['slow_query_ms']} ms: {len(data['slow_queries'])}")
+        for entry in reversed(data['slow_queries']):
+            lines.append(f"[{entry['time']}] {entry['ms']:.1f} ms  {entry['sql']}")
+            for step in entry['plan']:
+                lines.append(f"      {step}")
+        return "\n".join(lines)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that times each statement (execute + fetches) and reports slow ones"""
+
+    def __init__(self, conn, metrics):
+        super().__init__(conn)
+        self._metrics = metrics
+        self._sql = None
+        self._params = None
+        self._elapsed = 0.0
+        self._reported = False
+
+    def _account(self, seconds):
+        self._elapsed += seconds
+        ms = self._elapsed * 1000
+        if not self._reported and self._sql is not None and ms >= self._metrics.slow_query_ms:
+            self._reported = True
+            self._metrics.record_slow_query(self.connection, self._sql, self._params, ms)
+
+    def execute(self, sql, params=()):
+        self._sql, self._params, self._elapsed, self._reported = sql, params, 0.0, False
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._account(time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_params):
+        self._sql, self._params, self._elapsed, self._reported = sql, None, 0.0, False
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            self._account(time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._account(time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._account(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._account(time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors (including those behind conn.execute) are TimedCursors"""
+    metrics = None  # Set on the subclass made by DBMetrics.connection_factory
+
+    def cursor(self, factory=None, _plain=False):
+        if _plain:
+            return super().cursor()
+        if factory is None:
+            return super().cursor(lambda conn: TimedCursor(conn, self.metrics))
+        return super().cursor(factory)
+
+
+def connection_factory(metrics):
+    """sqlite3.connect(factory=...) class reporting to metrics"""
+    return type('TimedConnection', (TimedConnection,), {'metrics': metrics})
+
+
+def from_environment(argv=None):
+    """DBMetrics if enabled by --db-metrics or RABAH_DB_METRICS, else None"""
+    argv = sys.argv if argv is None else argv
+    value = os.environ.get('RABAH_DB_METRICS', '').strip()
+    if '--db-metrics' not in argv and value in ('', '0'):
+        return None
+    try:
+        threshold = float(value)
+    except ValueError:
+        threshold = SLOW_QUERY_MS
+    return DBMetrics(threshold if threshold > 1 else SLOW_QUERY_MS)
@@ -0,0 +1,225 @@
+"""
+Batch quote generation
+Renders one Word quote per row of a CSV file, in parallel across worker processes,
+using the same template and layout as the price list window's "Export to Word".
+
+CSV columns (header row required):
+    customer    customer name as it should appear on the quote
+    date        quote date (YYYY/MM/DD); empty means today
+    fan_ids     fan ids separated by ';' (e.g. 12;15;40)
+    quantities  quantity per fan, same order, separated by ';' (empty means 1 each)
+    price_type  retail or wholesale (default: retail)
+    file        optional output file name (default: numbered from the customer name)
+
+Usage:
+    python generate_quotes.py quotes.csv [--output-dir quotes] [--template format.docx]
+                              [--workers 4] [--report timings.csv]
+"""
+
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from database import InventoryDB
+
+PRICE_TYPES = ('retail', 'wholesale')
+
+
+def split_list(value):
+    """'12; 15;40' -> ['12', '15', '40']"""
+    return [part.strip() for part in (value or '').split(';') if part.strip()]
+
+
+def safe_filename(text):
+    """Customer name reduced to something every file system accepts"""
+    text = re.sub(r'[\\/:*?"<>|\s]+', '_', text.strip())
+    return text.strip('._')[:60] or 'quote'
+
+
+def read_jobs(db, path, output_dir):
+    """
+    Turn the CSV into render jobs. Returns (jobs, errors); each job is a dict with the
+    row number, customer, date, items and output path, errors are (row number, message).
+    """
+    jobs, errors = [], []
+    today = datetime.now().strftime("%Y/%m/%d")
+    # utf-8-sig strips the BOM Excel adds when saving "CSV UTF-8"
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        # Row 1 is the header
+        for number, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                customer = (row.get('customer') or '').strip()
+                if not customer:
+                    raise ValueError("customer is empty")
+                price_type = (row.get('price_type') or 'retail').strip().lower()
+                if price_type not in PRICE_TYPES:
+                    raise ValueError(f"price_type must be retail or wholesale, not {price_type!r}")
+                
+                fan_ids = [int(v) for v in split_list(row.get('fan_ids'))]
+                if not fan_ids:
+                    raise ValueError("fan_ids is empty")
+                quantities = [int(v) for v in split_list(row.get('quantities'))] or [1] * len(fan_ids)
+                if len(quantities) != len(fan_ids):
+                    raise ValueError(f"{len(fan_ids)} fan ids but {len(quantities)} quantities")
+                
+                items = []
+                for fan_id, qty in zip(fan_ids, quantities):
+                    fan = db.get_fan_by_id(fan_id)
+                    if fan is None:
+                        raise ValueError(f"fan id {fan_id} not found")
+                    items.append({'fan': fan.to_dict(), 'quantity': qty, 'price_type': price_type})
+                
+                filename = (row.get('file') or '').strip() or f"{number - 1:04d}_{safe_filename(customer)}"
+                if not filename.lower().endswith('.docx'):
+                    filename += '.docx'
+                jobs.append({
+                    'row': number,
+                    'customer': customer,
+                    'date': (row.get('date') or '').strip() or today,
+                    'items': items,
+                    'output': os.path.join(output_dir, filename),
+                })
+            except ValueError as e:
+                errors.append((number, str(e)))
+    return jobs, errors
+
+
+_template_path = None
+
+
+def init_worker(template_path):
+    """Compile the template once per worker process, before the first quote is timed"""
+    global _template_path
+    from quote_template import get_template
+    _template_path = template_path
+    get_template(template_path)
+
+
+def render_job(job):
+    """
+    Render one quote with the worker's template.
+    Returns (row, output, seconds, grand total, error message or None).
+    """
+    from quote_template import get_template
+    start = time.perf_counter()
+    try:
+        total = get_template(_template_path).render(job['customer'], job['date'],
+                                                    job['items'], job['output'])
+        return job['row'], job['output'], time.perf_counter() - start, total, None
+    except Exception as e:
+        return job['row'], job['output'], time.perf_counter() - start, 0, str(e)
+
+
+def generate(template_path, jobs, workers, progress=None):
+    """Render all jobs, in a process pool when workers > 1; returns the results in job order"""
+    results = []
+    if workers <= 1:
+        init_worker(template_path)
+        for job in jobs:
+            results.append(render_job(job))
+            if progress:
+                progress(len(results), len(jobs))
+        return results
+    
+    # A few ms per quote is less than the cost of a round trip to a worker, so jobs
+    # are sent in chunks (about four per worker)
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(template_path,)) as pool:
+        for result in pool.map(render_job, jobs, chunksize=chunksize):
+            results.append(result)
+            if progress:
+                progress(len(results), len(jobs))
+    return results
+
+
+def print_report(results, elapsed):
+    """Per-document timings followed by a summary"""
+    print(f"{'row':>5}  {'ms':>8}  {'total':>10}  file")
+    for row, output, seconds, total, error in results:
+        status = f"ERROR: {error}" if error else os.path.basename(output)
+        print(f"{row:>5}  {seconds * 1000:>8.1f}  {total:>10.0f}  {status}")
+    
+    times = sorted(result[2] for result in results if result[4] is None)
+    if times:
+        print()
+        print(f"Documents: {len(times)} in {elapsed:.2f}s ({len(times) / elapsed:.1f} per second)")
+        print(f"   - Fastest: {times[0] * 1000:.1f} ms")
+        print(f"   - Median: {times[len(times) // 2] * 1000:.1f} ms")
+        print(f"   - Slowest: {times[-1] * 1000:.1f} ms")
+
+
+def write_report(path, results):
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['row', 'file', 'ms', 'total', 'error'])
+        for row, output, seconds, total, error in results:
+            writer.writerow([row, output, f"{seconds * 1000:.1f}", f"{total:.0f}", error or ''])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render Word quotes in bulk from a CSV file")
+    parser.add_argument('csv', help="CSV with customer, date, fan_ids, quantities, price_type columns")
+    parser.add_argument('--db', default='inventory.db', help="Database file (default: inventory.db)")
+    parser.add_argument('--template', help="Quote template (default: template.docx or format.docx)")
+    parser.add_argument('--output-dir', default='quotes', help="Folder for the quotes (default: quotes)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (default: one per CPU; 1 renders in this process)")
+    parser.add_argument('--report', help="Also write the per-document timings to this CSV file")
+    args = parser.parse_args()
+    
+    try:
+        from quote_template import find_template
+    except ImportError:
+        print("Error: python-docx is required. Install it with: pip install python-docx")
+        return 1
+    
+    template_path = args.template or find_template()
+    if not template_path or not os.path.exists(template_path):
+        print("Error: no quote template found (template.docx or format.docx); use --template")
+        return 1
+    
+    db = InventoryDB(args.db)
+    try:
+        jobs, errors = read_jobs(db, args.csv, args.output_dir)
+    except OSError as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        db.close()
+    
+    for number, message in errors:
+        print(f"Skipping row {number}: {message}")
+    if not jobs:
+        print("No quotes to generate.")
+        return 1 if errors else 0
+    
+    os.makedirs(args.output_dir, exist_ok=True)
+    workers = max(1, min(args.workers, len(jobs)))
+    print(f"Generating {len(jobs)} quotes with {workers} worker(s)...")
+    
+    step = max(1, len(jobs) // 100)
+    
+    def progress(done, total):
+        if done % step == 0 or done == total:
+            print(f"\r   {done}/{total} quotes...", end='', flush=True)
+    
+    start = time.perf_counter()
+    results = generate(template_path, jobs, workers, progress)
+    elapsed = time.perf_counter() - start
+    print()
+    print_report(results, elapsed)
+    if args.report:
+        write_report(args.report, results)
+    
+    failed = len(errors) + sum(1 for result in results if result[4])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
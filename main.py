@@ -1,9 +1,23 @@
-import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
 import os
 import sys
-from database import InventoryDB
-from price_list_window import PriceListWindow
+import threading
+import time
+from startup_timer import StartupTimer
+
+# Import times are logged to startup.log; heavy modules (the price list window,
+# python-docx) are imported on first use instead of here
+startup = StartupTimer()
+with startup.phase("import tkinter"):
+    import tkinter as tk
+    from tkinter import ttk, messagebox, simpledialog
+with startup.phase("import database"):
+    from database import InventoryDB
+    from catalog_index import CatalogIndexer
+    from backup import BackupScheduler
+    import db_metrics
+with startup.phase("import widgets"):
+    from background_search import BackgroundSearch
+    from virtual_table import VirtualTreeview, PAGE_SIZE
 
 # Helper function to get resource path (works both as script and as PyInstaller exe)
 def resource_path(relative_path):
@@ -56,7 +70,24 @@ class FanInventoryApp:
         self.root.title("رباح للتهوية")
         self.root.geometry("1000x700")
         
-        self.db = InventoryDB()
+        # The schema check runs on a worker thread once the window is up (see
+        # _start_schema_check); upgrading an old database shows a progress window
+        self._migration_window = None
+        self._schema_check = None  # The worker thread, while it runs
+        self._schema_check_stop = threading.Event()
+        # Opt-in database instrumentation (--db-metrics); Ctrl+Alt+M shows it
+        self.metrics = db_metrics.from_environment()
+        self.db = InventoryDB(auto_migrate=False, metrics=self.metrics)
+        self.root.bind_all('<Control-Alt-m>', lambda e: self.show_db_metrics())
+        # Catalog PDFs are indexed for searching in the background after startup
+        self.catalog_indexer = CatalogIndexer(self.db)
+        # Snapshots of the database in backups/, taken in the background (see backup.py)
+        self.backups = BackupScheduler(self.db.db_path)
+        self._backup_warned = None  # failing_since of the failures last reported
+        # Search-as-you-type runs off the Tk thread; only the newest result is shown
+        self.search = BackgroundSearch(self.root, self._show_search_results,
+                                       on_error=self._show_search_error,
+                                       cleanup=self.db.release_connection)
         self.current_product_type = "fans"  # Current product type: fans, sheet_metal, flexible
         self.sort_column = "name"  # Default sort by name
         self.sort_reverse = False  # Default ascending
@@ -113,6 +144,8 @@ class FanInventoryApp:
                   width=20).pack(pady=5, fill=tk.X)
         ttk.Button(buttons_frame, text="إنشاء عرض سعر", 
                   command=self.open_price_list, width=20).pack(pady=5, fill=tk.X)
+        ttk.Button(buttons_frame, text="تعديل الأسعار", 
+                  command=self.reprice_items, width=20).pack(pady=5, fill=tk.X)
         
         # Sort controls
         self.sort_frame = ttk.LabelFrame(buttons_frame, text="Sort By", padding="5")
@@ -163,8 +196,10 @@ class FanInventoryApp:
                                  yscrollcommand=scrollbar_y.set,
                                  xscrollcommand=scrollbar_x.set)
         
-        scrollbar_y.config(command=self.tree.yview)
         scrollbar_x.config(command=self.tree.xview)
+        # Only the rows around the visible window exist as Tk items; the vertical
+        # scrollbar is driven by the table model over the full row list
+        self.table = VirtualTreeview(self.tree, scrollbar_y, self.format_row)
         
         self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         scrollbar_y.grid(row=0, column=1, sticky=(tk.N, tk.S))
@@ -176,8 +211,199 @@ class FanInventoryApp:
         # Setup columns based on product type
         self.setup_table_columns()
         
-        # Load initial data
-        self.refresh_table()
+        # Close the database connections cleanly when the window is closed
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # Nothing may touch the database until the schema check has finished:
+        # the tables and triggers of a pending migration do not exist yet
+        self._controls = (product_frame, buttons_frame, search_container)
+        self._set_controls_enabled(False)
+        
+        # Load initial data once the schema check has finished
+        self.root.after(0, self._start_schema_check)
+    
+    def _start_schema_check(self):
+        """Bring the schema up to date on a worker thread, then load the table"""
+        check = {
+            'progress': None,  # (description, done, total), replaced by the worker
+            'error': None,
+            'finished': False,
+        }
+        
+        def progress(description, done, total):
+            check['progress'] = (description, done, total)
+        
+        def run():
+            start = time.perf_counter()
+            try:
+                self.db.migrate(progress, stop=self._schema_check_stop)
+                # Tombstones every delta export target has received (see migrate_to_web.py)
+                self.db.prune_deleted_items()
+            except Exception as e:
+                check['error'] = e
+            finally:
+                self.db.release_connection()
+            startup.record("schema check", time.perf_counter() - start)
+            check['finished'] = True
+        
+        self._schema_check = threading.Thread(target=run, name="SchemaCheck", daemon=True)
+        self._schema_check.start()
+        self._poll_schema_check(check)
+    
+    def _poll_schema_check(self, check):
+        """Show migration progress until the schema check finishes (Tk thread)"""
+        if check['progress'] is not None:
+            self._show_migration_progress(*check['progress'])
+        if not check['finished']:
+            self.root.after(20, lambda: self._poll_schema_check(check))
+            return
+        if self._schema_check_stop.is_set():
+            return  # Closing: on_close finishes once the worker is done
+        
+        if self._migration_window is not None:
+            self._migration_window.destroy()
+            self._migration_window = None
+        if check['error'] is not None:
+            messagebox.showerror("خطأ في قاعدة البيانات",
+                                 f"تعذر تحديث قاعدة البيانات:\n{check['error']}")
+            self.on_close()
+            return
+        
+        self._set_controls_enabled(True)
+        with startup.phase("first page"):
+            self.refresh_table()
+            self.root.update_idletasks()
+        startup.finish()
+        self._start_catalog_indexer()
+        self.backups.start()
+        self.root.after(60000, self._poll_backups)
+    
+    def _set_controls_enabled(self, enabled):
+        """Enable or disable the product choice, buttons and search of the main window"""
+        flag = '!disabled' if enabled else 'disabled'
+        pending = list(self._controls)
+        while pending:
+            widget = pending.pop()
+            pending.extend(widget.winfo_children())
+            if isinstance(widget, (ttk.Button, ttk.Radiobutton, ttk.Entry)):
+                widget.state([flag])
+    
+    def _start_catalog_indexer(self):
+        """Read new or changed catalog PDFs on a worker thread (see catalog_index.py)"""
+        result = {}
+        thread = self.catalog_indexer.start(on_done=result.update)
+        self.root.after(500, lambda: self._poll_catalog_indexer(thread, result))
+    
+    def _poll_catalog_indexer(self, thread, result):
+        """Re-run the current search once the index has changed (Tk thread)"""
+        if thread.is_alive():
+            self.root.after(500, lambda: self._poll_catalog_indexer(thread, result))
+            return
+        if (result.get('indexed') or result.get('removed')) and self.search_var.get().strip():
+            self.refresh_table()
+    
+    def _poll_backups(self):
+        """Tell the user once when snapshots keep failing (Tk thread)"""
+        since = self.backups.failing_since
+        error = self.backups.failure()
+        if error is not None and since != self._backup_warned:
+            # Once per run of failures; after a good snapshot the next one is reported again
+            self._backup_warned = since
+            messagebox.showwarning("النسخ الاحتياطي",
+                                   f"تعذر أخذ نسخة احتياطية من قاعدة البيانات:\n{error}\n\n"
+                                   "ستتم المحاولة مرة أخرى تلقائيا.")
+        self.root.after(60000, self._poll_backups)
+    
+    def _show_migration_progress(self, description, done, total):
+        """Progress window for database upgrades that copy or index existing rows"""
+        if total <= 1:
+            return  # Schema-only step, finishes instantly
+        if self._migration_window is None:
+            self._migration_window = tk.Toplevel(self.root)
+            self._migration_window.title("تحديث قاعدة البيانات")
+            self._migration_window.resizable(False, False)
+            frame = ttk.Frame(self._migration_window, padding="20")
+            frame.pack(fill=tk.BOTH, expand=True)
+            self._migration_label = ttk.Label(frame, text="")
+            self._migration_label.pack(pady=(0, 10))
+            self._migration_bar = ttk.Progressbar(frame, length=300, maximum=total)
+            self._migration_bar.pack()
+            # Stays on top of the (disabled) main window until the schema is up to date
+            self._migration_window.transient(self.root)
+            self._migration_window.grab_set()
+        self._migration_label.config(text=f"جاري تحديث قاعدة البيانات... {done * 100 // total}%")
+        self._migration_bar.config(maximum=total, value=done)
+    
+    def on_close(self):
+        """Release database connections and close the application"""
+        if self._schema_check is not None and self._schema_check.is_alive():
+            # Closing the database under a migration would cut it off halfway: let
+            # the current one finish (the rest run at the next start), then close
+            self._schema_check_stop.set()
+            self.root.withdraw()
+            self.root.after(50, self.on_close)
+            return
+        self.search.close()
+        # A PDF takes at most a second or two to read; then the indexer stops
+        self.catalog_indexer.stop(timeout=2)
+        # A snapshot being copied is abandoned; the next start takes it again
+        self.backups.stop(timeout=2)
+        self.db.close()
+        if self.metrics is not None:
+            try:
+                self.metrics.write(db_metrics.METRICS_FILE)
+            except OSError:
+                pass  # Read-only folder; metrics are diagnostic only
+        self.root.destroy()
+    
+    def show_db_metrics(self):
+        """Hidden diagnostics window (Ctrl+Alt+M): database timings and slow statements"""
+        if self.metrics is None:
+            messagebox.showinfo("قياس الأداء",
+                                "قياس أداء قاعدة البيانات غير مفعل.\n"
+                                "شغّل البرنامج مع --db-metrics أو عرّف المتغير RABAH_DB_METRICS.")
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title("قياس أداء قاعدة البيانات")
+        window.geometry("900x600")
+        frame = ttk.Frame(window, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        frame.columnconfigure(0, weight=1)
+        frame.rowconfigure(0, weight=1)
+        
+        text = tk.Text(frame, wrap=tk.NONE, font=("Courier", 9))
+        text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        scrollbar_y = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=text.yview)
+        scrollbar_y.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        scrollbar_x = ttk.Scrollbar(frame, orient=tk.HORIZONTAL, command=text.xview)
+        scrollbar_x.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        text.configure(yscrollcommand=scrollbar_y.set, xscrollcommand=scrollbar_x.set)
+        
+        def refresh():
+            text.configure(state=tk.NORMAL)
+            text.delete('1.0', tk.END)
+            text.insert('1.0', self.metrics.format_text())
+            text.configure(state=tk.DISABLED)
+        
+        def save():
+            from tkinter import filedialog
+            filename = filedialog.asksaveasfilename(
+                defaultextension=".json", initialfile=db_metrics.METRICS_FILE,
+                filetypes=[("JSON", "*.json"), ("All files", "*.*")], parent=window)
+            if filename:
+                self.metrics.write(filename)
+        
+        def reset():
+            self.metrics.reset()
+            refresh()
+        
+        buttons = ttk.Frame(frame)
+        buttons.grid(row=2, column=0, columnspan=2, pady=(10, 0))
+        ttk.Button(buttons, text="تحديث", command=refresh).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="حفظ JSON...", command=save).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="تصفير", command=reset).pack(side=tk.LEFT, padx=5)
+        refresh()
     
     def update_sort_buttons(self):
         """Update sort buttons based on current product type"""
@@ -232,6 +458,9 @@ class FanInventoryApp:
     
     def setup_table_columns(self):
         """Setup table columns based on current product type"""
+        # Drop rows formatted for the previous product type
+        self.table.clear()
+        
         # Clear existing columns
         for col in self.tree['columns']:
             self.tree.heading(col, text="")
@@ -296,91 +525,69 @@ class FanInventoryApp:
     
     def refresh_table(self):
         """Refresh the table with current inventory"""
-        # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # Get items based on current product type and search
+        # A synchronous refresh supersedes any search still running in the background
+        self.search.cancel()
         search_term = self.search_var.get().strip()
-        
+        total = self.db.count(self.current_product_type, search_term)
+        self.populate_table(self.current_product_type, search_term, total)
+    
+    def fetch_page(self, product_type, search_term, offset, limit):
+        """Get one sorted page of items (safe to call from any thread)"""
+        order_by, desc = self.sort_order(product_type)
+        return self.db.query(product_type, order_by=order_by, desc=desc,
+                             limit=limit, offset=offset, search=search_term)
+    
+    def populate_table(self, product_type, search_term, total, first_page=None):
+        """Show the sorted items in the table; pages are fetched as they scroll into view"""
+        self.table.set_source(
+            total,
+            lambda offset, limit: self.fetch_page(product_type, search_term, offset, limit),
+            first_page)
+    
+    def format_row(self, item):
+        """Column values for an item based on product type (RTL order - reversed)"""
         if self.current_product_type == "fans":
-            if search_term:
-                items = self.db.search_fans(search_term)
-            else:
-                items = self.db.get_all_fans()
+            return (
+                item['quantity'],
+                f"${item['price_retail']:.2f}",
+                f"${item['price_wholesale']:.2f}",
+                item.get('airflow') or "",
+                item['name']
+            )
         elif self.current_product_type == "sheet_metal":
-            if search_term:
-                items = self.db.search_sheet_metal(search_term)
-            else:
-                items = self.db.get_all_sheet_metal()
+            return (
+                item.get('extra') or "",
+                f"${item.get('cost', 0):.2f}",
+                item.get('measurement') or "",
+                item.get('dimensions') or "",
+                item.get('thickness') or ""
+            )
         else:  # flexible
-            if search_term:
-                items = self.db.search_flexible(search_term)
-            else:
-                items = self.db.get_all_flexible()
-        
-        # Apply sorting
-        items = self.apply_sorting(items)
-        
-        # Insert into treeview based on product type (RTL order - reversed)
-        # Use iid to store the item ID for edit/delete operations
-        for item in items:
-            if self.current_product_type == "fans":
-                self.tree.insert("", tk.END, iid=str(item['id']), values=(
-                    item['quantity'],
-                    f"${item['price_retail']:.2f}",
-                    f"${item['price_wholesale']:.2f}",
-                    item.get('airflow') or "",
-                    item['name']
-                ))
-            elif self.current_product_type == "sheet_metal":
-                self.tree.insert("", tk.END, iid=str(item['id']), values=(
-                    item.get('extra') or "",
-                    f"${item.get('cost', 0):.2f}",
-                    item.get('measurement') or "",
-                    item.get('dimensions') or "",
-                    item.get('thickness') or ""
-                ))
-            else:  # flexible
-                self.tree.insert("", tk.END, iid=str(item['id']), values=(
-                    f"${item.get('meter', 0):.2f}",
-                    item.get('collection') or "",
-                    item.get('diameter') or ""
-                ))
+            return (
+                f"${item.get('meter', 0):.2f}",
+                item.get('collection') or "",
+                item.get('diameter') or ""
+            )
     
-    def apply_sorting(self, items):
-        """Apply current sort settings to items list"""
-        if self.sort_column == "id":
-            items.sort(key=lambda x: x['id'], reverse=self.sort_reverse)
-        elif self.sort_column == "name":
-            # Name sorting only works for fans, not sheet_metal or flexible
-            if self.current_product_type == "fans":
-                items.sort(key=lambda x: x.get('name', '').lower(), reverse=self.sort_reverse)
-            else:
-                # For sheet_metal and flexible, sort by id instead if name is requested
-                items.sort(key=lambda x: x['id'], reverse=self.sort_reverse)
+    def sort_order(self, product_type):
+        """Database column and direction for the current sort settings"""
+        if self.sort_column == "name" and product_type == "fans":
+            column = "name"
         elif self.sort_column == "price":
             # Sort by price (retail for fans, cost for sheet_metal, meter for flexible)
-            if self.current_product_type == "fans":
-                items.sort(key=lambda x: x.get('price_retail', 0), reverse=self.sort_reverse)
-            elif self.current_product_type == "sheet_metal":
-                items.sort(key=lambda x: x.get('cost', 0), reverse=self.sort_reverse)
-            else:  # flexible
-                items.sort(key=lambda x: x.get('meter', 0), reverse=self.sort_reverse)
-        elif self.sort_column == "quantity":
-            # Quantity sorting only works for fans
-            if self.current_product_type == "fans":
-                items.sort(key=lambda x: x['quantity'], reverse=self.sort_reverse)
-            else:
-                # For sheet_metal and flexible, sort by id instead if quantity is requested
-                items.sort(key=lambda x: x['id'], reverse=self.sort_reverse)
-        elif self.sort_column == "airflow":
-            items.sort(key=lambda x: (x.get('airflow') or '').lower(), reverse=self.sort_reverse)
-        elif self.sort_column == "thickness":
-            items.sort(key=lambda x: (x.get('thickness') or '').lower(), reverse=self.sort_reverse)
-        elif self.sort_column == "diameter":
-            items.sort(key=lambda x: (x.get('diameter') or '').lower(), reverse=self.sort_reverse)
-        return items
+            column = {"fans": "price_retail", "sheet_metal": "cost", "flexible": "meter"}[product_type]
+        elif self.sort_column == "quantity" and product_type == "fans":
+            column = "quantity"
+        elif self.sort_column == "airflow" and product_type == "fans":
+            column = "airflow"
+        elif self.sort_column == "thickness" and product_type == "sheet_metal":
+            column = "thickness"
+        elif self.sort_column == "diameter" and product_type == "flexible":
+            column = "diameter"
+        else:
+            # id, or a column this product type does not have
+            column = "id"
+        return column, self.sort_reverse
     
     def sort_by_column(self, column_name):
         """Sort table by clicking column header"""
@@ -432,12 +639,43 @@ class FanInventoryApp:
         if self.current_product_type != "fans":
             messagebox.showinfo("معلومات", "ميزة عرض السعر متاحة حالياً للمراوح فقط.")
             return
+        if 'price_list_window' not in sys.modules:
+            start = time.perf_counter()
+            import price_list_window
+            startup.log_first_use("price_list_window", time.perf_counter() - start)
+        from price_list_window import PriceListWindow
         PriceListWindow(self.root, self.db)
     
+    def reprice_items(self):
+        """Open the bulk repricing dialog for the items shown (all, or the search results)"""
+        search_term = self.search_var.get().strip() if self.search_visible else ""
+        dialog = RepriceDialog(self.root, self.db, self.current_product_type, search_term)
+        self.root.wait_window(dialog.dialog)
+        if dialog.changed:
+            self.refresh_table()
+    
     def on_search_change(self, *args):
-        """Handle search input changes"""
-        # Just refresh the table, which handles search
-        self.refresh_table()
+        """Handle search input changes (debounced, queried on a worker thread)"""
+        product_type = self.current_product_type
+        search_term = self.search_var.get().strip()
+        
+        def query():
+            total = self.db.count(product_type, search_term)
+            first_page = self.fetch_page(product_type, search_term, 0, PAGE_SIZE)
+            return product_type, search_term, total, first_page
+        
+        self.search.submit(query)
+    
+    def _show_search_results(self, result):
+        """Show a finished background search (main thread)"""
+        product_type, search_term, total, first_page = result
+        if product_type != self.current_product_type:
+            return  # Product type switched while the search was running
+        self.populate_table(product_type, search_term, total, first_page)
+    
+    def _show_search_error(self, error):
+        """Report a failed background search (main thread)"""
+        messagebox.showerror("خطأ", f"فشل البحث: {str(error)}")
     
     def add_item(self):
         """Open dialog to add a new item based on product type"""
@@ -642,7 +880,7 @@ class FanInventoryApp:
             self.search_visible = True
             # Focus on search entry
             self.search_entry.focus()
-    
+
 
 
 class FanDialog:
@@ -1022,8 +1260,217 @@ class FlexibleDialog:
         self.dialog.destroy()
 
 
+class RepriceDialog:
+    """Change the prices of every item shown (all items, or the current search results) at once"""
+    
+    # Price columns and their headings, per product type
+    PRICE_LABELS = {
+        "fans": (("price_wholesale", "جملة"), ("price_retail", "مفرق")),
+        "sheet_metal": (("cost", "اجور"),),
+        "flexible": (("meter", "متر"),),
+    }
+    ROUNDING = (("nearest", "الأقرب"), ("up", "للأعلى"), ("down", "للأسفل"))
+    
+    def __init__(self, parent, db, product_type, search_term):
+        self.db = db
+        self.product_type = product_type
+        self.search_term = search_term
+        self.changed = 0  # Items repriced; the caller refreshes its table if any
+        self._busy = False
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("تعديل الأسعار")
+        self.dialog.geometry("600x550")
+        self.dialog.transient(parent)
+        self.dialog.grab_set()
+        
+        form_frame = ttk.Frame(self.dialog, padding="20")
+        form_frame.pack(fill=tk.BOTH, expand=True)
+        form_frame.columnconfigure(0, weight=1)  # Entry column
+        form_frame.columnconfigure(1, weight=0)  # Label column
+        form_frame.rowconfigure(7, weight=1)  # Preview table
+        
+        # RTL Layout: Entry on left (column 0), Label on right (column 1)
+        scope = f"نتائج البحث: {search_term}" if search_term else "جميع العناصر"
+        ttk.Label(form_frame, text=scope).grid(row=0, column=0, sticky=tk.E, pady=5, padx=(0, 10))
+        ttk.Label(form_frame, text=":العناصر").grid(row=0, column=1, sticky=tk.E, pady=5)
+        
+        columns_frame = ttk.Frame(form_frame)
+        columns_frame.grid(row=1, column=0, sticky=tk.E, pady=5, padx=(0, 10))
+        self.column_vars = {}
+        for column, label in self.PRICE_LABELS[product_type]:
+            self.column_vars[column] = tk.BooleanVar(value=True)
+            ttk.Checkbutton(columns_frame, text=label, variable=self.column_vars[column]).pack(side=tk.RIGHT, padx=5)
+        ttk.Label(form_frame, text=":الأسعار").grid(row=1, column=1, sticky=tk.E, pady=5)
+        
+        self.percent_var = tk.StringVar(value="0")
+        ttk.Entry(form_frame, textvariable=self.percent_var, width=30).grid(
+            row=2, column=0, sticky=(tk.W, tk.E), pady=5, padx=(0, 10))
+        ttk.Label(form_frame, text=":نسبة التغيير %").grid(row=2, column=1, sticky=tk.E, pady=5)
+        
+        self.amount_var = tk.StringVar(value="0")
+        ttk.Entry(form_frame, textvariable=self.amount_var, width=30).grid(
+            row=3, column=0, sticky=(tk.W, tk.E), pady=5, padx=(0, 10))
+        ttk.Label(form_frame, text=":إضافة مبلغ").grid(row=3, column=1, sticky=tk.E, pady=5)
+        
+        round_frame = ttk.Frame(form_frame)
+        round_frame.grid(row=4, column=0, sticky=(tk.W, tk.E), pady=5, padx=(0, 10))
+        self.round_to_var = tk.StringVar(value="")
+        ttk.Entry(round_frame, textvariable=self.round_to_var, width=10).pack(side=tk.RIGHT)
+        self.rounding_var = tk.StringVar(value="nearest")
+        for value, label in self.ROUNDING:
+            ttk.Radiobutton(round_frame, text=label, variable=self.rounding_var,
+                            value=value).pack(side=tk.RIGHT, padx=5)
+        ttk.Label(form_frame, text=":التقريب إلى").grid(row=4, column=1, sticky=tk.E, pady=5)
+        
+        button_frame = ttk.Frame(form_frame)
+        button_frame.grid(row=5, column=0, columnspan=2, pady=10)
+        ttk.Button(button_frame, text="إغلاق", command=self.close).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="تطبيق", command=self.apply).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="معاينة", command=self.preview).pack(side=tk.RIGHT, padx=5)
+        
+        self.summary_label = ttk.Label(form_frame, text="")
+        self.summary_label.grid(row=6, column=0, columnspan=2, sticky=tk.E, pady=5)
+        
+        # Preview of the first changed items (reverse column order for RTL display)
+        preview_frame = ttk.Frame(form_frame)
+        preview_frame.grid(row=7, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
+        preview_frame.columnconfigure(0, weight=1)
+        preview_frame.rowconfigure(0, weight=1)
+        self.preview_tree = ttk.Treeview(preview_frame, columns=("New", "Old", "Name"),
+                                         show="headings", height=8)
+        for col, heading, width in (("New", "السعر الجديد", 150), ("Old", "السعر الحالي", 150),
+                                    ("Name", "العنصر", 200)):
+            self.preview_tree.heading(col, text=heading)
+            self.preview_tree.column(col, width=width, anchor=tk.E)
+        scrollbar_y = ttk.Scrollbar(preview_frame, orient=tk.VERTICAL, command=self.preview_tree.yview)
+        self.preview_tree.configure(yscrollcommand=scrollbar_y.set)
+        self.preview_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        scrollbar_y.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        
+        self.dialog.protocol("WM_DELETE_WINDOW", self.close)
+    
+    def _rules(self):
+        """reprice() arguments from the form, or None after reporting an invalid entry"""
+        columns = [column for column, var in self.column_vars.items() if var.get()]
+        if not columns:
+            messagebox.showerror("خطأ في التحقق", "اختر سعراً واحداً على الأقل.", parent=self.dialog)
+            return None
+        try:
+            percent = float(self.percent_var.get().strip() or 0)
+            amount = float(self.amount_var.get().strip() or 0)
+            round_to = float(self.round_to_var.get().strip() or 0) or None
+            if percent <= -100 or (round_to is not None and round_to < 0):
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("خطأ في التحقق", "النسبة أو المبلغ أو التقريب غير صحيح.", parent=self.dialog)
+            return None
+        return {
+            'percent': percent,
+            'amount': amount,
+            'round_to': round_to,
+            'rounding': self.rounding_var.get(),
+            'columns': columns,
+            'search': self.search_term or None,
+        }
+    
+    def _run(self, work, done):
+        """Run work() on a worker thread, then done(result) on the Tk thread"""
+        if self._busy:
+            return
+        self._busy = True
+        self.dialog.config(cursor="watch")
+        outcome = {}
+        
+        def run():
+            try:
+                outcome['result'] = work()
+            except Exception as e:
+                outcome['error'] = e
+            finally:
+                self.db.release_connection()
+        
+        thread = threading.Thread(target=run, name="Reprice", daemon=True)
+        thread.start()
+        
+        def poll():
+            if thread.is_alive():
+                self.dialog.after(50, poll)
+                return
+            self._busy = False
+            try:
+                self.dialog.config(cursor="")
+            except tk.TclError:
+                return  # Dialog closed meanwhile
+            if 'error' in outcome:
+                messagebox.showerror("خطأ", f"فشل تعديل الأسعار: {outcome['error']}", parent=self.dialog)
+            else:
+                done(outcome['result'])
+        self.dialog.after(50, poll)
+    
+    def _item_label(self, item):
+        """The item's natural key values (name, or dimensions and the like)"""
+        return " / ".join(str(value) for key, value in item.items()
+                          if key != 'id' and key not in self.column_vars
+                          and not key.startswith('new_') and value not in (None, ""))
+    
+    @staticmethod
+    def _money(value):
+        return "-" if value is None else f"${value:.2f}"
+    
+    def preview(self):
+        """Show how many items would change and the new prices of the first ones"""
+        rules = self._rules()
+        if rules is None:
+            return
+        self._run(lambda: self.db.reprice(self.product_type, dry_run=True, **rules), self._show_preview)
+    
+    def _show_preview(self, preview):
+        self.preview_tree.delete(*self.preview_tree.get_children())
+        for item in preview['items']:
+            columns = [c for c in self.column_vars if f'new_{c}' in item]
+            self.preview_tree.insert("", tk.END, values=(
+                "  ".join(self._money(item[f'new_{c}']) for c in columns),
+                "  ".join(self._money(item[c]) for c in columns),
+                self._item_label(item),
+            ))
+        totals = "  ".join(f"{dict(self.PRICE_LABELS[self.product_type])[c]}: "
+                           f"${before:.2f} ← ${after:.2f}"
+                           for c, (before, after) in preview['totals'].items())
+        self.summary_label.config(text=f"سيتغير سعر {preview['changed']} من {preview['matched']} عنصر.  "
+                                       f"المجموع {totals}")
+    
+    def apply(self):
+        """Reprice the items in one transaction after confirming the number changed"""
+        rules = self._rules()
+        if rules is None:
+            return
+        
+        def confirm(preview):
+            self._show_preview(preview)
+            if not preview['changed']:
+                messagebox.showinfo("تعديل الأسعار", "لا توجد أسعار تتغير بهذه القواعد.", parent=self.dialog)
+                return
+            if not messagebox.askyesno("تأكيد", f"هل تريد تعديل أسعار {preview['changed']} عنصر؟",
+                                       parent=self.dialog):
+                return
+            self._run(lambda: self.db.reprice(self.product_type, **rules), applied)
+        
+        def applied(result):
+            self.changed += result['changed']
+            self.summary_label.config(text=f"تم تعديل أسعار {result['changed']} عنصر.")
+            self.preview_tree.delete(*self.preview_tree.get_children())
+        
+        self._run(lambda: self.db.reprice(self.product_type, dry_run=True, **rules), confirm)
+    
+    def close(self):
+        """Close the dialog (a running change still finishes)"""
+        self.dialog.destroy()
+
+
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = FanInventoryApp(root)
+    with startup.phase("create window"):
+        root = tk.Tk()
+        app = FanInventoryApp(root)
     root.mainloop()
 
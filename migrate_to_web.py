@@ -4,14 +4,84 @@ Converts SQLite database (inventory.db) to JSON format for web version
 """
 
 import sqlite3
+import argparse
+import gzip
+import io
 import json
 import os
 from datetime import datetime
+from itertools import groupby
+
+# Columns written for each table (older databases may lack some; they export as null)
+EXPORT_COLUMNS = {
+    'fans': ('id', 'name', 'description', 'airflow', 'price_wholesale', 'price_retail',
+             'quantity', 'catalog_file_path'),
+    'sheet_metal': ('id', 'thickness', 'dimensions', 'measurement', 'cost', 'extra'),
+    'flexible': ('id', 'description', 'diameter', 'collection', 'meter'),
+}
+EXPORT_BATCH_SIZE = 1000  # Rows fetched from SQLite at a time
+EXPORT_VERSION = '1.0'
+
+
+def safe_get(row, key, default=None):
+    """Safely get value from sqlite3.Row, handling missing columns"""
+    try:
+        return row[key]
+    except (KeyError, IndexError):
+        return default
+
+
+def iter_table_rows(cursor, table):
+    """Yield a table's rows as export dicts, reading EXPORT_BATCH_SIZE rows at a time"""
+    cursor.execute(f"SELECT * FROM {table} ORDER BY id")
+    columns = EXPORT_COLUMNS[table]
+    while True:
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        if not rows:
+            return
+        for row in rows:
+            yield {column: safe_get(row, column) for column in columns}
+
+
+def write_json_array(f, key, items, indent='  ', last=False):
+    """Write '"key": [...],' with one item per line; returns the number of items"""
+    f.write(f'{indent}"{key}": [')
+    count = 0
+    for item in items:
+        f.write((',\n' if count else '\n') + indent * 2 + json.dumps(item, ensure_ascii=False))
+        count += 1
+    if count:
+        f.write(f'\n{indent}]')
+    else:
+        f.write(']')
+    f.write('\n' if last else ',\n')
+    return count
+
+
+def open_stream(path, mode):
+    """Open a text file, compressed according to its extension (.gz or .zst)"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("Writing .zst files requires zstandard. Install it with: pip install zstandard")
+        raw = open(path, mode + 'b')
+        if mode == 'w':
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
 
 def export_database_to_json(db_path="inventory.db", output_file="web_data_export.json"):
     """
     Export all data from SQLite database to JSON format
     that can be imported into the web version
+    
+    Rows are written as they are read, so memory use does not grow with the database.
     """
     
     if not os.path.exists(db_path):
@@ -21,75 +91,65 @@ def export_database_to_json(db_path="inventory.db", output_file="web_data_export
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row  # Access columns by name
     cursor = conn.cursor()
-    
-    data = {
-        'fans': [],
-        'sheet_metal': [],
-        'flexible': [],
-        'export_date': datetime.now().isoformat(),
-        'version': '1.0'
-    }
+    counts = {}
     
     try:
-        def safe_get(row, key, default=None):
-            """Safely get value from sqlite3.Row, handling missing columns"""
-            try:
-                return row[key]
-            except (KeyError, IndexError):
-                return default
-        
-        # Export Fans
-        cursor.execute("SELECT * FROM fans")
-        fans = cursor.fetchall()
-        for fan in fans:
-            data['fans'].append({
-                'id': fan['id'],
-                'name': fan['name'],
-                'description': safe_get(fan, 'description'),
-                'airflow': safe_get(fan, 'airflow'),
-                'price_wholesale': fan['price_wholesale'],
-                'price_retail': fan['price_retail'],
-                'quantity': fan['quantity'],
-                'catalog_file_path': safe_get(fan, 'catalog_file_path')
-            })
-        
-        # Export Sheet Metal
-        cursor.execute("SELECT * FROM sheet_metal")
-        sheet_metal = cursor.fetchall()
-        for item in sheet_metal:
-            data['sheet_metal'].append({
-                'id': item['id'],
-                'thickness': safe_get(item, 'thickness'),
-                'dimensions': safe_get(item, 'dimensions'),
-                'measurement': safe_get(item, 'measurement'),
-                'cost': item['cost'],
-                'extra': safe_get(item, 'extra')
-            })
+        with open_stream(output_file, 'w') as f:
+            f.write('{\n')
+            for table in EXPORT_COLUMNS:
+                counts[table] = write_json_array(f, table, iter_table_rows(cursor, table))
+            f.write(f'  "export_date": {json.dumps(datetime.now().isoformat())},\n')
+            f.write(f'  "version": "{EXPORT_VERSION}"\n}}\n')
         
-        # Export Flexible
-        cursor.execute("SELECT * FROM flexible")
-        flexible = cursor.fetchall()
-        for item in flexible:
-            data['flexible'].append({
-                'id': item['id'],
-                'description': safe_get(item, 'description'),
-                'diameter': safe_get(item, 'diameter'),
-                'collection': safe_get(item, 'collection'),
-                'meter': item['meter']
-            })
+        print("Export successful!")
+        print(f"   - Fans: {counts['fans']} items")
+        print(f"   - Sheet Metal: {counts['sheet_metal']} items")
+        print(f"   - Flexible: {counts['flexible']} items")
+        print(f"   - Output file: {output_file}")
         
-        # Save to JSON file
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        return True
+    
+    except Exception as e:
+        print(f"Error exporting data: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        conn.close()
+
+def export_database_to_ndjson(db_path="inventory.db", output_file="web_data_export.ndjson.gz"):
+    """
+    Export all data as NDJSON: a header line, then one {"table": ..., "row": {...}}
+    line per row. Compressed with gzip (.gz) or zstd (.zst) according to the file name.
+    """
+    
+    if not os.path.exists(db_path):
+        print(f"Error: Database file '{db_path}' not found!")
+        return False
+    
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    counts = {}
+    
+    try:
+        with open_stream(output_file, 'w') as f:
+            header = {'version': EXPORT_VERSION, 'export_date': datetime.now().isoformat()}
+            f.write(json.dumps(header) + '\n')
+            for table in EXPORT_COLUMNS:
+                counts[table] = 0
+                for row in iter_table_rows(cursor, table):
+                    f.write(json.dumps({'table': table, 'row': row}, ensure_ascii=False) + '\n')
+                    counts[table] += 1
         
         print("Export successful!")
-        print(f"   - Fans: {len(data['fans'])} items")
-        print(f"   - Sheet Metal: {len(data['sheet_metal'])} items")
-        print(f"   - Flexible: {len(data['flexible'])} items")
+        print(f"   - Fans: {counts['fans']} items")
+        print(f"   - Sheet Metal: {counts['sheet_metal']} items")
+        print(f"   - Flexible: {counts['flexible']} items")
         print(f"   - Output file: {output_file}")
         
         return True
-        
+    
     except Exception as e:
         print(f"Error exporting data: {str(e)}")
         import traceback
@@ -98,6 +158,122 @@ def export_database_to_json(db_path="inventory.db", output_file="web_data_export
     finally:
         conn.close()
 
+def export_delta(db_path="inventory.db", output_file="web_data_delta.json", target="web",
+                 since=None):
+    """
+    Export only the rows added or changed since the last delta for target, plus the
+    ids of deleted items. The file is merged by web/import.html (db.mergeDelta) instead
+    of replacing the web data. The watermark is the last change number (see
+    InventoryDB.iter_changed_records); it is advanced only after the file is written.
+    
+    since: export changes from this UTC time ('YYYY-MM-DD HH:MM:SS') instead of the
+    stored watermark (e.g. to redo a lost delta). The first delta contains every row.
+    Deletion tombstones every target has received and that are older than
+    TOMBSTONE_RETENTION_DAYS are dropped afterwards.
+    """
+    
+    if not os.path.exists(db_path):
+        print(f"Error: Database file '{db_path}' not found!")
+        return False
+    
+    from database import CHANGE_WATERMARK, InventoryDB
+    
+    db = InventoryDB(db_path)  # Also adds change tracking to older databases
+    counts = {}
+    deleted_counts = {}
+    
+    try:
+        # Read before the rows: whatever commits while they are written is numbered above it
+        upto = db.get_replica_state()['seq']
+        previous = db.get_sync_watermarks(target)
+        if since is not None:
+            previous = {}
+            for table in EXPORT_COLUMNS:
+                previous[table] = previous[f'{table}.deleted'] = since
+        # Without a change number: the first delta (every row), --since, or a target
+        # last exported to by an older version (its per-table times)
+        after_seq = int(previous[CHANGE_WATERMARK]) if CHANGE_WATERMARK in previous else None
+        
+        def changed_rows(table):
+            for record in db.iter_changed_records(table, previous.get(table), after_seq):
+                yield {column: record[column] for column in EXPORT_COLUMNS[table]}
+        
+        with open_stream(output_file, 'w') as f:
+            f.write('{\n  "type": "delta",\n')
+            f.write(f'  "since": {json.dumps(previous, sort_keys=True)},\n')
+            for table in EXPORT_COLUMNS:
+                counts[table] = write_json_array(f, table, changed_rows(table))
+            f.write('  "deleted": {\n')
+            for i, table in enumerate(EXPORT_COLUMNS):
+                name = f'{table}.deleted'
+                deleted = db.get_deleted_items(table, previous.get(name), after_seq)
+                deleted_counts[table] = write_json_array(f, table, (item_id for item_id, _ in deleted),
+                                                         indent='    ', last=i == len(EXPORT_COLUMNS) - 1)
+            f.write('  },\n')
+            f.write(f'  "export_date": {json.dumps(datetime.now().isoformat())},\n')
+            f.write(f'  "version": "{EXPORT_VERSION}"\n}}\n')
+        
+        db.set_sync_watermarks(target, {CHANGE_WATERMARK: str(upto)}, replace=True)
+        pruned = db.prune_deleted_items()
+        
+        print("Delta export successful!")
+        print(f"   - Fans: {counts['fans']} changed, {deleted_counts['fans']} deleted")
+        print(f"   - Sheet Metal: {counts['sheet_metal']} changed, {deleted_counts['sheet_metal']} deleted")
+        print(f"   - Flexible: {counts['flexible']} changed, {deleted_counts['flexible']} deleted")
+        if pruned:
+            print(f"   - Dropped {pruned} old deletion records")
+        print(f"   - Output file: {output_file}")
+        
+        return True
+    
+    except Exception as e:
+        print(f"Error exporting delta: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        db.close()
+
+def read_ndjson_export(input_file):
+    """Yield (table, row) pairs from an NDJSON export, one line at a time"""
+    with open_stream(input_file, 'r') as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('version') != EXPORT_VERSION:
+            raise ValueError(f"Unsupported export version: {header.get('version')}")
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record['table'], record['row']
+
+def import_ndjson_to_database(input_file, db_path="inventory.db", on_conflict='update'):
+    """
+    Load an NDJSON export into a desktop database. Rows are matched to existing
+    items like bulk_import.py does (fans by name, ...), so importing into a database
+    that already has the items updates them instead of duplicating them.
+    """
+    from database import InventoryDB
+    
+    upserts = {
+        'fans': 'bulk_upsert_fans',
+        'sheet_metal': 'bulk_upsert_sheet_metal',
+        'flexible': 'bulk_upsert_flexible',
+    }
+    db = InventoryDB(db_path)
+    try:
+        # Rows arrive grouped by table; each group streams into its bulk upsert
+        for table, rows in groupby(read_ndjson_export(input_file), key=lambda item: item[0]):
+            if table not in upserts:
+                raise ValueError(f"Unknown table in export: {table}")
+            stats = getattr(db, upserts[table])((row for _, row in rows), on_conflict=on_conflict)
+            print(f"   - {table}: {stats['inserted']} inserted, {stats['updated']} updated, "
+                  f"{stats['unchanged']} unchanged")
+        return True
+    except Exception as e:
+        print(f"Error importing data: {str(e)}")
+        return False
+    finally:
+        db.close()
+
 def create_web_import_script(json_file="web_data_export.json"):
     """
     Create an HTML file with import functionality for the web version
@@ -193,6 +369,7 @@ def create_web_import_script(json_file="web_data_export.json"):
         <div id="result"></div>
     </div>
     
+    <script src="database.js"></script>
     <script>
         function importData() {{
             const fileInput = document.getElementById('fileInput');
@@ -210,6 +387,19 @@ def create_web_import_script(json_file="web_data_export.json"):
                 try {{
                     const data = JSON.parse(e.target.result);
                     
+                    // Delta files (migrate_to_web.py --delta) are merged into the existing data
+                    if (data.type === 'delta') {{
+                        const summary = db.mergeDelta(data);
+                        showResult(
+                            `تم دمج التحديثات بنجاح! / Changes merged!<br>` +
+                            `- Fans: ${{summary.fans.changed}} changed, ${{summary.fans.deleted}} deleted<br>` +
+                            `- Sheet Metal: ${{summary.sheet_metal.changed}} changed, ${{summary.sheet_metal.deleted}} deleted<br>` +
+                            `- Flexible: ${{summary.flexible.changed}} changed, ${{summary.flexible.deleted}} deleted`,
+                            'success'
+                        );
+                        return;
+                    }}
+                    
                     // Import to localStorage
                     if (data.fans) {{
                         localStorage.setItem('fans_db', JSON.stringify(data.fans));
@@ -251,20 +441,53 @@ def create_web_import_script(json_file="web_data_export.json"):
 </body>
 </html>
 """
-    
+
     with open('web/import.html', 'w', encoding='utf-8') as f:
         f.write(html_content)
     
     print("Import page created: web/import.html")
 
-if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(description="Desktop to Web Database Migration Tool")
+    parser.add_argument('--db', default='inventory.db', help="Database file (default: inventory.db)")
+    parser.add_argument('--format', choices=('json', 'ndjson'), default='json',
+                        help="json: file for web/import.html (default); ndjson: compressed stream")
+    parser.add_argument('--output', help="Output file (default: web_data_export.json "
+                                         "or web_data_export.ndjson.gz)")
+    parser.add_argument('--import', dest='import_file', metavar='FILE',
+                        help="Load an NDJSON export into --db instead of exporting")
+    parser.add_argument('--delta', action='store_true',
+                        help="Export only changes since the last delta (web_data_delta.json)")
+    parser.add_argument('--target', default='web',
+                        help="Name of the copy being kept in sync (default: web)")
+    parser.add_argument('--since', help="With --delta: export changes since this UTC time "
+                                        "('YYYY-MM-DD HH:MM:SS') instead of the last delta")
+    args = parser.parse_args()
+    
     print("=" * 50)
     print("Desktop to Web Database Migration Tool")
     print("=" * 50)
     print()
     
+    if args.import_file:
+        print(f"Importing {args.import_file} into {args.db}...")
+        if not import_ndjson_to_database(args.import_file, args.db):
+            print("\nImport failed. Please check the error above.")
+        return
+    
+    if args.delta:
+        if export_delta(args.db, args.output or "web_data_delta.json", args.target, args.since):
+            print()
+            print("Open 'web/import.html' in your browser and select the delta file")
+            print("to merge these changes into the web version.")
+        return
+    
+    if args.format == 'ndjson':
+        export_database_to_ndjson(args.db, args.output or "web_data_export.ndjson.gz")
+        return
+    
     # Export database
-    success = export_database_to_json()
+    success = export_database_to_json(args.db, args.output or "web_data_export.json")
     
     if success:
         print()
@@ -283,3 +506,5 @@ if __name__ == "__main__":
     else:
         print("\nMigration failed. Please check the error above.")
 
+if __name__ == "__main__":
+    main()
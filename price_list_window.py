@@ -1,16 +1,43 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
+import threading
+import traceback
+from datetime import datetime, timedelta
 from typing import List, Dict
+from background_search import BackgroundSearch
+from virtual_table import VirtualTreeview, PAGE_SIZE
+
+
+def prewarm_quote_engine():
+    """Import python-docx and compile the quote template so the first export starts at once"""
+    try:
+        from quote_template import find_template, get_template
+        template_path = find_template()
+        if template_path:
+            get_template(template_path)
+    except Exception:
+        pass  # export_to_word reports a missing python-docx or a broken template itself
+
 
 class PriceListWindow:
     def __init__(self, parent, db):
         self.db = db
         self.selected_fans = []  # List of dicts: {'fan': fan_data, 'quantity': int}
+        self.prices_date = None  # Day the quote is priced at (YYYY/MM/DD); None = current prices
         
         self.window = tk.Toplevel(parent)
         self.window.title("إنشاء عرض سعر / استفسار")
         self.window.geometry("1200x700")
         self.window.transient(parent)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        
+        # Search-as-you-type runs off the Tk thread; only the newest result is shown
+        self.search = BackgroundSearch(self.window, self.populate_available_fans,
+                                       cleanup=self.db.release_connection)
+        
+        # python-docx takes a while to import; load it while the user builds the quote
+        self._export = None  # State of the running Word export, if any
+        threading.Thread(target=prewarm_quote_engine, name="QuotePrewarm", daemon=True).start()
         
         # Main container
         main_frame = ttk.Frame(self.window, padding="10")
@@ -58,8 +85,10 @@ class PriceListWindow:
                                            xscrollcommand=scrollbar_avail_x.set,
                                            height=15)
         
-        scrollbar_avail_y.config(command=self.available_tree.yview)
         scrollbar_avail_x.config(command=self.available_tree.xview)
+        # Only the rows around the visible window exist as Tk items
+        self.available_table = VirtualTreeview(self.available_tree, scrollbar_avail_y,
+                                               self.format_available_fan)
         
         # Configure available tree columns (Arabic headings for fans, RTL order)
         self.available_tree.heading("Qty", text="كمية")
@@ -93,6 +122,12 @@ class PriceListWindow:
         info_frame.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
         ttk.Label(info_frame, text="انقر نقراً مزدوجاً على نوع السعر أو الكمية للتعديل", 
                  font=("Arial", 9)).pack()
+        prices_frame = ttk.Frame(info_frame)
+        prices_frame.pack(pady=(5, 0))
+        ttk.Button(prices_frame, text="تسعير بتاريخ...", 
+                  command=self.ask_prices_date).pack(side=tk.LEFT, padx=5)
+        self.prices_label = ttk.Label(prices_frame, text="الأسعار الحالية", font=("Arial", 9))
+        self.prices_label.pack(side=tk.LEFT, padx=5)
         
         # Price list treeview
         price_list_tree_frame = ttk.Frame(right_frame)
@@ -159,38 +194,69 @@ class PriceListWindow:
                   command=self.remove_from_price_list).pack(side=tk.LEFT, padx=5)
         ttk.Button(buttons_frame, text="مسح الكل", 
                   command=self.clear_price_list).pack(side=tk.LEFT, padx=5)
-        ttk.Button(buttons_frame, text="تصدير إلى Word", 
-                  command=self.export_to_word).pack(side=tk.LEFT, padx=5)
+        self.export_button = ttk.Button(buttons_frame, text="تصدير إلى Word", 
+                                        command=self.export_to_word)
+        self.export_button.pack(side=tk.LEFT, padx=5)
+        
+        # Export progress, shown only while a Word export is running
+        self.export_frame = ttk.Frame(right_frame)
+        self.export_frame.grid(row=4, column=0, sticky=(tk.W, tk.E))
+        self.export_frame.columnconfigure(1, weight=1)
+        self.export_status = ttk.Label(self.export_frame, text="")
+        self.export_status.grid(row=0, column=0, padx=(0, 5))
+        self.export_progress = ttk.Progressbar(self.export_frame, mode='determinate')
+        self.export_progress.grid(row=0, column=1, sticky=(tk.W, tk.E))
+        ttk.Button(self.export_frame, text="إلغاء", 
+                  command=self.cancel_export).grid(row=0, column=2, padx=(5, 0))
+        self.export_frame.grid_remove()
         
         # Load initial data
         self.refresh_available_fans()
     
+    def close(self):
+        """Stop the search worker and any running export, and close the window"""
+        self.search.close()
+        self.cancel_export()
+        self.window.destroy()
+    
     def refresh_available_fans(self):
         """Refresh the available fans list"""
-        # Clear existing items
-        for item in self.available_tree.get_children():
-            self.available_tree.delete(item)
-        
-        # Get all fans
+        self.search.cancel()
         search_term = self.search_var.get().strip()
-        if search_term:
-            fans = self.db.search_fans(search_term)
-        else:
-            fans = self.db.get_all_fans()
-        
-        # Insert into treeview (use iid to store fan ID, RTL order)
-        for fan in fans:
-            self.available_tree.insert("", tk.END, iid=str(fan['id']), values=(
-                fan['quantity'],
-                f"${fan['price_retail']:.2f}",
-                f"${fan['price_wholesale']:.2f}",
-                fan.get('airflow') or "",
-                fan['name']
-            ))
+        self.populate_available_fans((search_term, self.db.count('fans', search_term), None))
+    
+    def fetch_fans(self, search_term, offset, limit):
+        """Get one page of fans: best matches first when searching, else by name (any thread)"""
+        return self.db.query('fans', order_by=None if search_term else 'name',
+                             limit=limit, offset=offset, search=search_term)
+    
+    def populate_available_fans(self, result):
+        """Show (search_term, total, first_page) in the available list; pages load on scroll"""
+        search_term, total, first_page = result
+        self.available_table.set_source(
+            total,
+            lambda offset, limit: self.fetch_fans(search_term, offset, limit),
+            first_page)
+    
+    def format_available_fan(self, fan):
+        """Column values for an available fan (RTL order)"""
+        return (
+            fan['quantity'],
+            f"${fan['price_retail']:.2f}",
+            f"${fan['price_wholesale']:.2f}",
+            fan.get('airflow') or "",
+            fan['name']
+        )
     
     def on_search_change(self, *args):
-        """Handle search input changes"""
-        self.refresh_available_fans()
+        """Handle search input changes (debounced, queried on a worker thread)"""
+        search_term = self.search_var.get().strip()
+        
+        def query():
+            total = self.db.count('fans', search_term)
+            return search_term, total, self.fetch_fans(search_term, 0, PAGE_SIZE)
+        
+        self.search.submit(query)
     
     def add_to_price_list(self):
         """Add selected fan to price list"""
@@ -209,6 +275,8 @@ class PriceListWindow:
         
         # Get fan data
         fan = self.db.get_fan_by_id(fan_id)
+        if fan and self.prices_date is not None:
+            fan = self.historical_prices([fan]).get(fan_id, fan)
         if fan:
             # Ask user to select price type for this item
             price_type = self.select_price_type_dialog(fan['name'])
@@ -318,6 +386,61 @@ class PriceListWindow:
                         self.update_price_list()
                 break
     
+    def ask_prices_date(self):
+        """Ask for a day and price the quote as it was then (empty: current prices)"""
+        date_str = simpledialog.askstring("تسعير بتاريخ",
+                                         "أدخل التاريخ (YYYY/MM/DD) أو اتركه فارغاً للأسعار الحالية:",
+                                         initialvalue=self.prices_date or "",
+                                         parent=self.window)
+        if date_str is None:
+            return  # User cancelled
+        date_str = date_str.strip()
+        if date_str:
+            try:
+                datetime.strptime(date_str, "%Y/%m/%d")
+            except ValueError:
+                messagebox.showerror("تاريخ غير صحيح", "يرجى إدخال التاريخ بالشكل YYYY/MM/DD.",
+                                     parent=self.window)
+                return
+        self.reprice(date_str or None)
+    
+    def historical_prices(self, fans):
+        """{fan id: fan at its prices at the end of self.prices_date}, for fans with a recorded price"""
+        # End of that day in local time; the price history is kept in UTC
+        day = datetime.strptime(self.prices_date, "%Y/%m/%d")
+        moment = (day + timedelta(days=1) - timedelta(milliseconds=1)).astimezone()
+        prices = self.db.get_prices_at('fans', moment, [fan['id'] for fan in fans])
+        return {fan['id']: fan._replace(**prices[fan['id']]) for fan in fans if fan['id'] in prices}
+    
+    def reprice(self, date_str):
+        """Re-price every item in the list at a past day's prices (None: current prices)"""
+        self.prices_date = date_str
+        current = []
+        for item_data in self.selected_fans:
+            # Start from the stored fan, so a fan edited since keeps its new name
+            fan = self.db.get_fan_by_id(item_data['fan']['id'])
+            if fan is not None:
+                item_data['fan'] = fan
+                current.append(fan)
+        
+        missing = []
+        if date_str is not None:
+            priced = self.historical_prices(current)
+            for item_data in self.selected_fans:
+                fan = priced.get(item_data['fan']['id'])
+                if fan is None:
+                    missing.append(item_data['fan']['name'])
+                else:
+                    item_data['fan'] = fan
+        
+        self.prices_label.config(text=f"الأسعار بتاريخ {date_str}" if date_str else "الأسعار الحالية")
+        self.update_price_list()
+        if missing:
+            messagebox.showwarning("لا يوجد سعر مسجل",
+                                   "لا يوجد سعر مسجل بهذا التاريخ للعناصر التالية، فبقي سعرها الحالي:\n"
+                                   + "\n".join(missing[:20]),
+                                   parent=self.window)
+    
     def clear_price_list(self):
         """Clear all fans from price list"""
         if self.selected_fans and messagebox.askyesno("تأكيد المسح", 
@@ -423,12 +546,7 @@ class PriceListWindow:
             return
         
         try:
-            from docx import Document
-            from docx.shared import Inches, Pt, RGBColor
-            from docx.enum.text import WD_ALIGN_PARAGRAPH
-            from docx.oxml.ns import qn
-            from docx.oxml import OxmlElement
-            import os
+            from quote_template import find_template
         except ImportError:
             messagebox.showerror("Error", 
                 "python-docx library is required. Please install it using:\n"
@@ -436,26 +554,9 @@ class PriceListWindow:
             return
         
         from tkinter import filedialog
-        from datetime import datetime
         
         # Look for template file
-        try:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-        except:
-            current_dir = os.getcwd()
-        
-        template_paths = [
-            "template.docx",
-            "format.docx",
-            os.path.join(current_dir, "template.docx"),
-            os.path.join(current_dir, "format.docx")
-        ]
-        
-        template_path = None
-        for path in template_paths:
-            if os.path.exists(path):
-                template_path = path
-                break
+        template_path = find_template()
         
         if not template_path:
             # Ask user to select template file
@@ -494,7 +595,7 @@ class PriceListWindow:
         # Get date (optional, defaults to today) - with parent window
         date_str = simpledialog.askstring("التاريخ", 
                                          "أدخل التاريخ (YYYY/MM/DD) أو اتركه فارغاً لليوم:",
-                                         initialvalue=datetime.now().strftime("%Y/%m/%d"),
+                                         initialvalue=self.prices_date or datetime.now().strftime("%Y/%m/%d"),
                                          parent=self.window)
         if date_str is None:
             return  # User cancelled
@@ -514,206 +615,76 @@ class PriceListWindow:
         )
         
         if filename:
+            self.start_export(template_path, customer_name, date_str, filename)
+    
+    def start_export(self, template_path, customer_name, date_str, filename):
+        """Render the quote on a worker thread; progress is polled from the Tk thread"""
+        from quote_template import get_template
+        
+        # Snapshot the list so the quote can keep being edited while it is written
+        items = [dict(item_data) for item_data in self.selected_fans]
+        export = {
+            'cancel': threading.Event(),
+            'progress': (0, len(items)),  # Replaced by the worker, read by _poll_export
+            'error': None,
+            'finished': False,
+            'filename': filename,
+        }
+        
+        def progress(done, total):
+            export['progress'] = (done, total)
+        
+        def run():
             try:
-                # Load template document
-                doc = Document(template_path)
-                
-                # Helper function to replace placeholders in text
-                def replace_placeholder_in_runs(runs, placeholder, replacement):
-                    """Replace placeholder text in paragraph runs"""
-                    full_text = ''.join(run.text for run in runs)
-                    if placeholder in full_text:
-                        # Clear all runs
-                        for run in runs:
-                            run.text = ''
-                        # Recreate with replacement
-                        if runs:
-                            runs[0].text = full_text.replace(placeholder, replacement)
-                
-                # Replace placeholders in all paragraphs
-                placeholders = {
-                    '{CUSTOMER_NAME}': customer_name,
-                    '{DATE}': date_str,
-                    '{{CUSTOMER_NAME}}': customer_name,
-                    '{{DATE}}': date_str,
-                }
-                
-                for para in doc.paragraphs:
-                    for placeholder, replacement in placeholders.items():
-                        if placeholder in para.text:
-                            # Replace in all runs
-                            for run in para.runs:
-                                if placeholder in run.text:
-                                    run.text = run.text.replace(placeholder, replacement)
-                            # Also check the paragraph text directly
-                            if placeholder in para.text:
-                                para.text = para.text.replace(placeholder, replacement)
-                
-                # Replace placeholders in table cells
-                for table in doc.tables:
-                    for row in table.rows:
-                        for cell in row.cells:
-                            for para in cell.paragraphs:
-                                for placeholder, replacement in placeholders.items():
-                                    if placeholder in para.text:
-                                        # Replace in all runs
-                                        for run in para.runs:
-                                            if placeholder in run.text:
-                                                run.text = run.text.replace(placeholder, replacement)
-                                        # Also check the paragraph text directly
-                                        if placeholder in para.text:
-                                            para.text = para.text.replace(placeholder, replacement)
-                
-                # Find and populate product table
-                # Look for a table with placeholder {PRODUCTS_TABLE} or find the first suitable table
-                product_table = None
-                product_table_placeholder_found = False
-                
-                # First, try to find a table with {PRODUCTS_TABLE} placeholder
-                for table in doc.tables:
-                    for row in table.rows:
-                        for cell in row.cells:
-                            for para in cell.paragraphs:
-                                if '{PRODUCTS_TABLE}' in para.text or '{{PRODUCTS_TABLE}}' in para.text:
-                                    product_table = table
-                                    product_table_placeholder_found = True
-                                    # Clear the placeholder cell
-                                    para.text = ''
-                                    break
-                        if product_table:
-                            break
-                    if product_table:
-                        break
-                
-                # If no placeholder found, use the first table (assuming it's the product table)
-                if not product_table and doc.tables:
-                    product_table = doc.tables[0]
-                
-                if product_table:
-                    # Clear existing rows except header (if placeholder was found, clear all)
-                    if product_table_placeholder_found:
-                        # Remove all rows
-                        for i in range(len(product_table.rows) - 1, -1, -1):
-                            product_table._element.remove(product_table.rows[i]._element)
-                        # Add header row
-                        header_row = product_table.add_row()
-                    else:
-                        # Keep first row as header, clear others
-                        while len(product_table.rows) > 1:
-                            product_table._element.remove(product_table.rows[-1]._element)
-                        header_row = product_table.rows[0]
-                    
-                    # Set table RTL properties
-                    tbl = product_table._element
-                    tblPr = tbl.tblPr
-                    if tblPr is None:
-                        tblPr = OxmlElement('w:tblPr')
-                        tbl.insert(0, tblPr)
-                    tblPr.set(qn('w:bidiVisual'), '1')
-                    tblPr.set(qn('w:jc'), 'right')
-                    
-                    # Ensure header exists with 4 columns
-                    header_cells = header_row.cells
-                    while len(header_cells) < 4:
-                        header_row._element.append(OxmlElement('w:tc'))
-                        header_cells = header_row.cells
-                    
-                    # Set header text (RTL order: الإجمالي, عدد, الإفرادي, النوع)
-                    headers = ["الإجمالي", "عدد", "الإفرادي", "النوع"]
-                    for i, header_text in enumerate(headers):
-                        if i < len(header_cells):
-                            cell = header_cells[i]
-                            # Clear existing content
-                            cell.text = ''
-                            para = cell.paragraphs[0]
-                            para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                            pPr = para._element.get_or_add_pPr()
-                            pPr.set(qn('w:bidi'), '1')
-                            run = para.add_run(header_text)
-                            run.bold = True
-                    
-                    # Add product rows
-                    grand_total = 0
-                    for item_data in self.selected_fans:
-                        fan = item_data['fan']
-                        qty = item_data['quantity']
-                        item_price_type = item_data.get('price_type', 'retail')
-                        unit_price = fan['price_retail'] if item_price_type == 'retail' else fan['price_wholesale']
-                        total_price = unit_price * qty
-                        grand_total += total_price
-                        
-                        row_cells = product_table.add_row().cells
-                        
-                        # Column 0: الإجمالي (Total)
-                        if len(row_cells) > 0:
-                            total_cell = row_cells[0]
-                            total_para = total_cell.paragraphs[0]
-                            total_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                            total_para.text = f"$ {total_price:.0f}"
-                        
-                        # Column 1: عدد (Quantity)
-                        if len(row_cells) > 1:
-                            qty_cell = row_cells[1]
-                            qty_para = qty_cell.paragraphs[0]
-                            qty_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                            qty_para.text = str(qty)
-                        
-                        # Column 2: الإفرادي (Unit Price)
-                        if len(row_cells) > 2:
-                            price_cell = row_cells[2]
-                            price_para = price_cell.paragraphs[0]
-                            price_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                            price_para.text = f"{unit_price:.0f}"
-                        
-                        # Column 3: النوع (Type/Description)
-                        if len(row_cells) > 3:
-                            type_cell = row_cells[3]
-                            type_cell.text = ''  # Clear cell
-                            type_para = type_cell.paragraphs[0]
-                            type_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-                            pPr = type_para._element.get_or_add_pPr()
-                            pPr.set(qn('w:bidi'), '1')
-                            
-                            # Add description first (if exists), then name
-                            description = fan.get('description')
-                            description_text = description.strip() if description else ''
-                            if description_text:
-                                type_para.add_run(description_text)
-                                type_para = type_cell.add_paragraph()
-                                type_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-                                pPr = type_para._element.get_or_add_pPr()
-                                pPr.set(qn('w:bidi'), '1')
-                            
-                            # Add name
-                            type_para.add_run(fan['name'])
-                            
-                            # Add airflow if exists
-                            airflow = fan.get('airflow')
-                            if airflow:
-                                type_para = type_cell.add_paragraph()
-                                type_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-                                pPr = type_para._element.get_or_add_pPr()
-                                pPr.set(qn('w:bidi'), '1')
-                                type_para.add_run(f"Airflow: {airflow}")
-                
-                # Ensure RTL is set on all paragraphs and table cells
-                for para in doc.paragraphs:
-                    pPr = para._element.get_or_add_pPr()
-                    pPr.set(qn('w:bidi'), '1')
-                
-                for table in doc.tables:
-                    for row in table.rows:
-                        for cell in row.cells:
-                            for para in cell.paragraphs:
-                                pPr = para._element.get_or_add_pPr()
-                                pPr.set(qn('w:bidi'), '1')
-                
-                # Save document
-                doc.save(filename)
-                
-                messagebox.showinfo("نجح", f"تم تصدير عرض السعر إلى {filename}")
+                # The template is compiled once and cached; each quote renders from a copy
+                get_template(template_path).render(customer_name, date_str, items, filename,
+                                                   progress=progress, cancel=export['cancel'])
             except Exception as e:
-                messagebox.showerror("Error", f"Failed to export: {str(e)}")
-                import traceback
-                traceback.print_exc()
+                export['error'] = e
+            export['finished'] = True
+        
+        self._export = export
+        self.export_button.config(state=tk.DISABLED)
+        self.export_status.config(text="جارٍ التصدير...")
+        self.export_progress.config(maximum=max(1, len(items)), value=0)
+        self.export_frame.grid()
+        threading.Thread(target=run, name="QuoteExport", daemon=True).start()
+        self.window.after(50, self._poll_export)
+    
+    def cancel_export(self):
+        """Stop the running export; nothing is written to the file"""
+        if self._export is not None:
+            self._export['cancel'].set()
+            try:
+                self.export_status.config(text="جارٍ الإلغاء...")
+            except tk.TclError:
+                pass  # Window already destroyed
+    
+    def _poll_export(self):
+        """Show the export's progress and report the result once it finishes (Tk thread)"""
+        export = self._export
+        if export is None:
+            return
+        try:
+            done, total = export['progress']
+            self.export_progress.config(maximum=max(1, total), value=done)
+            if not export['finished']:
+                self.window.after(50, self._poll_export)
+                return
+        except tk.TclError:
+            return  # Window closed during the export
+        
+        self._export = None
+        self.export_frame.grid_remove()
+        self.export_button.config(state=tk.NORMAL)
+        
+        from quote_template import RenderCancelled
+        error = export['error']
+        if error is None:
+            messagebox.showinfo("نجح", f"تم تصدير عرض السعر إلى {export['filename']}", parent=self.window)
+        elif isinstance(error, RenderCancelled):
+            messagebox.showinfo("تم الإلغاء", "تم إلغاء تصدير عرض السعر.", parent=self.window)
+        else:
+            messagebox.showerror("Error", f"Failed to export: {str(error)}", parent=self.window)
+            traceback.print_exception(type(error), error, error.__traceback__)
 
@@ -0,0 +1,346 @@
+"""
+Word quote rendering for the price list.
+
+A quote template (template.docx / format.docx) is parsed once into a
+QuoteTemplate: placeholder runs are located, the product table is cut back to
+its header row and right-to-left settings are applied. Each quote is then
+rendered from a copy of that compiled tree, so the template is never re-read
+or re-scanned per export.
+
+    template = get_template("format.docx")
+    template.render(customer_name, date_str, items, "quote.docx")
+
+items is the price list as PriceListWindow keeps it: dicts with 'fan'
+(a fan record), 'quantity' and 'price_type' ('retail' or 'wholesale').
+"""
+
+import copy
+import io
+import os
+import re
+import threading
+import zipfile
+
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.text.run import Run
+
+TEMPLATE_NAMES = ("template.docx", "format.docx")
+
+# {{NAME}} is matched before {NAME}, so double-brace placeholders leave no braces behind
+PLACEHOLDER_RE = re.compile(r'\{\{(CUSTOMER_NAME|DATE)\}\}|\{(CUSTOMER_NAME|DATE)\}')
+PRODUCTS_TABLE_RE = re.compile(r'\{\{PRODUCTS_TABLE\}\}|\{PRODUCTS_TABLE\}')
+
+# Product table header, in RTL order: الإجمالي, عدد, الإفرادي, النوع
+PRODUCT_HEADERS = ("الإجمالي", "عدد", "الإفرادي", "النوع")
+
+DOCUMENT_PART = 'word/document.xml'
+
+# Already-compressed media is stored in the package as-is instead of being deflated again
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.emf', '.wmf')
+
+
+class RenderCancelled(Exception):
+    """Raised by QuoteTemplate.render when its cancel event is set"""
+
+
+def find_template(search_dirs=None):
+    """First template.docx/format.docx found in the working directory or search_dirs, else None"""
+    if search_dirs is None:
+        try:
+            search_dirs = [os.path.dirname(os.path.abspath(__file__))]
+        except NameError:
+            search_dirs = []
+    for directory in [''] + list(search_dirs):
+        for name in TEMPLATE_NAMES:
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def _set_bidi(paragraph):
+    paragraph._element.get_or_add_pPr().set(qn('w:bidi'), '1')
+
+
+def _merge_split_placeholders(paragraph, pattern):
+    """
+    Move placeholders that Word split across several runs into the first of those runs,
+    so every placeholder lives inside a single run. Returns the paragraph's runs.
+    """
+    runs = paragraph.runs
+    if len(runs) < 2:
+        return runs
+    texts = [run.text for run in runs]
+    starts = []
+    offset = 0
+    for text in texts:
+        starts.append(offset)
+        offset += len(text)
+    
+    def run_at(position):
+        index = 0
+        while index + 1 < len(starts) and starts[index + 1] <= position:
+            index += 1
+        return index
+    
+    # Work backwards so earlier offsets stay valid while runs are merged
+    for match in reversed(list(pattern.finditer(''.join(texts)))):
+        first, last = run_at(match.start()), run_at(match.end() - 1)
+        if first != last:
+            texts[first] = ''.join(texts[first:last + 1])
+            for index in range(first + 1, last + 1):
+                texts[index] = ''
+            for index in range(first, last + 1):
+                runs[index].text = texts[index]
+    return runs
+
+
+class QuoteTemplate:
+    """A quote template parsed once and rendered any number of times"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._document = Document(path)
+        self._body = self._document._body
+        root = self._document.element
+        
+        self._table_index = self._prepare_product_table()
+        
+        for para in self._iter_paragraphs():
+            _set_bidi(para)
+        
+        # Runs holding a placeholder, as (position in root.iter(w:r), template text)
+        self._fields = []
+        placeholder_runs = {}
+        for para in self._iter_paragraphs():
+            if PLACEHOLDER_RE.search(para.text):
+                for run in _merge_split_placeholders(para, PLACEHOLDER_RE):
+                    if PLACEHOLDER_RE.search(run.text):
+                        placeholder_runs[run._r] = run.text
+        if placeholder_runs:
+            for index, r in enumerate(root.iter(qn('w:r'))):
+                if r in placeholder_runs:
+                    self._fields.append((index, placeholder_runs[r]))
+        
+        # Every other part of the package is written back unchanged, so zip it once
+        saved = io.BytesIO()
+        self._document.save(saved)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(saved) as source, \
+                zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as package:
+            for info in source.infolist():
+                if info.filename == DOCUMENT_PART:
+                    continue
+                compression = (zipfile.ZIP_STORED if info.filename.lower().endswith(STORED_EXTENSIONS)
+                               else zipfile.ZIP_DEFLATED)
+                package.writestr(info.filename, source.read(info), compression)
+        self._package = buffer.getvalue()
+        self._root = root
+    
+    def _iter_paragraphs(self):
+        """Body paragraphs and paragraphs in top-level table cells"""
+        document = self._document
+        for para in document.paragraphs:
+            yield para
+        for table in document.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    for para in cell.paragraphs:
+                        yield para
+    
+    def _prepare_product_table(self):
+        """
+        Cut the product table back to a header row and return its position among the
+        document's w:tbl elements (None if the template has no table). The table marked
+        with {PRODUCTS_TABLE} is used if there is one, otherwise the first table.
+        """
+        document = self._document
+        product_table = None
+        for table in document.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    for para in cell.paragraphs:
+                        if PRODUCTS_TABLE_RE.search(para.text):
+                            product_table = table
+                            break
+                    if product_table:
+                        break
+                if product_table:
+                    break
+        
+        if product_table:
+            # Placeholder table: drop every row and build the header from scratch
+            for row in list(product_table.rows):
+                product_table._element.remove(row._element)
+            header_row = product_table.add_row()
+        elif document.tables:
+            # Keep the first row as the header
+            product_table = document.tables[0]
+            for row in list(product_table.rows)[1:]:
+                product_table._element.remove(row._element)
+            header_row = product_table.rows[0]
+        else:
+            return None
+        
+        tbl = product_table._element
+        tblPr = tbl.tblPr
+        if tblPr is None:
+            tblPr = OxmlElement('w:tblPr')
+            tbl.insert(0, tblPr)
+        tblPr.set(qn('w:bidiVisual'), '1')
+        tblPr.set(qn('w:jc'), 'right')
+        
+        header_cells = header_row.cells
+        while len(header_cells) < len(PRODUCT_HEADERS):
+            header_row._element.append(OxmlElement('w:tc'))
+            header_cells = header_row.cells
+        for cell, header_text in zip(header_cells, PRODUCT_HEADERS):
+            cell.text = ''
+            para = cell.paragraphs[0]
+            para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            _set_bidi(para)
+            para.add_run(header_text).bold = True
+        
+        self._build_prototype_row(product_table)
+        
+        for index, element in enumerate(self._document.element.iter(qn('w:tbl'))):
+            if element is tbl:
+                return index
+        return None
+    
+    def _build_prototype_row(self, table):
+        """
+        Build one product row with python-docx and keep it detached from the table;
+        rendering copies it and only fills in the text.
+        """
+        row = table.add_row()
+        cells = row.cells
+        for cell in cells[:3]:
+            para = cell.paragraphs[0]
+            para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            _set_bidi(para)
+            para.add_run('0')
+        
+        # The type cell gets one right-aligned paragraph per line, copied from self._line
+        self._line = None
+        if len(cells) > 3:
+            para = cells[3].paragraphs[0]
+            para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+            _set_bidi(para)
+            para.add_run('0')
+            self._line = para._element
+            cells[3]._tc.remove(self._line)
+        
+        for t in row._tr.iter(qn('w:t')):
+            t.set(qn('xml:space'), 'preserve')
+        if self._line is not None:
+            next(self._line.iter(qn('w:t'))).set(qn('xml:space'), 'preserve')
+        table._element.remove(row._tr)
+        self._row = row._tr
+    
+    def render(self, customer_name, date_str, items, output, progress=None, cancel=None):
+        """
+        Write a quote for items to output (a path or a binary file object).
+        Returns the grand total.
+        
+        progress: called as progress(rows_done, total_rows) while the product table is built
+        cancel: a threading.Event; once set, rendering stops with RenderCancelled and
+                nothing is written to output
+        """
+        values = {'CUSTOMER_NAME': customer_name, 'DATE': date_str}
+        root = copy.deepcopy(self._root)
+        
+        if self._fields:
+            runs = list(root.iter(qn('w:r')))
+            for index, text in self._fields:
+                Run(runs[index], self._body).text = PLACEHOLDER_RE.sub(
+                    lambda m: values[m.group(1) or m.group(2)], text)
+        
+        grand_total = 0
+        if self._table_index is not None:
+            for index, tbl in enumerate(root.iter(qn('w:tbl'))):
+                if index == self._table_index:
+                    grand_total = self._add_product_rows(tbl, items, progress, cancel)
+                    break
+        if cancel is not None and cancel.is_set():
+            raise RenderCancelled()
+        
+        # The static parts are already zipped; only document.xml is added per quote
+        buffer = io.BytesIO(self._package)
+        with zipfile.ZipFile(buffer, 'a', zipfile.ZIP_DEFLATED) as package:
+            package.writestr(DOCUMENT_PART, serialize_part_xml(root))
+        
+        if isinstance(output, (str, bytes, os.PathLike)):
+            with open(output, 'wb') as f:
+                f.write(buffer.getvalue())
+        else:
+            output.write(buffer.getvalue())
+        return grand_total
+    
+    def _add_product_rows(self, tbl, items, progress=None, cancel=None):
+        """Append a copy of the prototype row per price list item; returns the grand total"""
+        grand_total = 0
+        for done, item_data in enumerate(items):
+            if cancel is not None and cancel.is_set():
+                raise RenderCancelled()
+            if progress is not None:
+                progress(done, len(items))
+            fan = item_data['fan']
+            qty = item_data['quantity']
+            item_price_type = item_data.get('price_type', 'retail')
+            unit_price = fan['price_retail'] if item_price_type == 'retail' else fan['price_wholesale']
+            total_price = unit_price * qty
+            grand_total += total_price
+            
+            tr = copy.deepcopy(self._row)
+            tbl.append(tr)
+            
+            # Columns 0-2: الإجمالي (Total), عدد (Quantity), الإفرادي (Unit Price)
+            for t, text in zip(tr.iter(qn('w:t')), (f"$ {total_price:.0f}", str(qty), f"{unit_price:.0f}")):
+                t.text = text
+            
+            # Column 3: النوع (Type/Description) - description, name and airflow, one line each
+            if self._line is not None:
+                type_cell = tr.findall(qn('w:tc'))[3]
+                lines = []
+                description = fan.get('description')
+                description_text = description.strip() if description else ''
+                if description_text:
+                    lines.append(description_text)
+                lines.append(str(fan['name']))
+                airflow = fan.get('airflow')
+                if airflow:
+                    lines.append(f"Airflow: {airflow}")
+                for line in lines:
+                    p = copy.deepcopy(self._line)
+                    next(p.iter(qn('w:t'))).text = line
+                    type_cell.append(p)
+        if progress is not None:
+            progress(len(items), len(items))
+        return grand_total
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_template(path):
+    """
+    Compiled template for path. Templates are cached per file and recompiled when
+    the file's modification time or size changes.
+    """
+    key = os.path.abspath(path)
+    stat = os.stat(key)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+    template = QuoteTemplate(key)
+    with _cache_lock:
+        _cache[key] = (stamp, template)
+    return template
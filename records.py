@@ -0,0 +1,81 @@
+"""
+Compact row records for the product tables.
+
+A dict per row costs several hundred bytes before any of its values are
+counted. Fan, SheetMetal and Flexible are named tuples instead: one small
+tuple per row, with the column names stored once on the class.
+
+Records still read like the dicts the GUI code was written against
+(fan['name'], item.get('airflow'), dict(fan)), and are immutable, so the
+same record can safely be handed out by InventoryDB's row cache.
+"""
+
+from collections import namedtuple
+
+FAN_COLUMNS = ('id', 'name', 'description', 'airflow', 'price_wholesale', 'price_retail',
+               'quantity', 'catalog_file_path', 'created_at', 'updated_at')
+SHEET_METAL_COLUMNS = ('id', 'thickness', 'dimensions', 'measurement', 'cost', 'extra',
+                       'quantity', 'created_at', 'updated_at')
+FLEXIBLE_COLUMNS = ('id', 'description', 'diameter', 'collection', 'meter',
+                    'created_at', 'updated_at')
+
+
+class RecordMixin:
+    """Dict-style access for named tuple records (record['name'], record.get('name'))"""
+    __slots__ = ()
+    _index = {}  # column name -> position, set per class
+    
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._index[key]
+            except KeyError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+    
+    def __contains__(self, key):
+        return key in self._index
+    
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+    
+    def keys(self):
+        return self._fields
+    
+    def values(self):
+        return tuple(self)
+    
+    def items(self):
+        return zip(self._fields, self)
+    
+    def to_dict(self):
+        return dict(zip(self._fields, self))
+    
+    @classmethod
+    def row_factory(cls, cursor, row):
+        """sqlite3 row factory; the SELECT must list cls._fields in order"""
+        return tuple.__new__(cls, row)
+
+
+class Fan(RecordMixin, namedtuple('Fan', FAN_COLUMNS)):
+    __slots__ = ()
+    _index = {c: i for i, c in enumerate(FAN_COLUMNS)}
+
+
+class SheetMetal(RecordMixin, namedtuple('SheetMetal', SHEET_METAL_COLUMNS)):
+    __slots__ = ()
+    _index = {c: i for i, c in enumerate(SHEET_METAL_COLUMNS)}
+
+
+class Flexible(RecordMixin, namedtuple('Flexible', FLEXIBLE_COLUMNS)):
+    __slots__ = ()
+    _index = {c: i for i, c in enumerate(FLEXIBLE_COLUMNS)}
+
+
+# Record class for each product table
+RECORD_TYPES = {
+    'fans': Fan,
+    'sheet_metal': SheetMetal,
+    'flexible': Flexible,
+}
@@ -0,0 +1,142 @@
+"""
+Multi-site replication through changeset files.
+
+Each copy of the application (e.g. the warehouse and the showroom) records its
+own changes. A changeset holds only the changes made or received since the
+last changeset sent to that peer, so it stays small however large the
+database is:
+
+    python replicate.py export showroom to_showroom.ndjson.gz    # at the warehouse
+    python replicate.py apply to_showroom.ndjson.gz              # at the showroom
+    python replicate.py export warehouse to_warehouse.ndjson.gz  # and back
+
+Applying a changeset twice (or an older one again) changes nothing. When both
+sites changed the same item, the later change wins (Lamport clock, then site
+id); a deletion always wins. Quantities are merged, not overwritten: if each
+site sells one of an item, both end up with two fewer.
+
+Setting up a second site: copy inventory.db there, then give the copy its own
+site id before using it:
+
+    python replicate.py new-site
+
+File format: gzip-compressed NDJSON (.zst with zstandard installed, or plain
+.ndjson). The first line is a header, then one change per line:
+    {"op": "upsert", "t": "fans", "g": "<row id>", "c": <clock>, "s": "<site>", "row": {...}}
+    {"op": "delete", "t": "fans", "g": "<row id>", "c": <clock>, "s": "<site>"}
+    {"op": "stock",  "t": "fans", "g": "<row id>", "s": "<site>", "n": <net change>, "v": <count>}
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+
+from database import InventoryDB
+from migrate_to_web import open_stream
+
+CHANGESET_VERSION = 1
+
+
+def peer_target(peer):
+    """sync_state target holding the last change number sent to a peer"""
+    return f"replica:{peer}"
+
+
+def export_changeset(db, peer, path, resend_all=False):
+    """Write the changes not yet sent to peer; returns (number of changes, header)"""
+    state = db.get_replica_state()
+    since = 0 if resend_all else int(db.get_sync_watermarks(peer_target(peer)).get('seq', 0))
+    header = {
+        'type': 'changeset',
+        'version': CHANGESET_VERSION,
+        'site': state['site'],
+        'since': since,
+        'upto': state['seq'],
+        'created': datetime.now().isoformat(timespec='seconds'),
+    }
+    count = 0
+    with open_stream(path, 'w') as f:
+        f.write(json.dumps(header) + '\n')
+        for change in db.iter_replica_changes(since, state['seq']):
+            f.write(json.dumps(change, ensure_ascii=False, separators=(',', ':')) + '\n')
+            count += 1
+    # Only after the file is complete, so a failed export is simply repeated
+    db.set_sync_watermarks(peer_target(peer), {'seq': str(state['seq'])})
+    return count, header
+
+
+def read_changeset(path):
+    """(header, iterator over the changes) of a changeset file"""
+    f = open_stream(path, 'r')
+    header = json.loads(f.readline() or '{}')
+    if header.get('type') != 'changeset' or header.get('version') != CHANGESET_VERSION:
+        f.close()
+        raise ValueError(f"{path} is not a version {CHANGESET_VERSION} changeset")
+    
+    def changes():
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    return header, changes()
+
+
+def apply_changeset(db, path):
+    """Apply a changeset file in a single transaction; returns (stats, header)"""
+    header, changes = read_changeset(path)
+    if header['site'] == db.get_replica_state()['site']:
+        raise ValueError("This changeset was written by this database. If inventory.db was copied "
+                         "from another site, run 'python replicate.py new-site' first.")
+    return db.apply_replica_changes(changes), header
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replicate inventory changes between sites")
+    parser.add_argument('--db', default='inventory.db', help="Database file (default: inventory.db)")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    
+    export = commands.add_parser('export', help="Write the changes not yet sent to a peer")
+    export.add_argument('peer', help="Name of the receiving site (e.g. showroom)")
+    export.add_argument('file', help="Changeset file (.ndjson.gz, .ndjson.zst or .ndjson)")
+    export.add_argument('--all', action='store_true',
+                        help="Send every row again (e.g. after a changeset was lost)")
+    
+    apply = commands.add_parser('apply', help="Apply a changeset from another site")
+    apply.add_argument('file')
+    
+    commands.add_parser('status', help="Show this site's id and the peers' watermarks")
+    commands.add_parser('new-site', help="Give a copied database its own site id")
+    args = parser.parse_args()
+    
+    db = InventoryDB(args.db)
+    try:
+        if args.command == 'export':
+            count, header = export_changeset(db, args.peer, args.file, args.all)
+            print(f"Wrote {count} changes ({header['since']}..{header['upto']}) to {args.file}")
+        elif args.command == 'apply':
+            stats, header = apply_changeset(db, args.file)
+            print(f"Applied changes {header['since']}..{header['upto']} from site {header['site']}:")
+            for key in ('inserted', 'updated', 'deleted', 'stock', 'unchanged', 'conflicts'):
+                print(f"   - {key}: {stats[key]}")
+        elif args.command == 'status':
+            state = db.get_replica_state()
+            print(f"Site {state['site']}, clock {state['clock']}, last change {state['seq']}")
+            cursor = db.get_connection().cursor()
+            cursor.execute("SELECT target, watermark FROM sync_state "
+                           "WHERE target LIKE 'replica:%' AND name = 'seq' ORDER BY target")
+            for target, watermark in cursor.fetchall():
+                print(f"   - {target.split(':', 1)[1]}: sent up to {watermark}")
+        elif args.command == 'new-site':
+            print(f"New site id: {db.new_replica_site()}")
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
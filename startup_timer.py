@@ -0,0 +1,72 @@
+"""
+Startup timing for the main window.
+
+StartupTimer records how long each startup phase takes (imports, building the
+window, the schema check, loading the first page) and appends one line per
+launch to startup.log, so a slower start after an update shows up as a change
+in one column rather than a vague "it feels slower":
+
+    2025-03-01 09:14:02  total 412 ms | import tkinter 118 | import database 9 | ...
+
+Modules loaded on first use instead of at startup (the price list window) are
+logged on their own line when they are first imported.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+STARTUP_LOG = "startup.log"
+STARTUP_LOG_LINES = 200  # Older launches are dropped from the log
+
+
+class StartupTimer:
+    def __init__(self, log_path: str = STARTUP_LOG):
+        self.log_path = log_path
+        self.started = time.perf_counter()
+        self.phases = []  # (name, seconds), in the order they finished
+        self._lock = threading.Lock()
+        self._written = False
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the statements in the with-block (imports included) as one phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        """Add a phase timed elsewhere (e.g. on a worker thread)"""
+        with self._lock:
+            self.phases.append((name, seconds))
+
+    def finish(self):
+        """Startup is over: append the breakdown to the log (once)"""
+        with self._lock:
+            if self._written:
+                return
+            self._written = True
+            total = time.perf_counter() - self.started
+            parts = [f"{name} {seconds * 1000:.0f}" for name, seconds in self.phases]
+        self._append(f"total {total * 1000:.0f} ms | " + " | ".join(parts))
+
+    def log_first_use(self, name: str, seconds: float):
+        """Log a module that was loaded on first use instead of at startup"""
+        self._append(f"first use: {name} {seconds * 1000:.0f} ms")
+
+    def _append(self, message: str):
+        line = f"{datetime.now():%Y-%m-%d %H:%M:%S}  {message}\n"
+        try:
+            lines = []
+            if os.path.exists(self.log_path):
+                with open(self.log_path, encoding='utf-8') as f:
+                    lines = f.readlines()
+            lines = lines[-(STARTUP_LOG_LINES - 1):] + [line]
+            with open(self.log_path, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+        except OSError:
+            pass  # Read-only folder; timing is diagnostic only
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# The application modules live at the top of the repository, not in a package
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# The shipped database predates versioning (user_version 0): the baseline schema
+BASELINE_DB = os.path.join(REPO_DIR, 'inventory.db')
+
+from database import InventoryDB  # noqa: E402
+
+
+@pytest.fixture
+def make_db(tmp_path):
+    """Open InventoryDBs in the test's temporary folder; all are closed afterwards"""
+    opened = []
+    
+    def make(name="inventory.db", **kwargs):
+        db = InventoryDB(str(tmp_path / name), **kwargs)
+        opened.append(db)
+        return db
+    
+    yield make
+    for db in opened:
+        db.close()
+
+
+@pytest.fixture
+def db(make_db):
+    return make_db()
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import api_server
+from api_server import InventoryAPI, Request
+
+
+@pytest.fixture
+def api(db):
+    db.bulk_upsert_fans({'name': f'Fan {i:02d}', 'price_wholesale': i, 'price_retail': i + 1,
+                         'quantity': 1} for i in range(30))
+    return InventoryAPI(db, cors_origin=None)
+
+
+def get(api, target):
+    response = api.handle(Request('GET', target, 'HTTP/1.1', {}))
+    return response.status, json.loads(response.body)
+
+
+def test_pages_follow_each_other(api):
+    status, page = get(api, '/api/fans?limit=10&offset=25&order_by=name')
+    assert status == 200
+    assert [item['name'] for item in page['items']] == [f'Fan {i:02d}' for i in range(25, 30)]
+    assert (page['total'], page['limit'], page['offset'], page['next_offset']) == (30, 10, 25, None)
+    
+    status, page = get(api, '/api/fans?limit=10&order_by=name')
+    assert page['next_offset'] == 10
+
+
+def test_default_and_maximum_page_size(api, monkeypatch):
+    status, page = get(api, '/api/fans')
+    assert page['limit'] == api_server.PAGE_SIZE
+    
+    monkeypatch.setattr(api_server, 'MAX_PAGE_SIZE', 7)
+    status, page = get(api, '/api/fans?limit=5000')
+    assert status == 200
+    assert (page['limit'], len(page['items'])) == (7, 7)
+
+
+@pytest.mark.parametrize('query', ['limit=-5', 'limit=0', 'offset=-1', 'limit=abc', 'offset=1.5'])
+def test_invalid_paging_is_rejected(api, query):
+    status, body = get(api, f'/api/fans?{query}')
+    assert status == 400
+    assert 'error' in body
+
+
+def test_unknown_sort_column_is_rejected(api):
+    status, body = get(api, '/api/fans?order_by=price_retail;DROP')
+    assert status == 400
+
+
+def test_catalog_changes_change_the_fans_etag(api, db):
+    db.add_fan('Axial 500', None, None, 50.0, 60.0, 1, catalog_file_path='catalogs/axial.pdf')
+    first = api.handle(Request('GET', '/api/fans?search=backward', 'HTTP/1.1', {}))
+    assert json.loads(first.body)['total'] == 0
+    
+    db.save_catalog_entry('catalogs/axial.pdf', 1, 100, 1, 'axial.pdf', 'backward curved impeller')
+    response = api.handle(Request('GET', '/api/fans?search=backward', 'HTTP/1.1',
+                                  {'if-none-match': first.headers['ETag']}))
+    
+    assert response.status == 200
+    assert [item['name'] for item in json.loads(response.body)['items']] == ['Axial 500']
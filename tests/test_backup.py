@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+import backup
+
+
+def make_source(path, rows=200):
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, text TEXT)')
+    conn.executemany('INSERT INTO t (text) VALUES (?)', [('x' * 500,)] * rows)
+    return conn
+
+
+def edit_every_step(conn):
+    """A progress callback that commits an edit between every two steps"""
+    def progress(done, total):
+        conn.execute("INSERT INTO t (text) VALUES ('edit')")
+    return progress
+
+
+def count(path):
+    conn = sqlite3.connect(str(path))
+    try:
+        return conn.execute('SELECT COUNT(*) FROM t').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_copy_of_a_quiet_database_does_not_restart(tmp_path):
+    make_source(tmp_path / 'source.db').close()
+    
+    assert backup.copy_database(str(tmp_path / 'source.db'), str(tmp_path / 'copy.db'), pages=4) == 0
+    assert count(tmp_path / 'copy.db') == 200
+
+
+def test_constant_edits_end_in_one_short_pass(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, 'RESTART_BACKOFF', 0)
+    conn = make_source(tmp_path / 'source.db')
+    
+    restarts = backup.copy_database(str(tmp_path / 'source.db'), str(tmp_path / 'copy.db'),
+                                    pages=4, pause=0, progress=edit_every_step(conn))
+    
+    assert restarts == backup.MAX_RESTARTS + 1
+    assert count(tmp_path / 'copy.db') == count(tmp_path / 'source.db')
+    assert backup.verify_snapshot(str(tmp_path / 'copy.db')) == []
+    conn.close()
+
+
+def test_constant_edits_of_a_slow_copy_put_it_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, 'RESTART_BACKOFF', 0)
+    monkeypatch.setattr(backup, 'SINGLE_PASS_LIMIT', 0)
+    conn = make_source(tmp_path / 'source.db')
+    
+    with pytest.raises(backup.BackupBusy):
+        backup.copy_database(str(tmp_path / 'source.db'), str(tmp_path / 'copy.db'),
+                             pages=4, pause=0, progress=edit_every_step(conn))
+    conn.close()
+
+
+def test_scheduler_reports_failures_that_last(tmp_path, monkeypatch):
+    scheduler = backup.BackupScheduler(str(tmp_path / 'inventory.db'), interval=60)
+    now = [1000.0]
+    monkeypatch.setattr(backup.time, 'time', lambda: now[0])
+    
+    scheduler._failed(backup.BackupBusy('edited'))
+    assert scheduler.failure() is None
+    now[0] += 60
+    scheduler._failed(backup.BackupBusy('edited again'))
+    assert str(scheduler.failure()) == 'edited again'
+    
+    scheduler.last_error = scheduler.failing_since = None
+    scheduler._failed(OSError('disk full'))
+    assert isinstance(scheduler.failure(), OSError)
@@ -0,0 +1,55 @@
+import json
+
+from database import CHANGE_WATERMARK
+from migrate_to_web import export_delta
+
+
+def delta(db, tmp_path, target='web'):
+    path = tmp_path / 'delta.json'
+    assert export_delta(db.db_path, str(path), target)
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_deltas_hold_only_what_changed(db, tmp_path):
+    kept = db.add_fan('Fan A', None, None, 10.0, 12.0, 5)
+    sold = db.add_fan('Fan B', None, None, 20.0, 24.0, 5)
+    gone = db.add_sheet_metal('1mm', '1x2', 'm', 5.0, None)
+    first = delta(db, tmp_path)
+    assert [fan['id'] for fan in first['fans']] == [kept, sold]
+    
+    db.update_quantity(sold, -1)
+    db.delete_sheet_metal(gone)
+    added = db.add_flexible('hose', '100', 'x', 2.5)
+    second = delta(db, tmp_path)
+    assert [(fan['id'], fan['quantity']) for fan in second['fans']] == [(sold, 4)]
+    assert second['deleted']['sheet_metal'] == [gone]
+    assert [item['id'] for item in second['flexible']] == [added]
+    
+    third = delta(db, tmp_path)
+    assert third['fans'] == third['sheet_metal'] == third['flexible'] == []
+    assert third['deleted'] == {'fans': [], 'sheet_metal': [], 'flexible': []}
+
+
+def test_change_committed_after_the_export_read_is_not_lost(make_db):
+    db = make_db()
+    fan = db.add_fan('Fan A', None, None, 10.0, 12.0, 5)
+    other = make_db()  # A second program on the same database
+    since = db.get_replica_state()['seq']
+    
+    with other.transaction('fans') as conn:
+        conn.execute('UPDATE fans SET price_retail = 13.0, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                     (fan,))
+        # An export running now does not see the edit yet...
+        upto = db.get_replica_state()['seq']
+        assert list(db.iter_changed_records('fans', after_seq=since)) == []
+    
+    # ...and the next one, starting from where this one stopped, does
+    assert [record['id'] for record in db.iter_changed_records('fans', after_seq=upto)] == [fan]
+
+
+def test_watermark_is_a_change_number(db, tmp_path):
+    db.add_fan('Fan A', None, None, 10.0, 12.0, 5)
+    delta(db, tmp_path)
+    
+    assert db.get_sync_watermarks('web') == {CHANGE_WATERMARK: str(db.get_replica_state()['seq'])}
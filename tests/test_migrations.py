@@ -0,0 +1,126 @@
+import shutil
+import sqlite3
+import threading
+
+import database
+from database import MIGRATIONS, SCHEMA_VERSION, InventoryDB
+
+from conftest import BASELINE_DB
+
+
+def _tables(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+
+
+def _count(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_baseline_database_migrates_to_current_schema(tmp_path):
+    path = str(tmp_path / 'inventory.db')
+    shutil.copy(BASELINE_DB, path)
+    counts = {table: _count(path, table) for table in database.PRODUCT_TABLES}
+    steps = []
+    
+    db = InventoryDB(path, progress=lambda description, done, total: steps.append(description))
+    try:
+        assert db.schema_version == SCHEMA_VERSION
+        for _, description, _ in MIGRATIONS:
+            assert description in steps
+        assert {table: db.count(table) for table in database.PRODUCT_TABLES} == counts
+        # Existing rows start with their current prices and stock
+        for table in database.PRODUCT_TABLES:
+            assert len(db.get_prices_at(table, '9999-01-01 00:00:00')) == counts[table]
+        fan = db.query('fans', limit=1)[0]
+        assert db.get_quantity_at('fans', fan.id, '9999-01-01 00:00:00') == fan.quantity
+    finally:
+        db.close()
+    
+    tables = _tables(path)
+    for table in ('stock_movements', 'deleted_items', 'sync_state', 'catalog_index',
+                  'replica_state', 'row_versions', 'replica_counters', 'price_history'):
+        assert table in tables
+
+
+def test_up_to_date_database_is_left_alone(tmp_path):
+    path = str(tmp_path / 'inventory.db')
+    InventoryDB(path).close()
+    steps = []
+    db = InventoryDB(path, progress=lambda *args: steps.append(args))
+    try:
+        assert db.migrate() == SCHEMA_VERSION
+        assert steps == []
+    finally:
+        db.close()
+
+
+def test_legacy_table_layouts_are_rebuilt(tmp_path):
+    path = str(tmp_path / 'inventory.db')
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE sheet_metal (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, description TEXT,
+            thickness TEXT, dimensions TEXT, measurement TEXT, cost REAL NOT NULL, extra TEXT,
+            quantity INTEGER NOT NULL DEFAULT 0, created_at TIMESTAMP, updated_at TIMESTAMP);
+        INSERT INTO sheet_metal (name, thickness, dimensions, cost, quantity)
+            VALUES ('old', '1mm', '1x2', 5.5, 3);
+        CREATE TABLE flexible (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, description TEXT,
+            diameter TEXT, collection TEXT, meter REAL NOT NULL, quantity INTEGER,
+            created_at TIMESTAMP, updated_at TIMESTAMP);
+        INSERT INTO flexible (name, description, diameter, meter) VALUES ('old', 'hose', '100', 2.5);
+    ''')
+    conn.close()
+    
+    db = InventoryDB(path)
+    try:
+        sheet = db.get_sheet_metal_by_id(1)
+        assert (sheet.thickness, sheet.dimensions, sheet.cost, sheet.quantity) == ('1mm', '1x2', 5.5, 3)
+        flexible = db.get_flexible_by_id(1)
+        assert (flexible.description, flexible.diameter, flexible.meter) == ('hose', '100', 2.5)
+        assert len(db.search_sheet_metal('1x2')) == 1
+    finally:
+        db.close()
+
+
+def test_search_index_is_created_when_fts5_becomes_available(tmp_path, monkeypatch):
+    path = str(tmp_path / 'inventory.db')
+    monkeypatch.setattr(database, '_fts5_available', lambda: False)
+    db = InventoryDB(path)
+    db.add_fan('DA 10/10 Ripoll', None, None, 1.0, 2.0, 0)
+    assert db.schema_version == SCHEMA_VERSION
+    assert not db.fts_enabled
+    db.close()
+    assert 'fans_fts' not in _tables(path)
+    
+    monkeypatch.undo()
+    db = InventoryDB(path)
+    try:
+        assert db.fts_enabled
+        assert {'fans_fts', 'sheet_metal_fts', 'flexible_fts', 'catalog_index_fts'} <= _tables(path)
+        assert [fan.name for fan in db.query('fans', search='ripo')] == ['DA 10/10 Ripoll']
+    finally:
+        db.close()
+
+
+def test_stopped_migration_resumes_on_next_start(tmp_path):
+    path = str(tmp_path / 'inventory.db')
+    stop = threading.Event()
+    db = InventoryDB(path, auto_migrate=False)
+    try:
+        db.migrate(progress=lambda description, done, total: stop.set(), stop=stop)
+        assert db.schema_version == 1
+    finally:
+        db.close()
+    
+    db = InventoryDB(path)
+    try:
+        assert db.schema_version == SCHEMA_VERSION
+    finally:
+        db.close()
@@ -0,0 +1,181 @@
+import shutil
+
+import pytest
+
+from replicate import apply_changeset, export_changeset
+
+from conftest import BASELINE_DB
+
+
+@pytest.fixture
+def sites(make_db, tmp_path):
+    """A warehouse with two fans and a sheet, and a showroom copied from it"""
+    warehouse = make_db('warehouse.db')
+    fans = [warehouse.add_fan('Fan A', None, '100', 10.0, 12.0, 10),
+            warehouse.add_fan('Fan B', None, '200', 20.0, 24.0, 5)]
+    warehouse.add_sheet_metal('1mm', '1x2', 'm', 5.0, None)
+    warehouse.close()
+    shutil.copy(tmp_path / 'warehouse.db', tmp_path / 'showroom.db')
+    warehouse = make_db('warehouse.db')
+    showroom = make_db('showroom.db')
+    showroom.new_replica_site()
+    return warehouse, showroom, fans
+
+
+def sync(tmp_path, first, second):
+    """Send each site's changes to the other; returns the (first, second) apply stats"""
+    export_changeset(first, 'second', str(tmp_path / 'to_second.ndjson.gz'))
+    export_changeset(second, 'first', str(tmp_path / 'to_first.ndjson.gz'))
+    stats_second, _ = apply_changeset(second, str(tmp_path / 'to_second.ndjson.gz'))
+    stats_first, _ = apply_changeset(first, str(tmp_path / 'to_first.ndjson.gz'))
+    return stats_first, stats_second
+
+
+def fans_of(db):
+    return sorted((fan.name, fan.price_retail, fan.quantity) for fan in db.get_all_fans())
+
+
+def test_new_items_reach_the_other_site(sites, tmp_path):
+    warehouse, showroom, _ = sites
+    warehouse.add_fan('Fan W', None, None, 1.0, 2.0, 3)
+    showroom.add_flexible('hose', '100', 'x', 2.5)
+    
+    sync(tmp_path, warehouse, showroom)
+    
+    assert fans_of(warehouse) == fans_of(showroom)
+    assert 'Fan W' in [name for name, _, _ in fans_of(showroom)]
+    assert [f.description for f in warehouse.get_all_flexible()] == ['hose']
+
+
+def test_later_change_wins_on_both_sites(sites, tmp_path):
+    warehouse, showroom, (fan_a, _) = sites
+    warehouse.update_fan(fan_a, 'Fan A', None, '100', 10.0, 13.0, 10)
+    # Two edits at the showroom: its version of the row has the higher Lamport clock
+    showroom.update_fan(fan_a, 'Fan A', None, '100', 10.0, 14.0, 10)
+    showroom.update_fan(fan_a, 'Fan A', None, '100', 10.0, 15.0, 10)
+    
+    stats_warehouse, stats_showroom = sync(tmp_path, warehouse, showroom)
+    
+    assert warehouse.get_fan_by_id(fan_a).price_retail == 15.0
+    assert showroom.get_fan_by_id(fan_a).price_retail == 15.0
+    assert stats_warehouse['updated'] == 1
+    assert stats_showroom['conflicts'] == 1
+
+
+def test_equal_clocks_are_settled_the_same_way_on_both_sites(sites, tmp_path):
+    warehouse, showroom, (fan_a, _) = sites
+    warehouse.update_fan(fan_a, 'Fan A', None, '100', 10.0, 13.0, 10)
+    showroom.update_fan(fan_a, 'Fan A', None, '100', 10.0, 14.0, 10)
+    
+    sync(tmp_path, warehouse, showroom)
+    
+    assert warehouse.get_fan_by_id(fan_a).price_retail == showroom.get_fan_by_id(fan_a).price_retail
+    # The higher site id breaks the tie
+    winner = max((warehouse.get_replica_state()['site'], 13.0), (showroom.get_replica_state()['site'], 14.0))
+    assert warehouse.get_fan_by_id(fan_a).price_retail == winner[1]
+
+
+@pytest.mark.parametrize('deleting', ['warehouse', 'showroom'])
+def test_deletion_wins_over_a_concurrent_update(sites, tmp_path, deleting):
+    warehouse, showroom, (_, fan_b) = sites
+    deleter, editor = (warehouse, showroom) if deleting == 'warehouse' else (showroom, warehouse)
+    deleter.delete_fan(fan_b)
+    # More edits than the deleting site made changes: a deletion still wins
+    for price in (30.0, 31.0, 32.0):
+        editor.update_fan(fan_b, 'Fan B', None, '200', 20.0, price, 5)
+    
+    sync(tmp_path, warehouse, showroom)
+    
+    assert warehouse.get_fan_by_id(fan_b) is None
+    assert showroom.get_fan_by_id(fan_b) is None
+    assert fans_of(warehouse) == fans_of(showroom)
+
+
+def test_concurrent_sales_at_two_sites_add_up(sites, tmp_path):
+    warehouse, showroom, (fan_a, _) = sites
+    warehouse.update_quantity(fan_a, -1)
+    warehouse.update_quantity(fan_a, -2)
+    showroom.update_quantity(fan_a, -4)
+    showroom.update_quantity(fan_a, 1)
+    
+    sync(tmp_path, warehouse, showroom)
+    
+    # 10 - 3 at the warehouse - 3 at the showroom
+    assert warehouse.get_fan_by_id(fan_a).quantity == 4
+    assert showroom.get_fan_by_id(fan_a).quantity == 4
+    
+    # More sales after the first exchange are added on top, not overwritten
+    showroom.update_quantity(fan_a, -1)
+    sync(tmp_path, warehouse, showroom)
+    assert warehouse.get_fan_by_id(fan_a).quantity == 3
+    assert showroom.get_fan_by_id(fan_a).quantity == 3
+
+
+def test_stock_and_price_changes_of_one_item_both_survive(sites, tmp_path):
+    warehouse, showroom, (fan_a, _) = sites
+    warehouse.update_quantity(fan_a, -2)
+    showroom.update_fan(fan_a, 'Fan A', None, '100', 10.0, 19.0, 10)
+    showroom.update_fan(fan_a, 'Fan A', None, '100', 10.0, 20.0, 10)
+    
+    sync(tmp_path, warehouse, showroom)
+    
+    for db in (warehouse, showroom):
+        fan = db.get_fan_by_id(fan_a)
+        assert (fan.price_retail, fan.quantity) == (20.0, 8)
+
+
+def test_applying_a_changeset_again_changes_nothing(sites, tmp_path):
+    warehouse, showroom, (fan_a, _) = sites
+    warehouse.update_fan(fan_a, 'Fan A', None, '100', 10.0, 13.0, 10)
+    warehouse.update_quantity(fan_a, -1)
+    path = str(tmp_path / 'to_showroom.ndjson.gz')
+    export_changeset(warehouse, 'showroom', path)
+    
+    apply_changeset(showroom, path)
+    before = fans_of(showroom)
+    stats, _ = apply_changeset(showroom, path)
+    
+    assert fans_of(showroom) == before
+    assert stats['inserted'] == stats['updated'] == stats['deleted'] == stats['stock'] == 0
+
+
+def test_next_changeset_only_holds_new_changes(sites, tmp_path):
+    warehouse, showroom, (fan_a, _) = sites
+    warehouse.update_quantity(fan_a, -1)
+    first, _ = export_changeset(warehouse, 'showroom', str(tmp_path / 'one.ndjson.gz'))
+    second, _ = export_changeset(warehouse, 'showroom', str(tmp_path / 'two.ndjson.gz'))
+    
+    assert first > 0
+    assert second == 0
+
+
+def test_own_changeset_is_refused(sites, tmp_path):
+    warehouse, _, _ = sites
+    path = str(tmp_path / 'own.ndjson.gz')
+    export_changeset(warehouse, 'showroom', path, resend_all=True)
+    
+    with pytest.raises(ValueError):
+        apply_changeset(warehouse, path)
+
+
+def test_copies_upgraded_separately_share_their_existing_items(make_db, tmp_path):
+    # Both sites ran copies of the same pre-replication database and upgraded on their own
+    for name in ('warehouse.db', 'showroom.db'):
+        shutil.copy(BASELINE_DB, tmp_path / name)
+    warehouse, showroom = make_db('warehouse.db'), make_db('showroom.db')
+    assert warehouse.get_replica_state()['site'] != showroom.get_replica_state()['site']
+    fan = warehouse.query('fans', limit=1)[0]
+    count = warehouse.count('fans')
+    
+    warehouse.update_fan(fan.id, fan.name, 'edited', fan.airflow, fan.price_wholesale,
+                         fan.price_retail, fan.quantity)
+    warehouse.update_quantity(fan.id, 5)
+    showroom.update_quantity(fan.id, -1)
+    stats_warehouse, stats_showroom = sync(tmp_path, warehouse, showroom)
+    
+    assert stats_showroom['inserted'] == stats_warehouse['inserted'] == 0
+    assert (stats_showroom['updated'], stats_showroom['stock']) == (1, 1)
+    for db in (warehouse, showroom):
+        assert db.count('fans') == count
+        synced = db.get_fan_by_id(fan.id)
+        assert (synced.description, synced.quantity) == ('edited', max(fan.quantity + 5 - 1, 0))
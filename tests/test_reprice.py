@@ -0,0 +1,142 @@
+import pytest
+
+from replicate import apply_changeset, export_changeset
+
+
+@pytest.fixture
+def fans(db):
+    return [db.add_fan('DA 10/10', None, None, 100.0, 120.0, 1),
+            db.add_fan('DA 12/12', None, None, 33.33, 41.5, 1),
+            db.add_fan('Ripoll 400', None, None, 0.5, 9.99, 1)]
+
+
+def prices(db):
+    return [(fan.price_wholesale, fan.price_retail) for fan in db.get_all_fans()]
+
+
+def history_count(db):
+    return db.get_connection().execute('SELECT COUNT(*) FROM price_history').fetchone()[0]
+
+
+def test_dry_run_changes_nothing_and_matches_apply(db, fans):
+    before, history, seq = prices(db), history_count(db), db.get_replica_state()['seq']
+    
+    preview = db.reprice('fans', percent=10, dry_run=True)
+    
+    assert prices(db) == before
+    assert (history_count(db), db.get_replica_state()['seq']) == (history, seq)
+    assert (preview['matched'], preview['changed']) == (3, 3)
+    assert preview['totals']['price_retail'] == (171.49, 188.64)
+    item = preview['items'][0]
+    assert (item['name'], item['price_retail'], item['new_price_retail']) == ('DA 10/10', 120.0, 132.0)
+    
+    assert db.reprice('fans', percent=10) == {'changed': 3}
+    after = prices(db)
+    assert after == [(i['new_price_wholesale'], i['new_price_retail']) for i in preview['items']]
+    assert round(sum(retail for _, retail in after), 2) == preview['totals']['price_retail'][1]
+
+
+def test_prices_are_rounded_to_the_cent(db, fans):
+    db.reprice('fans', percent=3, columns=['price_retail'])
+    
+    assert [retail for _, retail in prices(db)] == [123.6, 42.75, 10.29]
+    # Only the chosen column changes
+    assert [wholesale for wholesale, _ in prices(db)] == [100.0, 33.33, 0.5]
+
+
+@pytest.mark.parametrize('rounding, expected', [
+    ('nearest', [120.0, 45.0, 10.0]),
+    ('up', [125.0, 45.0, 15.0]),
+    ('down', [120.0, 40.0, 10.0]),
+])
+def test_rounding_to_a_step(db, fans, rounding, expected):
+    preview = db.reprice('fans', amount=2, round_to=5, rounding=rounding,
+                         columns=['price_retail'], dry_run=True)
+    db.reprice('fans', amount=2, round_to=5, rounding=rounding, columns=['price_retail'])
+    
+    assert [retail for _, retail in prices(db)] == expected
+    assert preview['totals']['price_retail'][1] == sum(expected)
+
+
+def test_prices_already_on_a_step_stay_put(db):
+    db.add_fan('DA 10/10', None, None, 100.0, 120.0, 1)
+    
+    assert db.reprice('fans', round_to=10, rounding='up', dry_run=True)['changed'] == 0
+    assert db.reprice('fans', round_to=10, rounding='up') == {'changed': 0}
+
+
+def test_no_change_leaves_unrounded_prices_alone(db, fans):
+    db.get_connection().execute('UPDATE fans SET price_retail = 10.005 WHERE id = ?', (fans[2],))
+    before, history, seq = prices(db), history_count(db), db.get_replica_state()['seq']
+    
+    assert db.reprice('fans', dry_run=True)['changed'] == 0
+    assert db.reprice('fans') == {'changed': 0}
+    assert prices(db) == before
+    assert (history_count(db), db.get_replica_state()['seq']) == (history, seq)
+
+
+def test_prices_never_go_below_zero(db, fans):
+    db.reprice('fans', amount=-50, columns=['price_wholesale'])
+    
+    assert [wholesale for wholesale, _ in prices(db)] == [50.0, 0.0, 0.0]
+
+
+def test_search_and_ids_limit_the_items(db, fans):
+    assert db.reprice('fans', percent=10, search='DA', dry_run=True)['matched'] == 2
+    assert db.reprice('fans', percent=10, search='DA', item_ids=[fans[1], fans[2]]) == {'changed': 1}
+    
+    assert prices(db) == [(100.0, 120.0), (36.66, 45.65), (0.5, 9.99)]
+
+
+def test_each_change_is_recorded_in_the_price_history(db, fans):
+    history = history_count(db)
+    db.reprice('fans', percent=10, columns=['price_retail'], item_ids=[fans[0]])
+    
+    assert history_count(db) == history + 1
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'product_type': 'pumps'},
+    {'product_type': 'fans', 'columns': ['cost']},
+    {'product_type': 'fans', 'rounding': 'sideways'},
+    {'product_type': 'fans', 'percent': -100},
+    {'product_type': 'fans', 'percent': float('nan')},
+    {'product_type': 'fans', 'amount': '5'},
+    {'product_type': 'fans', 'round_to': -1},
+])
+def test_bad_arguments_are_rejected(db, fans, kwargs):
+    with pytest.raises(ValueError):
+        db.reprice(**kwargs)
+
+
+def test_triggers_are_back_after_repricing(db, fans):
+    db.reprice('fans', percent=10)
+    history = history_count(db)
+    seq = db.get_replica_state()['seq']
+    
+    db.update_fan(fans[0], 'DA 10/10', None, None, 100.0, 150.0, 1)
+    
+    assert history_count(db) == history + 1
+    assert db.get_replica_state()['seq'] == seq + 1
+
+
+def test_repriced_items_reach_other_sites(make_db, tmp_path, fans):
+    warehouse = make_db()
+    showroom = make_db('showroom.db')
+    path = str(tmp_path / 'changes.ndjson.gz')
+    export_changeset(warehouse, 'showroom', path, resend_all=True)
+    apply_changeset(showroom, path)
+    
+    warehouse.reprice('fans', percent=10, item_ids=fans[:2])
+    export_changeset(warehouse, 'showroom', path)
+    stats, _ = apply_changeset(showroom, path)
+    
+    assert stats['updated'] == 2
+    assert prices(showroom) == prices(warehouse) == [(110.0, 132.0), (36.66, 45.65), (0.5, 9.99)]
+
+
+def test_ids_without_sqlite_json_functions(db, fans, monkeypatch):
+    monkeypatch.setattr(db, '_json1', False)
+    
+    assert db.reprice('fans', percent=10, item_ids=[fans[1], fans[1], fans[2]]) == {'changed': 2}
+    assert prices(db)[0] == (100.0, 120.0)
@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+
+def test_quantity_changes_are_recorded(db):
+    fan = db.add_fan('DA 10/10', None, None, 100.0, 120.0, 5)
+    db.update_quantity(fan, -2)
+    db.update_quantities([(fan, 4)])
+    
+    movements = db.get_stock_movements('fans', fan)
+    assert [(m['change'], m['quantity_after']) for m in movements] == [(5, 5), (-2, 3), (4, 7)]
+    assert db.get_fan_by_id(fan).quantity == 7
+
+
+def test_quantity_never_goes_below_zero(db):
+    fan = db.add_fan('DA 10/10', None, None, 100.0, 120.0, 2)
+    db.update_quantity(fan, -5)
+    
+    assert db.get_fan_by_id(fan).quantity == 0
+    # The ledger records what was actually taken, so it adds up to the stock level
+    assert sum(m['change'] for m in db.get_stock_movements('fans', fan)) == 0
+
+
+def test_concurrent_sales_are_not_lost(make_db):
+    db = make_db()
+    fan = db.add_fan('DA 10/10', None, None, 100.0, 120.0, 1000)
+    
+    def sell():
+        for _ in range(50):
+            db.update_quantity(fan, -1)
+        db.release_connection()
+    
+    threads = [threading.Thread(target=sell) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert db.get_fan_by_id(fan).quantity == 800
+    assert len(db.get_stock_movements('fans', fan)) == 201
+
+
+def test_quantity_at_a_past_moment(db):
+    fan = db.add_fan('DA 10/10', None, None, 100.0, 120.0, 5)
+    db.get_connection().execute(
+        "UPDATE stock_movements SET created_at = '2024-01-01 00:00:00.000' WHERE item_id = ?", (fan,))
+    db.update_quantity(fan, -3)
+    
+    assert db.get_quantity_at('fans', fan, '2024-06-01 00:00:00') == 5
+    assert db.get_quantity_at('fans', fan, '2023-12-31 00:00:00') == 0
+    assert db.get_quantity_at('fans', fan, '9999-01-01 00:00:00') == 2
+
+
+def test_flexible_has_no_stock(db):
+    with pytest.raises(ValueError):
+        db.update_quantities([(1, 1)], product_type='flexible')
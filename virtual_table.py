@@ -0,0 +1,251 @@
+"""
+Virtualized rendering for ttk.Treeview.
+
+A Treeview with tens of thousands of rows is slow to fill and slow to clear,
+because every row is a Tk item. VirtualTreeview keeps the full list of rows in
+Python and only materializes the rows around the visible window (plus a
+buffer) as Tk items. The scrollbar is driven from the full row count, so
+scrolling looks the same as with a fully populated tree.
+
+Rows come either from a list (set_items) or from a paged source
+(set_source), e.g. InventoryDB.query, so only the pages around the visible
+window are ever fetched.
+
+Updates are diff-based: when the rows change (refresh, search, edit), only the
+materialized items whose iid, position or values changed are inserted, moved,
+updated or deleted.
+"""
+
+from collections import OrderedDict
+from tkinter import ttk
+
+PAGE_SIZE = 200       # Rows fetched per call to a paged source
+MAX_CACHED_PAGES = 20  # Pages kept in memory per table
+
+
+class VirtualTreeview:
+    def __init__(self, tree, scrollbar, format_row, row_id=None, buffer=50):
+        """
+        tree: the ttk.Treeview to render into
+        scrollbar: the vertical ttk.Scrollbar attached to the tree
+        format_row: item -> tuple of column values (only called for materialized rows)
+        row_id: item -> iid string (defaults to str(item['id']))
+        buffer: rows materialized above and below the visible window
+        """
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.format_row = format_row
+        self.row_id = row_id or (lambda item: str(item['id']))
+        self.buffer = buffer
+        
+        self.total = 0        # Number of rows in the source
+        self._fetch = None    # fetch(offset, limit) -> list of rows
+        self._pages = OrderedDict()  # page number -> rows (LRU)
+        self.offset = 0       # Index of the first visible row
+        self.start = 0        # Materialized window is rows[start:end]
+        self.end = 0
+        self._shown = {}      # iid -> values currently in the tree
+        self._selected = ()   # Selection survives rows scrolling out of the window
+        self._rendered_selection = ()
+        self._pending_render = None
+        
+        self.tree.configure(yscrollcommand=self._on_tree_scroll)
+        self.scrollbar.configure(command=self.yview)
+        self.tree.bind('<<TreeviewSelect>>', self._remember_selection, add='+')
+        self.tree.bind('<Configure>', lambda e: self._render(), add='+')
+    
+    def __len__(self):
+        return self.total
+    
+    def set_items(self, items):
+        """Show a list of rows, updating only the Tk rows that changed"""
+        items = list(items)
+        self.set_source(len(items), lambda offset, limit: items[offset:offset + limit])
+    
+    def set_source(self, total, fetch, first_page=None):
+        """Show total rows fetched on demand with fetch(offset, limit).
+        
+        first_page: rows 0..PAGE_SIZE-1 if the caller already has them
+        (e.g. fetched together with the count on a worker thread).
+        """
+        self.total = total
+        self._fetch = fetch
+        self._pages = OrderedDict()
+        if first_page is not None:
+            self._pages[0] = list(first_page)
+        self.offset = self._clamp(self.offset)
+        self._render()
+    
+    def clear(self):
+        """Remove all rows (e.g. before switching to a different set of columns)"""
+        self.total = 0
+        self._fetch = None
+        self._pages = OrderedDict()
+        self.offset = 0
+        self._selected = ()
+        self._render()
+    
+    def item(self, iid):
+        """Source row for a materialized iid (None if it is not materialized)"""
+        for row in self._rows(self.start, self.end):
+            if self.row_id(row) == iid:
+                return row
+        return None
+    
+    def see(self, iid):
+        """Scroll so the row with iid is visible (if it is in a fetched page)"""
+        for page, rows in self._pages.items():
+            for pos, row in enumerate(rows):
+                if self.row_id(row) == iid:
+                    index = page * PAGE_SIZE + pos
+                    break
+            else:
+                continue
+            break
+        else:
+            return
+        visible = self._visible_rows()
+        if not self.offset <= index < self.offset + visible:
+            self.offset = self._clamp(index - visible // 2)
+            self._render()
+        self.tree.see(iid)
+    
+    def _rows(self, start, end):
+        """Rows start..end-1, fetching missing pages from the source"""
+        rows = []
+        if end <= start:
+            return rows
+        for page in range(start // PAGE_SIZE, (end - 1) // PAGE_SIZE + 1):
+            page_rows = self._pages.get(page)
+            if page_rows is None:
+                page_rows = list(self._fetch(page * PAGE_SIZE, PAGE_SIZE))
+                self._pages[page] = page_rows
+                if len(self._pages) > MAX_CACHED_PAGES:
+                    self._pages.popitem(last=False)
+            else:
+                self._pages.move_to_end(page)
+            page_start = page * PAGE_SIZE
+            rows.extend(page_rows[max(0, start - page_start):end - page_start])
+        return rows
+    
+    def yview(self, *args):
+        """Scrollbar command: scroll over the full row list"""
+        visible = self._visible_rows()
+        if args and args[0] == 'moveto':
+            offset = int(float(args[1]) * self.total)
+        elif args and args[0] == 'scroll':
+            step = int(args[1])
+            offset = self.offset + (step * visible if args[2] == 'pages' else step)
+        else:
+            return
+        self.offset = self._clamp(offset)
+        
+        if self.start <= self.offset and self.offset + visible <= self.end:
+            # Still inside the materialized window: just move the tree's own view
+            self._move_tree_view()
+            self._update_scrollbar()
+        else:
+            self._render()
+    
+    def _visible_rows(self):
+        """Number of rows that fit in the tree's current height"""
+        style = ttk.Style(self.tree)
+        row_height = int(style.lookup('Treeview', 'rowheight') or 20)
+        rows = self.tree.winfo_height() // row_height
+        return max(int(self.tree.cget('height')), rows)
+    
+    def _clamp(self, offset):
+        return max(0, min(offset, self.total - self._visible_rows()))
+    
+    def _render(self):
+        """Materialize rows[start:end] around the current offset (diff against the tree)"""
+        if self._pending_render is not None:
+            self.tree.after_cancel(self._pending_render)
+            self._pending_render = None
+        
+        visible = self._visible_rows()
+        self.start = max(0, self.offset - self.buffer)
+        self.end = min(self.total, self.offset + visible + self.buffer)
+        rows = self._rows(self.start, self.end)
+        self.end = self.start + len(rows)  # The source may have shrunk since it was counted
+        wanted = [self.row_id(row) for row in rows]
+        wanted_set = set(wanted)
+        
+        # Delete rows that left the window (one Tk call)
+        current = self.tree.get_children()
+        stale = [iid for iid in current if iid not in wanted_set]
+        if stale:
+            self.tree.delete(*stale)
+            for iid in stale:
+                self._shown.pop(iid, None)
+        
+        # Walk the wanted order, inserting new rows and moving misplaced ones
+        remaining = [iid for iid in current if iid in wanted_set]
+        moved = set()
+        j = 0
+        for pos, iid in enumerate(wanted):
+            values = self.format_row(rows[pos])
+            while j < len(remaining) and remaining[j] in moved:
+                j += 1
+            if j < len(remaining) and remaining[j] == iid:
+                j += 1
+            elif iid in self._shown:
+                self.tree.move(iid, '', pos)
+                moved.add(iid)
+            else:
+                self.tree.insert('', pos, iid=iid, values=values)
+                self._shown[iid] = values
+                continue
+            if self._shown[iid] != values:
+                self.tree.item(iid, values=values)
+                self._shown[iid] = values
+        
+        # Restore the selection for rows that are materialized again
+        selection = tuple(iid for iid in self._selected if iid in wanted_set)
+        if selection != self.tree.selection():
+            self.tree.selection_set(selection)
+        self._rendered_selection = self.tree.selection()
+        
+        self._move_tree_view()
+        self._update_scrollbar()
+    
+    def _move_tree_view(self):
+        """Scroll the tree's own view so rows[offset] is the top row"""
+        count = self.end - self.start
+        if count:
+            self.tree.yview_moveto((self.offset - self.start) / count)
+    
+    def _update_scrollbar(self):
+        """Show the position of the visible rows within the full row list"""
+        total = self.total
+        if not total:
+            self.scrollbar.set(0, 1)
+            return
+        visible = self._visible_rows()
+        self.scrollbar.set(self.offset / total, min(1.0, (self.offset + visible) / total))
+    
+    def _on_tree_scroll(self, first, last):
+        """The tree scrolled itself (mouse wheel, arrow keys, see()): follow it"""
+        count = self.end - self.start
+        if not count:
+            self._update_scrollbar()
+            return
+        self.offset = self._clamp(self.start + int(round(float(first) * count)))
+        self._update_scrollbar()
+        
+        # Near an edge of the materialized window: slide the window once Tk is idle
+        margin = self.buffer // 4
+        visible = self._visible_rows()
+        near_top = self.start > 0 and self.offset - self.start < margin
+        near_bottom = (self.end < self.total
+                       and self.end - (self.offset + visible) < margin)
+        if (near_top or near_bottom) and self._pending_render is None:
+            self._pending_render = self.tree.after_idle(self._render)
+    
+    def _remember_selection(self, event=None):
+        """Record selection changes made by the user"""
+        selection = self.tree.selection()
+        if selection == self._rendered_selection:
+            return  # Caused by re-rendering (e.g. a selected row scrolled out)
+        self._selected = selection
+        self._rendered_selection = selection
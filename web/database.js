@@ -199,12 +199,34 @@ class Database {
         };
     }
 
-    // Import database (for restore)
+    // Import database (for restore); delta files are merged instead
     importData(data) {
+        if (data.type === 'delta') return this.mergeDelta(data);
         if (data.fans) this.saveAll('fans', data.fans);
         if (data.sheet_metal) this.saveAll('sheet_metal', data.sheet_metal);
         if (data.flexible) this.saveAll('flexible', data.flexible);
     }
+
+    // Merge an incremental export (migrate_to_web.py --delta): changed rows
+    // replace the item with the same id, deleted ids are removed
+    mergeDelta(delta) {
+        const summary = {};
+        ['fans', 'sheet_metal', 'flexible'].forEach(productType => {
+            const changed = delta[productType] || [];
+            const deleted = new Set((delta.deleted && delta.deleted[productType]) || []);
+            if (!changed.length && !deleted.size) {
+                summary[productType] = { changed: 0, deleted: 0 };
+                return;
+            }
+            const byId = new Map(this.getAll(productType).map(item => [item.id, item]));
+            changed.forEach(item => byId.set(item.id, item));
+            let removed = 0;
+            deleted.forEach(id => { if (byId.delete(id)) removed++; });
+            this.saveAll(productType, Array.from(byId.values()));
+            summary[productType] = { changed: changed.length, deleted: removed };
+        });
+        return summary;
+    }
 }
 
 // Initialize database